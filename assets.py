@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from typing import Dict, Tuple
+import brotli
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse, Response
+import compression
+import conditional
+
+# Static files, read and compressed once at startup and served from memory.
+# Every file is served under its own name and under a name carrying a hash
+# of its content (css/style.css also as css/style.3f2a9c1b04d5.css). The
+# templates link the hashed names through asset_url(), so a changed file
+# gets a new URL and hashed URLs can be cached for good. Brotli and gzip
+# versions are made at the highest levels, since that happens only once;
+# restart the server to pick up edited files.
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, no-cache"
+
+class Asset:
+    def __init__(self, path: str, body: bytes):
+        self.digest = hashlib.sha256(body).hexdigest()[:12]
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        # encoding -> (body, etag); an encoding is kept only where it is smaller
+        self.bodies = {None: (body, f'"{self.digest}"')}
+        compressed = {"br": brotli.compress(body, quality=11), "gzip": gzip.compress(body, 9, mtime=0)}
+        for encoding, encoded in compressed.items():
+            if len(encoded) < len(body):
+                self.bodies[encoding] = (encoded, f'"{self.digest}-{encoding}"')
+
+    def response(self, accept_encoding: str, if_none_match: str, cache_control: str) -> Response:
+        encoding = compression.choose_encoding(accept_encoding)
+        if encoding not in self.bodies:
+            encoding = None
+        body, etag = self.bodies[encoding]
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        if if_none_match and conditional.etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type=self.media_type, headers=headers)
+
+class StaticAssets:
+    """ASGI app serving the files under directory from memory"""
+
+    def __init__(self, directory: str, prefix: str):
+        self.directory = directory
+        self.prefix = prefix
+        self.assets: Dict[str, Tuple[Asset, str]] = {}   # served path -> (asset, Cache-Control)
+        self.hashed_paths: Dict[str, str] = {}
+        self.load()
+
+    def load(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                file_path = os.path.join(root, name)
+                path = os.path.relpath(file_path, self.directory).replace(os.sep, "/")
+                with open(file_path, "rb") as file:
+                    asset = Asset(path, file.read())
+                stem, extension = os.path.splitext(path)
+                hashed_path = f"{stem}.{asset.digest}{extension}"
+                self.assets[path] = (asset, REVALIDATE)
+                self.assets[hashed_path] = (asset, IMMUTABLE)
+                self.hashed_paths[path] = hashed_path
+
+    def url(self, path: str) -> str:
+        """URL of a static file under its content-hashed name"""
+        return f"{self.prefix}/{self.hashed_paths.get(path, path)}"
+
+    async def __call__(self, scope, receive, send):
+        entry = self.assets.get(scope["path"].lstrip("/"))
+        if scope["method"] not in ("GET", "HEAD"):
+            response = PlainTextResponse("Method Not Allowed", status_code=405)
+        elif entry is None:
+            response = PlainTextResponse("Not Found", status_code=404)
+        else:
+            asset, cache_control = entry
+            headers = Headers(scope=scope)
+            response = asset.response(
+                headers.get("accept-encoding", ""), headers.get("if-none-match"), cache_control
+            )
+        await response(scope, receive, send)
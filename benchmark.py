@@ -0,0 +1,819 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from datetime import datetime, timedelta
+
+# In-process endpoint benchmark. Drives every GET route of main.app, plus
+# the circulation write paths, through the ASGI app with httpx (no server,
+# no network) against a generated database, and records latency percentiles
+# and SQL statements per request to a JSON file that later runs can be
+# compared with. A 1k-row borrow page is also encoded outside HTTP both ways,
+# to measure serialization on its own, and bursts of concurrent logins
+# measure how many bcrypt verifications the password pool gets through:
+#
+#   python benchmark.py --scale 100k --output baseline.json
+#   python benchmark.py --scale 100k --compare baseline.json
+#
+# --mixed instead runs readers and circulation desk writers against the app
+# at once for a while, to compare the SQLite profiles under mixed load:
+#
+#   python benchmark.py --scale 100k --mixed --profile legacy
+#
+# --search times the FTS book search against the LIKE filter it replaced,
+# on catalogs of any size (--books):
+#
+#   python benchmark.py --database search-1m.db --scale 10k --books 1000000 --search
+#
+# --import ROWS times the CSV import of ROWS generated books and students:
+#
+#   python benchmark.py --scale 100k --import 100000
+#
+# --lookups times quick reads (single books and students, typeahead lookups)
+# on their own and then while the heavy reports run next to them, to check
+# that a report does not hold up everything else:
+#
+#   python benchmark.py --scale 100k --lookups
+#
+# --checkouts runs --writers circulation desks checking books out and back
+# in for --seconds, for the checkouts per second:
+#
+#   python benchmark.py --scale 100k --checkouts --writers 8
+#
+# --auth times what authenticating a request costs, with and without the
+# admin cache:
+#
+#   python benchmark.py --auth --repeat 1000
+#
+# --export streams the full borrows report as CSV and as NDJSON and records
+# rows per second and the peak RSS of the process:
+#
+#   python benchmark.py --scale 1m --export
+#
+# The database settings are read at import time, so main and database are
+# only imported once LIBRARY_DATABASE_URL points at the benchmark database.
+
+# Query parameters and bodies for the routes that need them to do real work
+ROUTE_REQUESTS = {
+    "GET /api/books/": {"params": {"search": "history", "limit": 20}},
+    "GET /api/students/": {"params": {"limit": 20}},
+    "GET /api/borrows/": {"params": {"limit": 20, "status": "active"}},
+    "GET /books": {"params": {"search": "data"}},
+    "GET /books/borrowed/": {"params": {"is_overdue": True}},
+    "GET /books/search/": {"json": {"search_query": "data"}},
+    "GET /reports/data": {"params": {"start_date": "{month_ago}"}},
+    "GET /reports/export": {"params": {"report_type": "borrows", "start_date": "{week_ago}"}},
+}
+
+# Extra cases for routes worth measuring with other parameters too, by name
+EXTRA_REQUESTS = {
+    # Serialization dominated: a thousand borrows with their books and students
+    "GET /api/borrows/ (1k rows)": ("/api/borrows/", {"params": {"limit": 1000}}),
+    "GET /api/borrows/ (1k rows, fast=true)": ("/api/borrows/", {"params": {"limit": 1000, "fast": True}}),
+}
+
+# What the readers of the mixed load cycle through
+MIXED_READS = [
+    ("/reports/data", {"params": {"start_date": "{month_ago}"}}),
+    ("/api/borrows/", {"params": {"limit": 20, "status": "active"}}),
+    ("/books", {"params": {"search": "data"}}),
+    ("/api/students/", {"params": {"limit": 20}}),
+]
+
+# The quick reads of --lookups, and the heavy reports run alongside them
+LOOKUP_READS = [
+    ("/api/books/{book_id}", {}),
+    ("/api/students/{student_id}", {}),
+    ("/api/lookup/students", {"params": {"q": "tan"}}),
+    ("/api/lookup/books", {"params": {"q": "data"}}),
+]
+HEAVY_REPORTS = [
+    ("/reports/export", {"params": {"report_type": "borrows"}}),
+    ("/reports/data", {}),
+]
+
+# Book searches for --search: common words, two words, a prefix, an author
+# and a word no book has
+SEARCH_TERMS = ["history", "data systems", "eco", "Tanaka", "zzyzx"]
+SEARCH_PAGE = 20
+
+def fill_request(spec, samples):
+    """httpx keyword arguments with {sample} placeholders filled in"""
+    spec = {key: dict(value) for key, value in spec.items()}
+    params = spec.get("params", {})
+    for key, value in params.items():
+        if isinstance(value, str):
+            params[key] = value.format(**samples)
+    return spec
+
+def route_request(name, samples):
+    return fill_request(ROUTE_REQUESTS.get(name, {}), samples)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def summarize(timings, queries, statuses):
+    timings = sorted(timings)
+    queries = sorted(queries)
+    return {
+        "requests": len(timings),
+        "status": {str(code): statuses.count(code) for code in sorted(set(statuses))},
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(timings, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+        "max_ms": round(timings[-1] * 1000, 3),
+        "requests_per_s": round(len(timings) / sum(timings), 1),
+        "queries": percentile(queries, 0.50),
+    }
+
+class Recorder:
+    """Counts SQL statements on the sync and async engines and times requests"""
+
+    def __init__(self, database):
+        from sqlalchemy import event
+        self.statements = 0
+        for engine in (database.engine, database.async_engine.sync_engine):
+            event.listen(engine, "before_cursor_execute", self._count)
+        self.results = {}
+
+    def _count(self, *args):
+        self.statements += 1
+
+    async def request(self, client, name, method, url, **kwargs):
+        statements = self.statements
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        await response.aread()
+        self.add(name, time.perf_counter() - start, self.statements - statements, response.status_code)
+        return response
+
+    def add(self, name, elapsed, statements, status=200):
+        timings, queries, statuses = self.results.setdefault(name, ([], [], []))
+        timings.append(elapsed)
+        queries.append(statements)
+        statuses.append(status)
+
+async def run_routes(app, recorder, samples, repeat, route_filter):
+    import httpx
+    from fastapi.routing import APIRoute
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        client.cookies.set("access_token", f"Bearer {samples['token']}")
+
+        def selected(name):
+            return not route_filter or route_filter in name
+
+        # Read routes; duplicate registrations are served by the first one
+        seen = set()
+        for route in app.routes:
+            if not isinstance(route, APIRoute) or "GET" not in route.methods:
+                continue
+            name = f"GET {route.path}"
+            if name in seen or not selected(name):
+                continue
+            seen.add(name)
+            spec = route_request(name, samples)
+            url = route.path.format(**samples)
+            await client.request("GET", url, **spec)  # warm up
+            for _ in range(repeat):
+                await recorder.request(client, name, "GET", url, **spec)
+        for name, (url, spec) in EXTRA_REQUESTS.items():
+            if selected(name):
+                await client.request("GET", url, **spec)
+                for _ in range(repeat):
+                    await recorder.request(client, name, "GET", url, **spec)
+
+        # Write paths: single checkout and return, then the batch endpoints.
+        # Every loan taken is given back, so runs can be repeated.
+        due = (datetime.utcnow() + timedelta(days=14)).isoformat()
+        pairs = samples["free_pairs"]
+        if selected("POST /api/borrows/") or selected("POST /api/borrows/{borrow_id}/return"):
+            for student_id, book_id in pairs[:repeat]:
+                response = await recorder.request(
+                    client, "POST /api/borrows/", "POST", "/api/borrows/",
+                    json={"student_id": student_id, "book_id": book_id, "due_date": due}
+                )
+                if response.status_code == 200:
+                    await recorder.request(
+                        client, "POST /api/borrows/{borrow_id}/return", "POST",
+                        f"/api/borrows/{response.json()['id']}/return"
+                    )
+        if selected("POST /api/borrows/batch") or selected("POST /api/borrows/batch-return"):
+            batch = [
+                {"student_id": student_id, "book_id": book_id, "due_date": due}
+                for student_id, book_id in pairs[:10]
+            ]
+            for _ in range(max(repeat // 5, 1)):
+                response = await recorder.request(
+                    client, "POST /api/borrows/batch", "POST", "/api/borrows/batch",
+                    json={"items": batch}
+                )
+                borrow_ids = [
+                    result["borrow"]["id"] for result in response.json()["results"] if result["success"]
+                ]
+                await recorder.request(
+                    client, "POST /api/borrows/batch-return", "POST", "/api/borrows/batch-return",
+                    json={"borrow_ids": borrow_ids}
+                )
+
+async def run_logins(app, recorder, username, password, logins, concurrency, hash_stats, route_filter):
+    """Send logins in bursts of `concurrency` at once; the logins per second
+    over the whole run and the mean wait for a password pool slot"""
+    import httpx
+
+    name = f"POST /login (x{concurrency} concurrent)"
+    if not logins or (route_filter and route_filter not in name):
+        return None
+    form = {"username": username, "password": password}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        await client.post("/login", data=form)  # warm up
+        completed, waited = hash_stats["completed"], hash_stats["queue_wait_seconds"]
+        start = time.perf_counter()
+        for burst in range(0, logins, concurrency):
+            await asyncio.gather(*[
+                recorder.request(client, name, "POST", "/login", data=form)
+                for _ in range(min(concurrency, logins - burst))
+            ])
+        elapsed = time.perf_counter() - start
+    hashes = hash_stats["completed"] - completed
+    return {
+        "route": name,
+        "concurrency": concurrency,
+        "logins": logins,
+        "logins_per_s": round(logins / elapsed, 1),
+        "mean_queue_wait_ms": round((hash_stats["queue_wait_seconds"] - waited) / max(hashes, 1) * 1000, 3),
+    }
+
+async def run_mixed(app, samples, readers, writers, seconds, busy_errors):
+    """Readers cycling through MIXED_READS and writers checking books out and
+    back in, all at once for `seconds`; throughput and latency of each side
+    and the statements that gave up waiting for a SQLite lock"""
+    import httpx
+
+    due = (datetime.utcnow() + timedelta(days=14)).isoformat()
+    reads, writes = ([], []), ([], [])    # timings, statuses
+    pairs = samples["free_pairs"]
+    if len(pairs) < writers:
+        sys.exit("Not enough free students and books for the writers")
+
+    async def timed(client, results, method, url, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        await response.aread()
+        results[0].append(time.perf_counter() - start)
+        results[1].append(response.status_code)
+        return response
+
+    async def reader(client, number):
+        while time.perf_counter() < stop_at:
+            url, spec = MIXED_READS[number % len(MIXED_READS)]
+            await timed(client, reads, "GET", url, **fill_request(spec, samples))
+            number += 1
+
+    async def writer(client, own_pairs):
+        number = 0
+        while time.perf_counter() < stop_at:
+            student_id, book_id = own_pairs[number % len(own_pairs)]
+            response = await timed(
+                client, writes, "POST", "/api/borrows/",
+                json={"student_id": student_id, "book_id": book_id, "due_date": due}
+            )
+            if response.status_code == 200:
+                await timed(client, writes, "POST", f"/api/borrows/{response.json()['id']}/return")
+            number += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        client.cookies.set("access_token", f"Bearer {samples['token']}")
+        for url, spec in MIXED_READS:
+            await client.get(url, **fill_request(spec, samples))  # warm up
+        busy = sum(busy_errors.values())
+        start = time.perf_counter()
+        stop_at = start + seconds
+        # Each writer works its own students and books, so writers only
+        # contend for the database, not for the same copies
+        await asyncio.gather(
+            *[reader(client, number) for number in range(readers)],
+            *[writer(client, pairs[number::writers]) for number in range(writers)]
+        )
+        elapsed = time.perf_counter() - start
+
+    results = {
+        "readers": readers,
+        "writers": writers,
+        "seconds": round(elapsed, 1),
+        "busy_errors": sum(busy_errors.values()) - busy,
+    }
+    for side, (timings, statuses) in (("reads", reads), ("writes", writes)):
+        if timings:
+            stats = summarize(timings, [], statuses)
+            # Requests overlap, so throughput comes from the wall clock
+            stats["requests_per_s"] = round(len(timings) / elapsed, 1)
+            del stats["queries"]
+            results[side] = stats
+    return results
+
+async def run_checkouts(app, database, models, samples, clients, seconds):
+    """clients checking books out and back in as fast as they can for
+    `seconds`, each on its own students and books; checkouts per second and
+    whether copies and loan counts still add up afterwards"""
+    import httpx
+    from sqlalchemy import func
+
+    due = (datetime.utcnow() + timedelta(days=14)).isoformat()
+    checkouts, returns = ([], []), ([], [])    # timings, statuses
+    pairs = samples["free_pairs"]
+    if len(pairs) < clients:
+        sys.exit("Not enough free students and books for the clients")
+
+    async def timed(client, results, url, **kwargs):
+        start = time.perf_counter()
+        response = await client.post(url, **kwargs)
+        await response.aread()
+        results[0].append(time.perf_counter() - start)
+        results[1].append(response.status_code)
+        return response
+
+    async def desk(client, own_pairs):
+        number = 0
+        while time.perf_counter() < stop_at:
+            student_id, book_id = own_pairs[number % len(own_pairs)]
+            response = await timed(
+                client, checkouts, "/api/borrows/", json={"student_id": student_id, "book_id": book_id, "due_date": due}
+            )
+            if response.status_code == 200:
+                await timed(client, returns, f"/api/borrows/{response.json()['id']}/return")
+            number += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        client.cookies.set("access_token", f"Bearer {samples['token']}")
+        start = time.perf_counter()
+        stop_at = start + seconds
+        await asyncio.gather(*[desk(client, pairs[number::clients]) for number in range(clients)])
+        elapsed = time.perf_counter() - start
+
+    book_ids = [book_id for _, book_id in pairs]
+    with database.SessionLocal() as db:
+        open_loans = dict(db.query(models.BorrowRecord.book_id, func.count(models.BorrowRecord.id)).filter(
+            models.BorrowRecord.book_id.in_(book_ids), models.BorrowRecord.return_date == None
+        ).group_by(models.BorrowRecord.book_id))
+        consistent = all(
+            book.quantity - book.available_quantity == open_loans.get(book.id, 0)
+            for book in db.query(models.Book).filter(models.Book.id.in_(book_ids))
+        )
+
+    stats = summarize(checkouts[0], [], checkouts[1])
+    return {
+        "clients": clients,
+        "seconds": round(elapsed, 1),
+        "checkouts_per_s": round(checkouts[1].count(200) / elapsed, 1),
+        "returns_per_s": round(returns[1].count(200) / elapsed, 1),
+        "checkout_p50_ms": stats["p50_ms"],
+        "checkout_p99_ms": stats["p99_ms"],
+        "refused": len(checkouts[1]) - checkouts[1].count(200),
+        "consistent": consistent,
+    }
+
+async def run_lookups(app, samples, readers, seconds):
+    """readers cycling through LOOKUP_READS for `seconds` on their own, then
+    again while one client per HEAVY_REPORTS entry runs its report over and
+    over; lookup latency of both phases and the reports finished"""
+    import httpx
+
+    async def timed(client, results, url, spec):
+        start = time.perf_counter()
+        response = await client.get(url, **fill_request(spec, samples))
+        await response.aread()
+        results[0].append(time.perf_counter() - start)
+        results[1].append(response.status_code)
+
+    async def loop(client, requests, results, number=0):
+        while time.perf_counter() < stop_at:
+            url, spec = requests[number % len(requests)]
+            await timed(client, results, url.format(**samples), spec)
+            number += 1
+
+    results = {"reports": {}}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        client.cookies.set("access_token", f"Bearer {samples['token']}")
+        for url, spec in LOOKUP_READS + HEAVY_REPORTS:
+            await client.get(url.format(**samples), **fill_request(spec, samples))  # warm up
+        for phase, reports in (("alone", []), ("with_reports", HEAVY_REPORTS)):
+            lookups = ([], [])    # timings, statuses
+            finished = {url: ([], []) for url, _ in reports}
+            stop_at = time.perf_counter() + seconds
+            await asyncio.gather(
+                *[loop(client, LOOKUP_READS, lookups, number) for number in range(readers)],
+                *[loop(client, [(url, spec)], finished[url]) for url, spec in reports]
+            )
+            stats = summarize(lookups[0], [], lookups[1])
+            stats["requests_per_s"] = round(len(lookups[0]) / seconds, 1)
+            del stats["queries"]
+            results[phase] = stats
+            for url, (timings, statuses) in finished.items():
+                results["reports"][url] = {
+                    "finished": len(timings),
+                    "mean_ms": round(sum(timings) / len(timings) * 1000, 1) if timings else None,
+                    "status": {str(code): statuses.count(code) for code in sorted(set(statuses))},
+                }
+    results["readers"] = readers
+    results["seconds"] = seconds
+    return results
+
+def like_book_search(query, models, term):
+    """The LIKE filter the FTS index replaced"""
+    from sqlalchemy import or_
+    pattern = f"%{term}%"
+    return query.where(or_(
+        models.Book.title.ilike(pattern),
+        models.Book.author.ilike(pattern),
+        models.Book.isbn.ilike(pattern)
+    ))
+
+def run_search(database, models, recorder, repeat):
+    """Time the first page of each SEARCH_TERMS search both ways"""
+    from sqlalchemy import select
+    import search as search_module
+
+    paths = (
+        ("fts", lambda query, term: search_module.apply_book_search(query, term)),
+        ("like", lambda query, term: like_book_search(query, models, term)),
+    )
+    with database.SessionLocal() as db:
+        for term in SEARCH_TERMS:
+            for path, apply in paths:
+                name = f"search {path}: {term}"
+                query = apply(select(models.Book), term).limit(SEARCH_PAGE)
+                db.execute(query).all()  # warm up
+                for _ in range(repeat):
+                    statements = recorder.statements
+                    start = time.perf_counter()
+                    db.execute(query).all()
+                    recorder.add(name, time.perf_counter() - start, recorder.statements - statements)
+                    db.expunge_all()
+
+async def run_auth(app_module, recorder, token, repeat):
+    """Time authenticating a request on its own: decoding the access token,
+    then finding the admin in admin_cache or, with the cache cleared, in
+    the database"""
+    from starlette.requests import Request
+
+    cookie = f'access_token="Bearer {token}"'.encode()
+
+    def request():
+        return Request({"type": "http", "headers": [(b"cookie", cookie)]})
+
+    async def decode():
+        assert app_module.get_token_payload(request())
+
+    async def cached():
+        assert await app_module.get_current_admin(request())
+
+    async def lookup():
+        app_module.admin_cache.clear()
+        assert await app_module.get_current_admin(request())
+
+    for name, case in (("auth: decode token", decode), ("auth: cached admin", cached), ("auth: admin lookup", lookup)):
+        await case()  # warm up
+        for _ in range(repeat):
+            statements = recorder.statements
+            start = time.perf_counter()
+            await case()
+            recorder.add(name, time.perf_counter() - start, recorder.statements - statements)
+
+def run_import(database, models, rows):
+    """Import rows generated books and students through importer.import_csv
+    and delete them again; the rows per second of each import"""
+    import importer
+
+    stamp = int(time.time())
+    imports = {
+        "books": (
+            "title,author,isbn,category,quantity", models.Book.isbn, f"imp-{stamp}-",
+            lambda number: f"Imported Title {number},Ima Writer,imp-{stamp}-{number},History,2"
+        ),
+        "students": (
+            "student_id,fullname,email,department,year_level", models.Student.student_id, f"IMP{stamp}-",
+            lambda number: f"IMP{stamp}-{number},Ima Student,imp.{stamp}.{number}@example.com,Science,2"
+        ),
+    }
+    results = {}
+    for kind, (header, key, prefix, make_row) in imports.items():
+        lines = itertools.chain([header], (make_row(number) for number in range(rows)))
+        with database.SessionLocal() as db:
+            start = time.perf_counter()
+            result = importer.import_csv(db, kind, lines)
+            elapsed = time.perf_counter() - start
+            db.query(key.class_).filter(key.like(f"{prefix}%")).delete(synchronize_session=False)
+            db.commit()
+        results[kind] = {
+            "rows": result.inserted,
+            "rejected": result.rejected,
+            "seconds": round(elapsed, 2),
+            "rows_per_s": round(result.inserted / elapsed),
+        }
+    return results
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def run_export(models, report_type="borrows"):
+    """Stream a whole report through export.stream_report in each format,
+    outside HTTP (the test transport would buffer the body); the rows per
+    second and the peak RSS after each"""
+    import export as export_module
+
+    results = {"rss_before_mb": peak_rss_mb()}
+    for export_format in export_module.EXPORT_FORMATS:
+        stmt = export_module.report_select(report_type, None, None)
+        rows = 0
+        size = 0
+        start = time.perf_counter()
+        for chunk in export_module.stream_report(stmt, export_format):
+            rows += chunk.count("\n")
+            size += len(chunk)
+        elapsed = time.perf_counter() - start
+        if export_format == "csv":
+            rows -= 1  # the header
+        results[export_format] = {
+            "rows": rows,
+            "mb": round(size / 2**20, 1),
+            "seconds": round(elapsed, 2),
+            "rows_per_s": round(rows / elapsed),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    return results
+
+def run_serialization(database, models, recorder, repeat, route_filter):
+    """Time reading and encoding a 1k-row borrow page outside HTTP: ORM
+    objects through pydantic and json.dumps as FastAPI does by default, and
+    Core rows through the fast JSON path"""
+    from typing import List
+    from pydantic import TypeAdapter
+    import fastjson
+    import main as app_module
+    import schemas
+
+    adapter = TypeAdapter(List[schemas.BorrowResponse])
+    limit = 1000
+
+    def default_path(db):
+        borrows = db.execute(app_module.borrow_records_select().order_by(models.BorrowRecord.id).limit(limit)).scalars().all()
+        content = adapter.dump_python(adapter.validate_python(borrows), mode="json")
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def fast_path(db):
+        rows = db.execute(fastjson.borrow_rows_select().order_by(models.BorrowRecord.id).limit(limit)).all()
+        return fastjson.FastJSONResponse(fastjson.borrow_payload(rows)).body
+
+    for name, encode in (("serialize borrows x1000: orm + pydantic", default_path),
+                         ("serialize borrows x1000: core + orjson", fast_path)):
+        if route_filter and route_filter not in name:
+            continue
+        with database.SessionLocal() as db:
+            encode(db)  # warm up
+            for _ in range(repeat):
+                statements = recorder.statements
+                start = time.perf_counter()
+                encode(db)
+                elapsed = time.perf_counter() - start
+                timings, queries, statuses = recorder.results.setdefault(name, ([], [], []))
+                timings.append(elapsed)
+                queries.append(recorder.statements - statements)
+                statuses.append(200)
+                db.expunge_all()
+
+def pick_samples(db, models, main, rng):
+    from sqlalchemy import func
+    admin = db.query(models.Admin).order_by(models.Admin.id).first()
+    if admin is None:
+        sys.exit("The benchmark database has no admin; seed it with --scale")
+    book_count = db.query(func.max(models.Book.id)).scalar()
+    student_count = db.query(func.max(models.Student.id)).scalar()
+    borrow_count = db.query(func.max(models.BorrowRecord.id)).scalar() or 1
+    # Students and books that can take a loan, for the write paths
+    students = [
+        student.id for student in db.query(models.Student).filter(
+            models.Student.is_active == True,
+            models.Student.active_borrow_count == 0
+        ).limit(200)
+    ]
+    books = [
+        book.id for book in db.query(models.Book).filter(
+            models.Book.available_quantity > 0
+        ).order_by(models.Book.id.desc()).limit(200)
+    ]
+    today = datetime.utcnow().date()
+    return {
+        "username": admin.username,
+        "token": main.create_access_token({"sub": admin.username}),
+        "book_id": rng.randint(1, book_count),
+        "student_id": rng.randint(1, student_count),
+        "borrow_id": rng.randint(max(borrow_count - 1000, 1), borrow_count),
+        "category": "Science",
+        "week_ago": (today - timedelta(days=7)).isoformat(),
+        "month_ago": (today - timedelta(days=30)).isoformat(),
+        "free_pairs": list(zip(students, books)),
+    }
+
+def print_table(routes, baseline=None):
+    print(f"{'route':<48} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'req/s':>8} {'queries':>8}")
+    for name, stats in routes.items():
+        line = (
+            f"{name:<48} {stats['p50_ms']:>9.2f} {stats['p90_ms']:>9.2f} {stats['p99_ms']:>9.2f}"
+            f" {stats['requests_per_s']:>8.1f} {stats['queries']:>8}"
+        )
+        old = (baseline or {}).get(name)
+        if old:
+            change = (stats["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0
+            line += f"   p50 {change:+.0f}% (was {old['p50_ms']:.2f}), queries was {old['queries']}"
+        print(line)
+
+def print_mixed(mixed, profile, baseline=None):
+    print(
+        f"mixed load, profile {profile}: {mixed['readers']} readers and {mixed['writers']} writers"
+        f" for {mixed['seconds']} s, {mixed['busy_errors']} statements gave up on a lock"
+    )
+    print(f"{'':<8} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}  status")
+    for side in ("reads", "writes"):
+        stats = mixed.get(side)
+        if not stats:
+            continue
+        line = (
+            f"{side:<8} {stats['requests_per_s']:>8.1f} {stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f}"
+            f" {stats['max_ms']:>9.2f}  {stats['status']}"
+        )
+        old = (baseline or {}).get(side)
+        if old:
+            line += f"   was {old['requests_per_s']:.1f} req/s, p99 {old['p99_ms']:.2f}"
+        print(line)
+
+def print_lookups(lookups, baseline=None):
+    print(f"{lookups['readers']} lookup clients, {lookups['seconds']} s per phase")
+    print(f"{'':<14} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}  status")
+    for phase in ("alone", "with_reports"):
+        stats = lookups[phase]
+        line = (
+            f"{phase:<14} {stats['requests_per_s']:>8.1f} {stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f}"
+            f" {stats['max_ms']:>9.2f}  {stats['status']}"
+        )
+        old = (baseline or {}).get(phase)
+        if old:
+            line += f"   was p99 {old['p99_ms']:.2f}"
+        print(line)
+    for url, report in lookups["reports"].items():
+        print(f"{url}: {report['finished']} finished alongside, {report['mean_ms']} ms each, {report['status']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the endpoints in-process against a generated database")
+    parser.add_argument("--database", default="benchmark.db", help="SQLite file to benchmark (default benchmark.db)")
+    parser.add_argument("--scale", default="10k", help="borrow records to generate if the database is empty (default 10k)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for the data and the sampled ids")
+    parser.add_argument("--repeat", type=int, default=20, help="requests per route (default 20)")
+    parser.add_argument("--routes", help="only run routes whose 'METHOD /path' contains this text")
+    parser.add_argument("--logins", type=int, default=24, help="logins for the login throughput run (default 24)")
+    parser.add_argument("--login-concurrency", type=int, default=8, help="logins sent at once (default 8)")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the results (default benchmark.json)")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--profile", help="SQLite profile from database.SQLITE_PROFILES (default LIBRARY_DB_PROFILE or balanced)")
+    parser.add_argument("--books", type=int, help="catalog size to generate (default a tenth of the borrows, at most 500k)")
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument("--mixed", action="store_true", help="run the mixed read/write load instead of the routes")
+    modes.add_argument("--search", action="store_true", help="time the FTS book search against LIKE instead of the routes")
+    modes.add_argument("--lookups", action="store_true", help="time quick lookups alone and next to heavy reports instead of the routes")
+    modes.add_argument("--checkouts", action="store_true", help="run --writers desks checking books out and in instead of the routes")
+    modes.add_argument("--auth", action="store_true", help="time authenticating a request instead of the routes")
+    modes.add_argument("--export", action="store_true", help="time streaming the full borrows report instead of the routes")
+    modes.add_argument("--import", dest="import_rows", type=int, metavar="ROWS", help="time importing ROWS generated books and students instead of the routes")
+    parser.add_argument("--readers", type=int, default=8, help="concurrent readers of the mixed load or lookups (default 8)")
+    parser.add_argument("--writers", type=int, default=2, help="concurrent writers of the mixed load or checkout desks (default 2)")
+    parser.add_argument("--seconds", type=float, default=10, help="how long the mixed load, each lookup phase or the checkouts run (default 10)")
+    args = parser.parse_args()
+
+    os.environ["LIBRARY_DATABASE_URL"] = f"sqlite:///{args.database}"
+    if args.profile:
+        os.environ["LIBRARY_DB_PROFILE"] = args.profile
+    try:
+        import database
+    except ValueError as error:
+        parser.error(str(error))
+    import datagen
+    import main as app_module
+    import metrics
+    import models
+
+    with database.SessionLocal() as db:
+        if db.query(models.Book.id).first() is None:
+            borrows = datagen.SCALES.get(args.scale) or int(args.scale)
+            print(f"Generating {borrows} borrow records into {args.database}", file=sys.stderr)
+            datagen.generate(db, borrows, seed=args.seed, books=args.books)
+        rows = {
+            "students": db.query(models.Student).count(),
+            "books": db.query(models.Book).count(),
+            "borrows": db.query(models.BorrowRecord).count(),
+        }
+        samples = pick_samples(db, models, app_module, random.Random(args.seed))
+
+    profile = os.getenv("LIBRARY_DB_PROFILE", database.DEFAULT_SQLITE_PROFILE)
+    results = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "database": args.database,
+            "profile": profile,
+            "rows": rows,
+            "repeat": args.repeat,
+        },
+    }
+    if args.mixed:
+        results["mixed"] = asyncio.run(run_mixed(
+            app_module.app, samples, args.readers, args.writers, args.seconds, metrics.sqlite_errors.busy
+        ))
+    elif args.lookups:
+        results["lookups"] = asyncio.run(run_lookups(app_module.app, samples, args.readers, args.seconds))
+    elif args.checkouts:
+        results["checkouts"] = asyncio.run(run_checkouts(
+            app_module.app, database, models, samples, args.writers, args.seconds
+        ))
+    elif args.export:
+        results["export"] = run_export(models)
+    elif args.import_rows:
+        results["import"] = run_import(database, models, args.import_rows)
+    else:
+        recorder = Recorder(database)
+        logins = None
+        if args.search:
+            run_search(database, models, recorder, args.repeat)
+        elif args.auth:
+            asyncio.run(run_auth(app_module, recorder, samples["token"], args.repeat))
+        else:
+            asyncio.run(run_routes(app_module.app, recorder, samples, args.repeat, args.routes))
+            run_serialization(database, models, recorder, args.repeat, args.routes)
+            logins = asyncio.run(run_logins(
+                app_module.app, recorder, samples["username"], datagen.ADMIN_PASSWORD,
+                args.logins, args.login_concurrency, app_module.password_hash_stats, args.routes
+            ))
+        routes = {name: summarize(*values) for name, values in recorder.results.items()}
+        if logins:
+            # Requests overlap, so throughput comes from the wall clock
+            routes[logins["route"]]["requests_per_s"] = logins["logins_per_s"]
+        results["routes"] = routes
+        results["logins"] = logins
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    if args.mixed:
+        print_mixed(results["mixed"], profile, baseline.get("mixed"))
+    elif args.lookups:
+        print_lookups(results["lookups"], baseline.get("lookups"))
+    elif args.checkouts:
+        checkouts = results["checkouts"]
+        print(
+            f"checkouts: {checkouts['checkouts_per_s']} per second with {checkouts['clients']} desks"
+            f" (p50 {checkouts['checkout_p50_ms']} ms, p99 {checkouts['checkout_p99_ms']} ms),"
+            f" returns: {checkouts['returns_per_s']} per second, refused: {checkouts['refused']},"
+            f" copies and loans add up: {checkouts['consistent']}"
+        )
+    elif args.export:
+        export = results["export"]
+        print(f"peak RSS before exporting: {export['rss_before_mb']} MB")
+        for export_format in ("csv", "ndjson"):
+            stats = export[export_format]
+            print(
+                f"export {export_format}: {stats['rows']} rows ({stats['mb']} MB) in {stats['seconds']} s,"
+                f" {stats['rows_per_s']} rows/s, peak RSS {stats['peak_rss_mb']} MB"
+            )
+    elif args.import_rows:
+        for kind, stats in results["import"].items():
+            print(f"import {kind}: {stats['rows']} rows in {stats['seconds']} s, {stats['rows_per_s']} rows/s")
+    else:
+        print_table(results["routes"], baseline.get("routes"))
+        if results["logins"]:
+            logins = results["logins"]
+            print(
+                f"logins: {logins['logins_per_s']} per second with {logins['concurrency']} at once,"
+                f" {logins['mean_queue_wait_ms']} ms mean wait for a password hashing slot"
+            )
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
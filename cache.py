@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import threading
+import time
+from sqlalchemy import event, inspect
+
+_MISSING = object()
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries also expire after ttl seconds"""
+
+    def __init__(self, maxsize: int = 128, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or entry[0] < time.monotonic():
+                if entry is not _MISSING:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class TableVersions:
+    """Write counters per table, bumped when a session commits a change to it.
+
+    A cache keyed by get(...) of the tables a value was computed from misses
+    as soon as one of them is written. Only writes made through sessions of
+    this process are seen, so such caches should still have a TTL.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, *tables) -> tuple:
+        return tuple(self._versions.get(table, 0) for table in tables)
+
+    def bump(self, tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def track(self, session_class):
+        """Bump the tables written by every session of session_class on commit"""
+        def written(session) -> set:
+            return session.info.setdefault("written_tables", set())
+
+        @event.listens_for(session_class, "after_flush")
+        def note_flushed(session, flush_context):
+            written(session).update(
+                inspect(instance).mapper.local_table.name
+                for instance in (*session.new, *session.dirty, *session.deleted)
+            )
+
+        @event.listens_for(session_class, "do_orm_execute")
+        def note_statement(orm_execute_state):
+            if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+                written(orm_execute_state.session).add(orm_execute_state.statement.table.name)
+
+        @event.listens_for(session_class, "after_commit")
+        def bump_written(session):
+            self.bump(session.info.pop("written_tables", ()))
+
+        @event.listens_for(session_class, "after_rollback")
+        def forget_written(session):
+            session.info.pop("written_tables", None)
@@ -0,0 +1,340 @@
+from collections import Counter
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import and_, case, delete, func, literal, or_, select, update, Date
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+import models
+
+def _open_borrows_of_student():
+    return and_(
+        models.BorrowRecord.student_id == models.Student.id,
+        models.BorrowRecord.return_date == None
+    )
+
+def sync_student_circulation(db: Session, student_ids: Optional[Iterable[int]] = None) -> int:
+    """Recompute active_borrow_count and earliest_open_due_date from borrow_records.
+
+    Runs as a single UPDATE inside the caller's transaction, so it can be
+    issued right after a borrow or return and committed together with it.
+    With no student_ids every student is rebuilt.
+    """
+    db.flush()
+    stmt = update(models.Student).values(
+        active_borrow_count=select(func.count(models.BorrowRecord.id))
+            .where(_open_borrows_of_student())
+            .scalar_subquery(),
+        earliest_open_due_date=select(func.min(models.BorrowRecord.due_date))
+            .where(_open_borrows_of_student())
+            .scalar_subquery()
+    )
+    if student_ids is not None:
+        stmt = stmt.where(models.Student.id.in_(list(student_ids)))
+    result = db.execute(stmt, execution_options={"synchronize_session": "fetch"})
+    return result.rowcount
+
+def student_circulation_missing(db: Session) -> bool:
+    """True if some open loan is not counted on its student.
+
+    That is the state right after the counter columns are added to an
+    existing database. Checking for it only reads the open loans, so it is
+    cheap enough to run at every startup.
+    """
+    return db.execute(
+        select(literal(1)).select_from(models.BorrowRecord)
+        .join(models.Student, models.Student.id == models.BorrowRecord.student_id)
+        .where(models.BorrowRecord.return_date == None, models.Student.active_borrow_count == 0)
+        .limit(1)
+    ).first() is not None
+
+# Checkout and return go through conditional UPDATEs instead of reading the
+# counters in Python and writing them back, so desks working at the same time
+# cannot oversell a book or push a student past their limit. The first UPDATE
+# also takes SQLite's write lock, which keeps the rest of the checkout
+# transaction serialized with other writers.
+
+def take_copy(db: Session, book_id: int) -> bool:
+    """Take one available copy of a book; False if none is left"""
+    result = db.execute(
+        update(models.Book).where(
+            models.Book.id == book_id,
+            models.Book.available_quantity > 0
+        ).values(available_quantity=models.Book.available_quantity - 1),
+        execution_options={"synchronize_session": "fetch"}
+    )
+    return result.rowcount == 1
+
+def return_copy(db: Session, book_id: int):
+    db.execute(
+        update(models.Book).where(models.Book.id == book_id)
+        .values(available_quantity=models.Book.available_quantity + 1),
+        execution_options={"synchronize_session": "fetch"}
+    )
+
+def take_borrow_slot(db: Session, student_id: int, limit: int) -> bool:
+    """Count one more active borrow for a student unless they are at limit.
+
+    record_borrow() recomputes the exact count from borrow_records afterwards.
+    """
+    result = db.execute(
+        update(models.Student).where(
+            models.Student.id == student_id,
+            models.Student.active_borrow_count < limit
+        ).values(active_borrow_count=models.Student.active_borrow_count + 1),
+        execution_options={"synchronize_session": "fetch"}
+    )
+    return result.rowcount == 1
+
+def close_loan(db: Session, borrow: models.BorrowRecord) -> bool:
+    """Set the return date of an open borrow record; False if it was already returned"""
+    result = db.execute(
+        update(models.BorrowRecord).where(
+            models.BorrowRecord.id == borrow.id,
+            models.BorrowRecord.return_date == None
+        ).values(return_date=datetime.utcnow()),
+        execution_options={"synchronize_session": "fetch"}
+    )
+    return result.rowcount == 1
+
+# Set-based versions for the batch endpoints: one UPDATE for any number of
+# books, students or loans, returning the ids that passed the guard.
+
+def take_copies(db: Session, wanted: Dict[int, int]) -> Set[int]:
+    """Take wanted[book_id] copies of each book; returns the ids of the books that had enough left"""
+    if not wanted:
+        return set()
+    count = case(wanted, value=models.Book.id)
+    rows = db.execute(
+        update(models.Book).where(
+            models.Book.id.in_(list(wanted)),
+            models.Book.available_quantity >= count
+        ).values(available_quantity=models.Book.available_quantity - count)
+        .returning(models.Book.id),
+        execution_options={"synchronize_session": "fetch"}
+    )
+    return set(rows.scalars())
+
+def return_copies(db: Session, counts: Dict[int, int]):
+    if not counts:
+        return
+    count = case(counts, value=models.Book.id)
+    db.execute(
+        update(models.Book).where(models.Book.id.in_(list(counts)))
+        .values(available_quantity=models.Book.available_quantity + count),
+        execution_options={"synchronize_session": "fetch"}
+    )
+
+def take_borrow_slots(db: Session, wanted: Dict[int, int], limit: int) -> Set[int]:
+    """Count wanted[student_id] more active borrows for each student that stays within limit"""
+    if not wanted:
+        return set()
+    count = case(wanted, value=models.Student.id)
+    rows = db.execute(
+        update(models.Student).where(
+            models.Student.id.in_(list(wanted)),
+            models.Student.active_borrow_count + count <= limit
+        ).values(active_borrow_count=models.Student.active_borrow_count + count)
+        .returning(models.Student.id),
+        execution_options={"synchronize_session": "fetch"}
+    )
+    return set(rows.scalars())
+
+def close_loans(db: Session, borrow_ids: Iterable[int]) -> Set[int]:
+    """Set the return date of the open borrow records among borrow_ids; returns their ids"""
+    borrow_ids = list(borrow_ids)
+    if not borrow_ids:
+        return set()
+    rows = db.execute(
+        update(models.BorrowRecord).where(
+            models.BorrowRecord.id.in_(borrow_ids),
+            models.BorrowRecord.return_date == None
+        ).values(return_date=datetime.utcnow())
+        .returning(models.BorrowRecord.id),
+        execution_options={"synchronize_session": "fetch"}
+    )
+    return set(rows.scalars())
+
+# daily_circulation holds one row per (day, category, department) with the
+# borrows, returns and overdue transitions of that day. The handlers keep it
+# up to date in the same transaction as the borrow record change, so the trend
+# charts read O(days) rows instead of grouping the whole borrow_records table.
+#
+# A loan counts one borrow on its borrow day, one return on its return day and
+# one overdue transition on its due day unless it came back on time. Open loans
+# therefore already count a transition on their (possibly future) due day,
+# which a return before the due date takes back.
+
+ROLLUP_COUNTS = ("borrows", "returns", "overdue_transitions")
+
+LoanState = Tuple[Optional[datetime], Optional[datetime], Optional[datetime]]
+
+def loan_state(borrow: models.BorrowRecord) -> LoanState:
+    """(borrow_date, due_date, return_date) of a borrow record"""
+    return (borrow.borrow_date, borrow.due_date, borrow.return_date)
+
+def _loan_counts(state: Optional[LoanState]) -> Counter:
+    counts = Counter()
+    if state is None:
+        return counts
+    borrow_date, due_date, return_date = state
+    if borrow_date:
+        counts[(borrow_date.date(), "borrows")] += 1
+    if return_date:
+        counts[(return_date.date(), "returns")] += 1
+    if due_date and (return_date is None or return_date > due_date):
+        counts[(due_date.date(), "overdue_transitions")] += 1
+    return counts
+
+def _upsert_daily_counts():
+    stmt = insert(models.DailyCirculation)
+    return stmt.on_conflict_do_update(
+        index_elements=["date", "category", "department"],
+        set_={
+            name: getattr(models.DailyCirculation, name) + getattr(stmt.excluded, name)
+            for name in ROLLUP_COUNTS
+        }
+    )
+
+def update_daily_circulation(
+    db: Session,
+    borrow_id: int,
+    before: Optional[LoanState] = None,
+    after: Optional[LoanState] = None
+):
+    """Apply the rollup change of a borrow record going from state before to after.
+
+    before=None is a new record, after=None a deleted one. The book category
+    and student department come from the database in the same statement, so
+    this must run while the borrow record row still exists.
+    """
+    deltas = _loan_counts(after)
+    deltas.subtract(_loan_counts(before))
+    days = {}
+    for (day, name), delta in deltas.items():
+        if delta:
+            days.setdefault(day, dict.fromkeys(ROLLUP_COUNTS, 0))[name] = delta
+    if not days:
+        return
+    db.flush()
+    for day, counts in days.items():
+        rows = select(
+            literal(day, Date),
+            models.Book.category,
+            models.Student.department,
+            *[literal(counts[name]) for name in ROLLUP_COUNTS]
+        ).select_from(models.BorrowRecord).join(
+            models.Book, models.Book.id == models.BorrowRecord.book_id
+        ).join(
+            models.Student, models.Student.id == models.BorrowRecord.student_id
+        ).where(
+            models.BorrowRecord.id == borrow_id,
+            models.Book.category != None,
+            models.Student.department != None
+        )
+        db.execute(_upsert_daily_counts().from_select(
+            ["date", "category", "department", *ROLLUP_COUNTS], rows
+        ))
+
+def _add_daily_counts(db: Session, deltas: Counter):
+    """Upsert rollup deltas keyed by (day, category, department, count name) in one executemany"""
+    rows = {}
+    for (day, category, department, name), delta in deltas.items():
+        if delta and category is not None and department is not None:
+            row = rows.setdefault((day, category, department), {
+                "date": day, "category": category, "department": department,
+                **dict.fromkeys(ROLLUP_COUNTS, 0)
+            })
+            row[name] = delta
+    if rows:
+        db.execute(_upsert_daily_counts(), list(rows.values()))
+
+def _batch_daily_counts(borrows: List[models.BorrowRecord], returned: bool) -> Counter:
+    deltas = Counter()
+    for borrow in borrows:
+        counts = _loan_counts(loan_state(borrow))
+        if returned:
+            counts.subtract(_loan_counts((borrow.borrow_date, borrow.due_date, None)))
+        for (day, name), delta in counts.items():
+            deltas[(day, borrow.book.category, borrow.student.department, name)] += delta
+    return deltas
+
+def record_borrows(db: Session, borrows: List[models.BorrowRecord]):
+    """Batch counterpart of record_borrow; the records need book and student loaded"""
+    if not borrows:
+        return
+    sync_student_circulation(db, {borrow.student_id for borrow in borrows})
+    _add_daily_counts(db, _batch_daily_counts(borrows, returned=False))
+
+def record_returns(db: Session, borrows: List[models.BorrowRecord]):
+    """Batch counterpart of record_return; the records need book and student loaded"""
+    if not borrows:
+        return
+    sync_student_circulation(db, {borrow.student_id for borrow in borrows})
+    _add_daily_counts(db, _batch_daily_counts(borrows, returned=True))
+
+def record_borrow(db: Session, borrow: models.BorrowRecord):
+    """Update the student counters and the rollup for a newly added borrow record"""
+    sync_student_circulation(db, [borrow.student_id])
+    update_daily_circulation(db, borrow.id, after=loan_state(borrow))
+
+def record_return(db: Session, borrow: models.BorrowRecord):
+    """Update the student counters and the rollup for a borrow record just returned"""
+    sync_student_circulation(db, [borrow.student_id])
+    update_daily_circulation(
+        db, borrow.id,
+        before=(borrow.borrow_date, borrow.due_date, None),
+        after=loan_state(borrow)
+    )
+
+def backfill_daily_circulation(db: Session) -> int:
+    """Rebuild daily_circulation from borrow_records; returns the number of rows written"""
+    book = models.Book
+    student = models.Student
+    record = models.BorrowRecord
+    day_counts = {}
+
+    def add_counts(name, day_column, *conditions):
+        day = func.date(day_column)
+        rows = db.query(
+            day, book.category, student.department, func.count(record.id)
+        ).join(book, book.id == record.book_id).join(
+            student, student.id == record.student_id
+        ).filter(
+            day_column != None,
+            book.category != None,
+            student.department != None,
+            *conditions
+        ).group_by(day, book.category, student.department)
+        for day_value, category, department, count in rows:
+            key = (date.fromisoformat(day_value), category, department)
+            day_counts.setdefault(key, dict.fromkeys(ROLLUP_COUNTS, 0))[name] = count
+
+    add_counts("borrows", record.borrow_date)
+    add_counts("returns", record.return_date)
+    add_counts(
+        "overdue_transitions", record.due_date,
+        or_(record.return_date == None, record.return_date > record.due_date)
+    )
+
+    db.execute(delete(models.DailyCirculation))
+    if day_counts:
+        db.execute(insert(models.DailyCirculation), [
+            {"date": day, "category": category, "department": department, **counts}
+            for (day, category, department), counts in day_counts.items()
+        ])
+    return len(day_counts)
+
+def daily_borrow_counts(db: Session, start: Optional[date] = None, end: Optional[date] = None):
+    """(date, borrows) per day with borrows from the rollup, oldest first.
+
+    start and end are inclusive days.
+    """
+    day = models.DailyCirculation.date
+    query = db.query(
+        day, func.sum(models.DailyCirculation.borrows).label("borrows")
+    ).group_by(day).having(func.sum(models.DailyCirculation.borrows) > 0).order_by(day)
+    if start:
+        query = query.filter(day >= start)
+    if end:
+        query = query.filter(day <= end)
+    return query.all()
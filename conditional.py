@@ -0,0 +1,88 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+from fastapi import Request, Response
+from sqlalchemy import column, func, select, table
+import models
+
+# Conditional GET for the JSON API. Single books and students are validated
+# by their updated_at, as a strong ETag and a Last-Modified date. The list
+# endpoints are validated by the table_versions counters of the tables they
+# read (see counts.py), so a list is only sent again after a write to one of
+# them. A request whose If-None-Match (or, without one, If-Modified-Since)
+# still matches gets an empty 304 before the body is loaded or serialized.
+#
+# Responses carry Cache-Control: no-cache, so browsers keep them but check
+# back on every use instead of reusing them for a guessed lifetime.
+
+CACHE_CONTROL = "private, no-cache"
+
+_table_versions = table("table_versions", column("table_name"), column("version"))
+
+def make_etag(*parts) -> str:
+    digest = hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+def row_etag(kind: str, row_id: int, updated_at: Optional[datetime]) -> str:
+    return make_etag(kind, row_id, updated_at.isoformat() if updated_at else "")
+
+def list_validators_select(tables: tuple, due_dates: bool = False):
+    """One row with the versions of tables, for the ETag of a list reading them.
+
+    Lists that show or filter on whether loans are overdue change with time
+    as well; with due_dates the row also has the next due date of an open
+    loan, which passes exactly when the next loan turns overdue.
+    """
+    columns = [
+        select(_table_versions.c.version).where(_table_versions.c.table_name == name).scalar_subquery()
+        for name in tables
+    ]
+    if due_dates:
+        record = models.BorrowRecord
+        columns.append(
+            select(func.min(record.due_date))
+            .where(record.return_date == None, record.due_date >= datetime.utcnow())
+            .scalar_subquery()
+        )
+    return select(*columns)
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+def etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match compares weakly: W/"x" matches "x"
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+def _not_modified_since(header: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+def set_validators(response: Response, etag: str, last_modified: Optional[datetime] = None):
+    response.headers["ETag"] = etag
+    if last_modified is not None:
+        response.headers["Last-Modified"] = http_date(last_modified)
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> Optional[Response]:
+    """An empty 304 response if the client's copy is still current, else None"""
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match is not None:
+        current = etag_matches(if_none_match, etag)
+    elif if_modified_since is not None and last_modified is not None:
+        current = _not_modified_since(if_modified_since, last_modified)
+    else:
+        current = False
+    if not current:
+        return None
+    response = Response(status_code=304)
+    set_validators(response, etag, last_modified)
+    return response
@@ -0,0 +1,129 @@
+from typing import Optional
+from sqlalchemy import text
+from cache import TTLCache
+
+# Result counts for the paginated HTML pages. Unfiltered pages read the
+# exact row count of their table from row_counts, which triggers keep in
+# step with every insert and delete, whichever code path makes them.
+# Filtered counts are cached by page, filter values and table versions;
+# free-text searches, which have to scan, stop counting at
+# COUNT_ESTIMATE_LIMIT and are shown as "more than" that.
+#
+# table_versions holds a write counter per table, kept by triggers in the
+# same way, so unlike cache.TableVersions it also sees writes made by other
+# worker processes, the import CLI and plain SQL. The API uses it for the
+# ETags of its list endpoints.
+
+COUNTED_TABLES = ("books", "students", "borrow_records")
+COUNT_ESTIMATE_LIMIT = 1000
+
+ROW_COUNT_DDL = [
+    """CREATE TABLE IF NOT EXISTS row_counts (
+        table_name TEXT PRIMARY KEY,
+        row_count INTEGER NOT NULL
+    )""",
+]
+for _table in COUNTED_TABLES:
+    ROW_COUNT_DDL += [
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_count_ai AFTER INSERT ON {_table} BEGIN
+            UPDATE row_counts SET row_count = row_count + 1 WHERE table_name = '{_table}';
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {_table}_count_ad AFTER DELETE ON {_table} BEGIN
+            UPDATE row_counts SET row_count = row_count - 1 WHERE table_name = '{_table}';
+        END""",
+    ]
+
+# Counters start at the current time in microseconds, and move on to it
+# whenever triggers had to be recreated, so versions are never repeated even
+# if table_versions is rebuilt or writes went uncounted
+NOW_MICROSECONDS = "CAST((julianday('now') - 2440587.5) * 86400000000 AS INTEGER)"
+
+TABLE_VERSION_DDL = [
+    """CREATE TABLE IF NOT EXISTS table_versions (
+        table_name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )""",
+]
+for _table in COUNTED_TABLES:
+    TABLE_VERSION_DDL.append(
+        f"""INSERT OR IGNORE INTO table_versions (table_name, version)
+        VALUES ('{_table}', {NOW_MICROSECONDS})"""
+    )
+    for _kind, _event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE")):
+        TABLE_VERSION_DDL.append(
+            f"""CREATE TRIGGER IF NOT EXISTS {_table}_version_{_kind} AFTER {_event} ON {_table} BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE table_name = '{_table}';
+            END"""
+        )
+
+def ensure_row_counts(conn) -> bool:
+    """Create row_counts and its triggers if missing; returns True if created.
+
+    Triggers go away when their table is dropped and recreated, so the
+    counts are rebuilt whenever any trigger was missing.
+    """
+    triggers = [f"{table}_count_{kind}" for table in COUNTED_TABLES for kind in ("ai", "ad")]
+    names = ", ".join(f"'{name}'" for name in triggers)
+    existing = conn.exec_driver_sql(
+        f"SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({names})"
+    ).scalar()
+    for ddl in ROW_COUNT_DDL:
+        conn.exec_driver_sql(ddl)
+    if existing < len(triggers):
+        rebuild_row_counts(conn)
+        return True
+    return False
+
+def rebuild_row_counts(conn):
+    for table in COUNTED_TABLES:
+        conn.exec_driver_sql(
+            f"INSERT OR REPLACE INTO row_counts (table_name, row_count) SELECT '{table}', count(*) FROM {table}"
+        )
+
+def ensure_table_versions(conn) -> bool:
+    """Create table_versions and its triggers if missing; returns True if created"""
+    triggers = [f"{table}_version_{kind}" for table in COUNTED_TABLES for kind in ("ai", "au", "ad")]
+    names = ", ".join(f"'{name}'" for name in triggers)
+    existing = conn.exec_driver_sql(
+        f"SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({names})"
+    ).scalar()
+    for ddl in TABLE_VERSION_DDL:
+        conn.exec_driver_sql(ddl)
+    if existing < len(triggers):
+        conn.exec_driver_sql(f"UPDATE table_versions SET version = max(version + 1, {NOW_MICROSECONDS})")
+        return True
+    return False
+
+class PageCount:
+    def __init__(self, total: int, estimated: bool = False):
+        self.total = total
+        # True when total is only a lower bound (the count stopped early)
+        self.estimated = estimated
+
+    def pages(self, per_page: int) -> int:
+        return (self.total + per_page - 1) // per_page
+
+# Filtered counts by (table, filters, table versions)
+count_cache = TTLCache(maxsize=1024, ttl=60)
+
+def page_count(db, table: str, query, filters: dict, versions: tuple, estimate: bool = False) -> PageCount:
+    """Number of rows of query, a Query over table restricted by filters.
+
+    Empty filters read the maintained count of table. With estimate the
+    count stops at COUNT_ESTIMATE_LIMIT rows.
+    """
+    filters = tuple(sorted((name, str(value)) for name, value in filters.items() if value))
+    if not filters:
+        return PageCount(
+            db.execute(text("SELECT row_count FROM row_counts WHERE table_name = :table"), {"table": table}).scalar() or 0
+        )
+    key = (table, filters, versions, estimate)
+    count: Optional[PageCount] = count_cache.get(key)
+    if count is None:
+        if estimate:
+            total = query.limit(COUNT_ESTIMATE_LIMIT + 1).count()
+            count = PageCount(min(total, COUNT_ESTIMATE_LIMIT), total > COUNT_ESTIMATE_LIMIT)
+        else:
+            count = PageCount(query.count())
+        count_cache.set(key, count)
+    return count
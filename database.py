@@ -1,19 +1,117 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
 import os
 
 # Delete the database file if it exists
 # if os.path.exists("library.db"):
 #     os.remove("library.db")
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./library.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("LIBRARY_DATABASE_URL", "sqlite:///./library.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# SQLite engine profiles, picked with the LIBRARY_DB_PROFILE environment variable.
+# Pragmas are applied to every new connection; cache_size is in KiB when
+# negative and mmap_size in bytes.
+SQLITE_PROFILES = {
+    # Plain SQLite defaults (rollback journal, no busy timeout)
+    "legacy": {
+        "pragmas": {},
+        "poolclass": QueuePool,
+    },
+    # Full durability, but readers no longer block the circulation desk
+    "safe": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "FULL",
+            "busy_timeout": 5000,
+        },
+        "poolclass": QueuePool,
+    },
+    # WAL with NORMAL sync: a power cut can lose the last commits, never corrupt
+    "balanced": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "cache_size": -64000,
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+        },
+        "poolclass": QueuePool,
+    },
+    # Bulk loads and benchmarks only: no fsync at all
+    "fast": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "busy_timeout": 10000,
+            "cache_size": -256000,
+            "mmap_size": 1073741824,
+            "temp_store": "MEMORY",
+        },
+        "poolclass": QueuePool,
+    },
+}
+DEFAULT_SQLITE_PROFILE = "balanced"
+
+def _profile_settings(profile: str = None) -> dict:
+    profile = profile or os.getenv("LIBRARY_DB_PROFILE", DEFAULT_SQLITE_PROFILE)
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(
+            f"Unknown database profile '{profile}', expected one of: {', '.join(SQLITE_PROFILES)}"
+        )
+    return SQLITE_PROFILES[profile]
+
+def _is_memory_url(url: str) -> bool:
+    return url.split("://", 1)[1] in ("", "/:memory:")
+
+def _install_pragmas(sync_engine, pragmas: dict):
+    @event.listens_for(sync_engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def create_sqlite_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = None):
+    """Build an engine for url with the pragmas and pool class of a named profile"""
+    settings = _profile_settings(profile)
+
+    poolclass = settings["poolclass"]
+    if _is_memory_url(url):
+        # Every connection to an in-memory database is a new, empty database
+        poolclass = StaticPool
+
+    new_engine = create_engine(
+        url, connect_args={"check_same_thread": False}, poolclass=poolclass
+    )
+    _install_pragmas(new_engine, settings["pragmas"])
+    return new_engine
+
+def create_async_sqlite_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = None):
+    """Async (aiosqlite) counterpart of create_sqlite_engine for the same database"""
+    settings = _profile_settings(profile)
+    url = url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+    new_engine = create_async_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool if _is_memory_url(url) else AsyncAdaptedQueuePool
+    )
+    _install_pragmas(new_engine.sync_engine, settings["pragmas"])
+    return new_engine
+
+engine = create_sqlite_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine over the same file, used by the non-blocking routes
+async_engine = create_async_sqlite_engine()
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
 
 # Dependency
@@ -23,3 +121,64 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def missing_tables(conn):
+    """Names of the model tables that the database does not have yet"""
+    inspector = inspect(conn)
+    return [
+        table.name for table in Base.metadata.sorted_tables
+        if not inspector.has_table(table.name)
+    ]
+
+def add_missing_columns(conn):
+    """Add model columns that an existing database file does not have yet.
+
+    create_all() only creates missing tables, so columns added to a model
+    later are appended here with ALTER TABLE. Returns the added columns as
+    "table.column" strings.
+    """
+    inspector = inspect(conn)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            conn.exec_driver_sql(ddl)
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+def add_missing_indexes(conn):
+    """Create model indexes that an existing database does not have yet.
+
+    Like columns, indexes declared on a model after its table was created
+    are not added by create_all(). Returns the names of the created indexes.
+    """
+    inspector = inspect(conn)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(conn)
+                added.append(index.name)
+    return added
+
+def explain_query_plan(conn, stmt):
+    """SQLite's EXPLAIN QUERY PLAN for a statement, one line per plan step"""
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")]
@@ -0,0 +1,234 @@
+import bisect
+import itertools
+import math
+import random
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from passlib.context import CryptContext
+from sqlalchemy import func, insert, update, bindparam
+from sqlalchemy.orm import Session
+import circulation
+import models
+from enums import BookCategory, Department, YearLevel, YEAR_LEVEL_LIMITS
+
+# Seeded synthetic library for benchmarks and load tests. The same seed and
+# scale always give the same rows. Popularity follows a Zipf curve (a few
+# titles account for most loans), some students borrow far more than others,
+# and late returns and overdue loans vary by department. The generated data
+# respects the app's invariants: no book lends out more copies than it has,
+# no student holds more loans than their limit or two copies of one title,
+# and the circulation counters, rollup and search index are filled in.
+
+SCALES = {
+    "1k": 1_000,
+    "10k": 10_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+
+INSERT_CHUNK_SIZE = 10_000
+# Password of every generated admin, the README's default
+ADMIN_PASSWORD = "admin123"
+LOAN_DAYS = 14
+HISTORY_DAYS = 730
+
+# Share of loans returned late, per department
+LATE_RETURN_RATES = {
+    Department.COMPUTER_SCIENCE: 0.12,
+    Department.ENGINEERING: 0.15,
+    Department.BUSINESS: 0.18,
+    Department.ARTS: 0.25,
+    Department.SCIENCE: 0.10,
+    Department.MEDICINE: 0.08,
+    Department.LAW: 0.14,
+    Department.OTHER: 0.20,
+}
+# Loans from the last few weeks that are still out, and older loans never returned
+OPEN_RECENT_RATE = 0.6
+NEVER_RETURNED_RATE = 0.01
+
+WORDS = (
+    "art data design history modern systems theory practice introduction guide "
+    "principles world science life energy network city language music law health "
+    "economics mind code nature power story future origins structure analysis"
+).split()
+FIRST_NAMES = "Ana Ben Chen Dara Eli Fatima Gabriel Hana Ivan Jun Kofi Lena Mateo Nia Omar Priya Quinn Ravi Sara Tomas".split()
+LAST_NAMES = "Abe Bauer Costa Diaz Evans Fischer Garcia Haddad Ito Jensen Kim Lopez Mensah Novak Okafor Patel Rossi Silva Tanaka Wong".split()
+
+def scale_counts(borrows: int, books: Optional[int] = None) -> dict:
+    """Row counts of a library with the given number of borrow records;
+    books overrides the catalog size (e.g. for the search benchmark)"""
+    return {
+        "admins": 3,
+        "students": min(max(borrows // 25, 50), 200_000),
+        "books": books or min(max(borrows // 10, 100), 500_000),
+        "borrows": borrows,
+    }
+
+def _weighted_picker(rng: random.Random, weights: list) -> Callable[[], int]:
+    """Return a function drawing an index with probability proportional to weights"""
+    cumulative = list(itertools.accumulate(weights))
+    total = cumulative[-1]
+    last = len(cumulative) - 1
+    return lambda: min(bisect.bisect(cumulative, rng.random() * total), last)
+
+def _insert_chunks(db: Session, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK_SIZE:
+            db.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        db.execute(insert(table), chunk)
+
+def generate(
+    db: Session,
+    borrows: int,
+    seed: int = 42,
+    now: Optional[datetime] = None,
+    progress: Optional[Callable[[str], None]] = None,
+    books: Optional[int] = None
+) -> dict:
+    """Fill an empty database with a synthetic library; returns the row counts"""
+    if db.query(models.Book.id).first() or db.query(models.Student.id).first():
+        raise ValueError("The database already has books or students")
+    rng = random.Random(seed)
+    now = now or datetime.utcnow().replace(microsecond=0)
+    counts = scale_counts(borrows, books)
+    report = progress or (lambda message: None)
+
+    # Admins
+    password = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(ADMIN_PASSWORD)
+    db.execute(insert(models.Admin.__table__), [
+        {
+            "username": "admin" if number == 0 else f"librarian{number}",
+            "email": "admin@library.com" if number == 0 else f"librarian{number}@library.com",
+            "full_name": "Administrator" if number == 0 else f"Librarian {number}",
+            "hashed_password": password,
+            "is_active": True,
+            "created_at": now - timedelta(days=HISTORY_DAYS),
+        }
+        for number in range(counts["admins"])
+    ])
+    admin_ids = list(range(1, counts["admins"] + 1))
+
+    # Students, with a lognormal borrowing appetite
+    departments = list(Department)
+    student_departments = []
+    student_limits = []
+    def student_rows():
+        for number in range(counts["students"]):
+            department = rng.choice(departments)
+            year_level = rng.choice(list(YearLevel))
+            student_departments.append(department)
+            student_limits.append(YEAR_LEVEL_LIMITS[year_level])
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            yield {
+                "fullname": f"{first} {last}",
+                "student_id": f"S{number + 1:07d}",
+                "email": f"{first.lower()}.{last.lower()}.{number + 1}@students.example.edu",
+                "department": department,
+                "year_level": year_level,
+                "phone": None,
+                "is_active": rng.random() > 0.03,
+                "created_at": now - timedelta(days=rng.randint(0, HISTORY_DAYS)),
+                "admin_id": rng.choice(admin_ids),
+                "active_borrow_count": 0,
+            }
+    _insert_chunks(db, models.Student.__table__, student_rows())
+    report(f"{counts['students']} students")
+
+    # Books; popular titles (low rank) get more copies
+    categories = list(BookCategory)
+    book_quantities = []
+    def book_rows():
+        for number in range(counts["books"]):
+            quantity = 1 + min(int(8 / math.sqrt(number + 1)), 7) + (rng.random() < 0.3)
+            book_quantities.append(quantity)
+            title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+            yield {
+                "title": title,
+                "author": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                "isbn": f"978{number + 1:010d}",
+                "category": rng.choice(categories),
+                "description": f"{title}: a synthetic catalog entry",
+                "quantity": quantity,
+                "available_quantity": quantity,
+                "admin_id": rng.choice(admin_ids),
+                "created_at": now - timedelta(days=HISTORY_DAYS + rng.randint(0, 365)),
+                "updated_at": now - timedelta(days=rng.randint(0, HISTORY_DAYS)),
+            }
+    _insert_chunks(db, models.Book.__table__, book_rows())
+    report(f"{counts['books']} books")
+
+    # Borrow records in time order; ids grow with borrow_date like real data
+    pick_book = _weighted_picker(rng, [1 / (rank + 1) ** 1.1 for rank in range(counts["books"])])
+    pick_student = _weighted_picker(rng, [rng.lognormvariate(0, 1) for _ in range(counts["students"])])
+    open_per_book = [0] * counts["books"]
+    open_per_student = [0] * counts["students"]
+    open_loans = set()
+    start = now - timedelta(days=HISTORY_DAYS)
+    step = (now - start) / max(borrows, 1)
+
+    def borrow_rows():
+        for number in range(borrows):
+            book = pick_book()
+            student = pick_student()
+            borrow_date = start + step * number + timedelta(seconds=rng.randint(0, 3600))
+            due_date = borrow_date + timedelta(days=LOAN_DAYS)
+            late = rng.random() < LATE_RETURN_RATES[student_departments[student]]
+            stays_open = (
+                rng.random() < OPEN_RECENT_RATE if borrow_date > now - timedelta(days=LOAN_DAYS * 2)
+                else rng.random() < NEVER_RETURNED_RATE
+            )
+            # A loan can only stay out if the copy, the limit and the title allow it
+            if stays_open and (
+                open_per_book[book] >= book_quantities[book]
+                or open_per_student[student] >= student_limits[student]
+                or (student, book) in open_loans
+            ):
+                stays_open = False
+            if stays_open:
+                open_per_book[book] += 1
+                open_per_student[student] += 1
+                open_loans.add((student, book))
+                return_date = None
+            else:
+                days_out = rng.randint(LOAN_DAYS + 1, LOAN_DAYS + 30) if late else rng.randint(1, LOAN_DAYS)
+                return_date = min(borrow_date + timedelta(days=days_out, seconds=rng.randint(0, 36000)), now)
+            yield {
+                "book_id": book + 1,
+                "student_id": student + 1,
+                "admin_id": rng.choice(admin_ids),
+                "borrow_date": borrow_date,
+                "due_date": due_date,
+                "return_date": return_date,
+            }
+            if number and number % 1_000_000 == 0:
+                report(f"{number} borrow records")
+    _insert_chunks(db, models.BorrowRecord.__table__, borrow_rows())
+    report(f"{borrows} borrow records")
+
+    # Derived data: copies on loan, student counters, daily rollup
+    db.execute(
+        update(models.Book.__table__)
+        .where(models.Book.__table__.c.id == bindparam("book_id"))
+        .values(available_quantity=bindparam("available")),
+        [
+            {"book_id": book + 1, "available": book_quantities[book] - out}
+            for book, out in enumerate(open_per_book) if out
+        ]
+    )
+    circulation.sync_student_circulation(db)
+    circulation.backfill_daily_circulation(db)
+    db.commit()
+    return {
+        **counts,
+        "open_loans": sum(open_per_book),
+        "overdue_loans": db.query(func.count(models.BorrowRecord.id)).filter(
+            models.BorrowRecord.return_date == None,
+            models.BorrowRecord.due_date < now
+        ).scalar(),
+    }
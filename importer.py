@@ -0,0 +1,136 @@
+import csv
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+import models
+import schemas
+from enums import YearLevel
+
+# Bulk CSV import of books and students. Rows are parsed one at a time,
+# checked against in-memory sets of the unique keys already in the database
+# (loaded with one SELECT per key) and inserted with executemany in chunks,
+# one commit per chunk, so a large file never sits in memory at once.
+
+IMPORT_CHUNK_SIZE = 2000
+
+class ImportSpec:
+    """What to import: the model, the schema validating a row, its unique
+    fields and extra_fields(values, record) for columns the schema lacks"""
+
+    def __init__(self, model, schema, unique_fields: List[str], extra_fields: Callable[[dict, dict], dict]):
+        self.model = model
+        self.schema = schema
+        self.unique_fields = unique_fields
+        self.extra_fields = extra_fields
+
+def _book_fields(values: dict, record: dict) -> dict:
+    return {"available_quantity": record["quantity"]}
+
+def _student_fields(values: dict, record: dict) -> dict:
+    # year_level is not part of StudentCreate but an import may carry it
+    if not values.get("year_level"):
+        return {"year_level": None}
+    try:
+        return {"year_level": YearLevel(int(values["year_level"]))}
+    except ValueError:
+        raise ValueError(f"year_level: must be one of {', '.join(str(level.value) for level in YearLevel)}")
+
+IMPORTS = {
+    "books": ImportSpec(models.Book, schemas.BookCreate, ["isbn"], _book_fields),
+    "students": ImportSpec(models.Student, schemas.StudentCreate, ["student_id", "email"], _student_fields),
+}
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}"
+        for item in error.errors()
+    )
+
+class ImportResult:
+    def __init__(self):
+        self.processed = 0
+        self.inserted = 0
+        self.rejected = 0
+
+def import_csv(
+    db: Session,
+    kind: str,
+    lines: Iterable[str],
+    admin_id: Optional[int] = None,
+    on_reject: Optional[Callable[[int, dict, str], None]] = None,
+    on_progress: Optional[Callable[[ImportResult], None]] = None,
+    chunk_size: int = IMPORT_CHUNK_SIZE
+) -> ImportResult:
+    """Import the CSV rows of lines as books or students.
+
+    on_reject(line, row, error) is called for every row that is not imported,
+    on_progress(result) after every committed chunk.
+    """
+    spec = IMPORTS[kind]
+    result = ImportResult()
+    # Unique keys already taken, in the database or earlier in the file
+    taken: Dict[str, set] = {
+        field: set(db.scalars(select(getattr(spec.model, field))))
+        for field in spec.unique_fields
+    }
+    chunk = []
+
+    def flush_chunk():
+        if chunk:
+            # A Core insert on the table: the ORM bulk insert would split the
+            # chunk wherever optional fields switch between None and a value
+            db.execute(insert(spec.model.__table__), chunk)
+            db.commit()
+            result.inserted += len(chunk)
+            chunk.clear()
+        if on_progress:
+            on_progress(result)
+
+    reader = csv.DictReader(lines)
+    for row in reader:
+        result.processed += 1
+        line = reader.line_num
+        values = {key: value.strip() for key, value in row.items() if key and value and value.strip()}
+        try:
+            record = spec.schema.model_validate(values).model_dump()
+            record.update(spec.extra_fields(values, record))
+        except ValidationError as error:
+            message = _validation_message(error)
+        except ValueError as error:
+            message = str(error)
+        else:
+            message = next(
+                (f"{field} already registered" for field in spec.unique_fields if record[field] in taken[field]),
+                None
+            )
+        if message:
+            result.rejected += 1
+            if on_reject:
+                on_reject(line, row, message)
+            continue
+
+        for field in spec.unique_fields:
+            taken[field].add(record[field])
+        record["admin_id"] = admin_id
+        record["created_at"] = datetime.utcnow()
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            flush_chunk()
+    flush_chunk()
+    return result
+
+class RejectsWriter:
+    """on_reject callback writing rejected rows to a CSV file with their line and error"""
+
+    def __init__(self, file):
+        self.file = file
+        self.writer = None
+
+    def __call__(self, line: int, row: dict, error: str):
+        if self.writer is None:
+            fieldnames = ["line", "error"] + [key for key in row if key]
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, extrasaction="ignore")
+            self.writer.writeheader()
+        self.writer.writerow({**row, "line": line, "error": error})
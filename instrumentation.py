@@ -0,0 +1,94 @@
+import contextvars
+import logging
+import os
+import time
+from typing import Optional
+from sqlalchemy import event
+
+# Per-request database instrumentation. The HTTP middleware in main.py opens
+# a RequestStats for every request; cursor execute hooks on the engines add
+# each statement and its duration to the stats of the request running it.
+# The totals go out as a Server-Timing header and as fields of the request
+# log line, and are checked against the route's declared query budget.
+
+logger = logging.getLogger("library.requests")
+
+# With LIBRARY_QUERY_BUDGET_STRICT=1 (the test setting) a route exceeding its
+# budget fails the request instead of only logging a warning
+STRICT_QUERY_BUDGETS = os.getenv("LIBRARY_QUERY_BUDGET_STRICT", "") == "1"
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    @property
+    def total_seconds(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.db_seconds * 1000:.2f};desc="{self.queries} queries", '
+            f"total;dur={self.total_seconds * 1000:.2f}"
+        )
+
+_current_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "request_db_stats", default=None
+)
+
+def start_request() -> RequestStats:
+    """Start collecting statistics for the request running in this context"""
+    stats = RequestStats()
+    _current_stats.set(stats)
+    return stats
+
+def current_stats() -> Optional[RequestStats]:
+    return _current_stats.get()
+
+def install_query_hooks(sync_engine):
+    """Count statements and time them for the current request on an engine"""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += time.perf_counter() - context.query_started
+
+def query_budget(max_queries: int):
+    """Declare how many SQL statements a route may run per request"""
+    def declare(endpoint):
+        endpoint.query_budget = max_queries
+        return endpoint
+    return declare
+
+def check_query_budget(endpoint, route: str, stats: RequestStats):
+    budget = getattr(endpoint, "query_budget", None)
+    if budget is None or stats.queries <= budget:
+        return
+    message = f"{route} ran {stats.queries} queries, over its budget of {budget}"
+    if STRICT_QUERY_BUDGETS:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+def log_request(method: str, route: str, status_code: int, stats: RequestStats):
+    fields = {
+        "method": method,
+        "route": route,
+        "status": status_code,
+        "duration_ms": round(stats.total_seconds * 1000, 2),
+        "db_queries": stats.queries,
+        "db_ms": round(stats.db_seconds * 1000, 2),
+    }
+    logger.info(
+        " ".join(f"{name}={value}" for name, value in fields.items()),
+        extra=fields
+    )
@@ -0,0 +1,209 @@
+import bisect
+import itertools
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Tuple
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+import models
+
+# In-memory prefix indexes behind the typeahead lookups. Every student is
+# indexed by the words of their name and their student ID, every book by
+# the words of its title and its ISBN (digits only, so "978-0-1" and
+# "97801" both match). The index only finds candidate ids; the rows are
+# then read from the database, so filters like "available" are always
+# current and rows deleted elsewhere simply drop out.
+#
+# Writes made through sessions update the index when they commit. Rows
+# inserted without the ORM (bulk imports) or by other processes are picked
+# up by an id range query whenever the table's version changes, and at
+# least every CATCH_UP_SECONDS.
+
+CATCH_UP_SECONDS = 30
+LOOKUP_LIMIT = 50
+
+def normalize(word: str) -> str:
+    return re.sub(r"[\W_]+", "", word.lower())
+
+def words(text: str) -> List[str]:
+    return [word for word in map(normalize, (text or "").split()) if word]
+
+class PrefixIndex:
+    """Sorted tokens with the ids of the items carrying each of them"""
+
+    def __init__(self):
+        self._tokens: List[str] = []
+        self._postings: Dict[str, List[int]] = {}
+        self._item_tokens: Dict[int, Tuple[str, ...]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._item_tokens)
+
+    def load(self, items: Iterator[Tuple[int, List[str]]]):
+        """Replace the whole index with (id, tokens) pairs"""
+        postings = {}
+        item_tokens = {}
+        for item_id, tokens in items:
+            tokens = tuple(dict.fromkeys(tokens))
+            item_tokens[item_id] = tokens
+            for token in tokens:
+                postings.setdefault(token, []).append(item_id)
+        for ids in postings.values():
+            ids.sort()
+        with self._lock:
+            self._postings = postings
+            self._item_tokens = item_tokens
+            self._tokens = sorted(postings)
+
+    def set(self, item_id: int, tokens: List[str]):
+        with self._lock:
+            self._remove(item_id)
+            tokens = tuple(dict.fromkeys(tokens))
+            self._item_tokens[item_id] = tokens
+            for token in tokens:
+                ids = self._postings.get(token)
+                if ids is None:
+                    self._postings[token] = [item_id]
+                    bisect.insort(self._tokens, token)
+                else:
+                    bisect.insort(ids, item_id)
+
+    def remove(self, item_id: int):
+        with self._lock:
+            self._remove(item_id)
+
+    def _remove(self, item_id: int):
+        for token in self._item_tokens.pop(item_id, ()):
+            ids = self._postings[token]
+            ids.remove(item_id)
+            if not ids:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def search(self, terms: List[str], limit: int) -> List[int]:
+        """Up to limit ids of items having a token starting with each term,
+        in the order of the tokens matching the longest term"""
+        if not terms:
+            return []
+        terms = sorted(set(terms), key=len, reverse=True)
+        first, others = terms[0], terms[1:]
+        found = []
+        seen = set()
+        with self._lock:
+            position = bisect.bisect_left(self._tokens, first)
+            while position < len(self._tokens) and self._tokens[position].startswith(first):
+                for item_id in self._postings[self._tokens[position]]:
+                    if item_id in seen:
+                        continue
+                    seen.add(item_id)
+                    tokens = self._item_tokens[item_id]
+                    if all(any(token.startswith(term) for token in tokens) for term in others):
+                        found.append(item_id)
+                        if len(found) >= limit:
+                            return found
+                position += 1
+        return found
+
+class Lookup:
+    """Prefix index over one model, loaded on first use"""
+
+    def __init__(self, model, columns: list, tokens_of: Callable):
+        self.model = model
+        self.columns = columns
+        self.tokens_of = tokens_of
+        self.index = PrefixIndex()
+        self.loaded = False
+        self.max_id = 0
+        self.version = None
+        self.checked = 0.0
+        self._lock = threading.Lock()
+
+    def _rows(self, db: Session, after_id: int = 0):
+        return db.execute(
+            select(self.model.id, *self.columns).where(self.model.id > after_id).order_by(self.model.id)
+        ).all()
+
+    def refresh(self, db: Session, version):
+        """Load the index, or add the rows inserted since it was last checked"""
+        with self._lock:
+            if not self.loaded:
+                rows = self._rows(db)
+                self.index.load((row.id, self.tokens_of(row)) for row in rows)
+                self.loaded = True
+            elif version != self.version or time.monotonic() - self.checked > CATCH_UP_SECONDS:
+                rows = self._rows(db, self.max_id)
+                for row in rows:
+                    self.index.set(row.id, self.tokens_of(row))
+            else:
+                return
+            if rows:
+                self.max_id = max(self.max_id, rows[-1].id)
+            self.version = version
+            self.checked = time.monotonic()
+
+    def search(self, db: Session, query: str, limit: int, *filters) -> list:
+        """Rows matching query and filters, at most limit of them"""
+        terms = words(query)
+        candidates = iter(self.index.search(terms, LOOKUP_LIMIT * 20))
+        results = []
+        # Read candidates in growing batches until enough pass the filters
+        batch_size = limit * 2
+        while len(results) < limit:
+            batch = list(itertools.islice(candidates, batch_size))
+            if not batch:
+                break
+            batch_size *= 4
+            rows = {
+                row.id: row for row in
+                db.query(self.model).filter(self.model.id.in_(batch), *filters)
+            }
+            results.extend(rows[item_id] for item_id in batch if item_id in rows)
+        return results[:limit]
+
+    def apply(self, changes: List[Tuple[int, list]]):
+        """Apply (id, tokens) changes from a commit; tokens None removes the id"""
+        if not self.loaded:
+            return
+        for item_id, tokens in changes:
+            if tokens is None:
+                self.index.remove(item_id)
+            else:
+                self.index.set(item_id, tokens)
+
+def _student_tokens(student) -> List[str]:
+    return words(student.fullname) + words(student.student_id)
+
+def _book_tokens(book) -> List[str]:
+    return words(book.title) + words(book.isbn)
+
+students = Lookup(models.Student, [models.Student.fullname, models.Student.student_id], _student_tokens)
+books = Lookup(models.Book, [models.Book.title, models.Book.isbn], _book_tokens)
+LOOKUPS = {models.Student: students, models.Book: books}
+
+def track(session_class):
+    """Update the lookups with the students and books every session commits"""
+
+    @event.listens_for(session_class, "after_flush")
+    def note_changes(session, flush_context):
+        changes = session.info.setdefault("lookup_changes", [])
+        for instance in (*session.new, *session.dirty):
+            if type(instance) in LOOKUPS:
+                changes.append((type(instance), instance.id, LOOKUPS[type(instance)].tokens_of(instance)))
+        for instance in session.deleted:
+            if type(instance) in LOOKUPS:
+                changes.append((type(instance), instance.id, None))
+
+    @event.listens_for(session_class, "after_commit")
+    def apply_changes(session):
+        for model, lookup in LOOKUPS.items():
+            lookup.apply([
+                (item_id, tokens) for changed, item_id, tokens in session.info.get("lookup_changes", ())
+                if changed is model
+            ])
+        session.info.pop("lookup_changes", None)
+
+    @event.listens_for(session_class, "after_rollback")
+    def forget_changes(session):
+        session.info.pop("lookup_changes", None)
@@ -1,17 +1,37 @@
 from datetime import datetime, timedelta
 from typing import Optional, List
-from fastapi import FastAPI, Request, Depends, HTTPException, status, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import os
+import time
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, status, Form, File, UploadFile, Query
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, and_, or_, asc, desc
+from sqlalchemy import func, and_, or_, asc, desc, case, select, insert, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import models
 import database
 import schemas
+import circulation
+import search as search_module
+import counts as counts_module
+import assets
+import compression
+import conditional
+import export as export_module
+import fastjson
+import importer
+import instrumentation
+import lookup
+import metrics
+import pagination
+from cache import TableVersions, TTLCache
 from enums import BookCategory, Department, YearLevel
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.sessions import SessionMiddleware
@@ -27,6 +47,21 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt runs on its own bounded pool so a burst of logins cannot starve the
+# event loop; extra requests wait for a slot instead of piling up threads
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("LIBRARY_PASSWORD_HASH_CONCURRENCY", "2"))
+password_hash_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix="password-hash"
+)
+password_hash_slots = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+# Only touched from the event loop thread, so plain counters are safe
+password_hash_stats = {
+    "waiting": 0,
+    "running": 0,
+    "completed": 0,
+    "queue_wait_seconds": 0.0,
+}
+
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="token",
@@ -35,7 +70,23 @@ oauth2_scheme = OAuth2PasswordBearer(
 
 # Create tables
 with database.engine.begin() as conn:
+    added_tables = database.missing_tables(conn)
     models.Base.metadata.create_all(conn)
+    database.add_missing_columns(conn)
+    search_module.ensure_book_search_index(conn)
+    counts_module.ensure_row_counts(conn)
+    counts_module.ensure_table_versions(conn)
+
+# Fill circulation counters that an upgraded database does not have yet,
+# whether the columns were added here or by `manage.py upgrade`
+with database.SessionLocal() as db:
+    if circulation.student_circulation_missing(db):
+        circulation.sync_student_circulation(db)
+        db.commit()
+if "daily_circulation" in added_tables:
+    with database.SessionLocal() as db:
+        circulation.backfill_daily_circulation(db)
+        db.commit()
 
 # Authentication functions
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -44,17 +95,35 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
-def authenticate_admin(db: Session, username: str, password: str) -> Optional[models.Admin]:
-    admin = db.query(models.Admin).filter(models.Admin.username == username).first()
-    if not admin:
+async def run_password_hashing(func, *args):
+    """Run a bcrypt call on the password hashing pool, waiting for a free slot"""
+    password_hash_stats["waiting"] += 1
+    queued_at = time.perf_counter()
+    async with password_hash_slots:
+        password_hash_stats["waiting"] -= 1
+        password_hash_stats["queue_wait_seconds"] += time.perf_counter() - queued_at
+        password_hash_stats["running"] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(password_hash_executor, func, *args)
+        finally:
+            password_hash_stats["running"] -= 1
+            password_hash_stats["completed"] += 1
+
+async def authenticate_admin(db: AsyncSession, username: str, password: str) -> Optional[models.Admin]:
+    result = await db.execute(select(models.Admin).where(models.Admin.username == username))
+    admin = result.scalars().first()
+    if not admin or not admin.is_active:
         return None
-    if not verify_password(password, admin.hashed_password):
+    # Hand the connection back to the pool while waiting on bcrypt
+    await db.commit()
+    if not await run_password_hashing(verify_password, password, admin.hashed_password):
         return None
     return admin
 
-def create_access_token(data: dict) -> str:
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=30)
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
@@ -69,29 +138,118 @@ def verify_token(token: str) -> Optional[dict]:
     except JWTError:
         return None
 
-async def get_current_admin(
-    request: Request,
-    db: Session = Depends(database.get_db)
-) -> Optional[models.Admin]:
+def get_token_payload(request: Request) -> Optional[dict]:
+    """Decoded access token of the request, decoded at most once per request"""
+    # auth_middleware stores the payload; routes it skips (/login) decode here
+    payload = getattr(request.state, "token_payload", None)
+    if payload is not None:
+        return payload
+
     token = request.cookies.get("access_token")
     if not token or not token.startswith("Bearer "):
         return None
-        
     try:
-        token_data = verify_token(token.split(" ")[1])
-        if not token_data:
-            return None
-            
-        username = token_data.get("sub")
-        if not username:
-            return None
-            
-        admin = db.query(models.Admin).filter(
-            models.Admin.username == username
-        ).first()
-        return admin
+        payload = verify_token(token.split(" ")[1])
     except:
         return None
+    request.state.token_payload = payload
+    return payload
+
+# Authenticated admins by username and admins table version, so a write to
+# any admin row (ORM flush or update() statement) takes effect on the next
+# request. The TTL covers writes made by other processes.
+admin_cache = TTLCache(maxsize=256, ttl=60)
+
+# Per-table write counters; caches of derived data key on them
+table_versions = TableVersions()
+table_versions.track(Session)
+
+# Typeahead indexes follow the students and books each session commits
+lookup.track(Session)
+
+# Dashboard statistics by table versions. The TTL bounds staleness from
+# loans turning overdue and from writes made by other processes.
+dashboard_cache = TTLCache(maxsize=8, ttl=60)
+
+async def get_current_admin(request: Request) -> Optional[models.Admin]:
+    token_data = get_token_payload(request)
+    if not token_data:
+        return None
+
+    username = token_data.get("sub")
+    if not username:
+        return None
+
+    key = (username, *table_versions.get("admins"))
+    admin = admin_cache.get(key)
+    if admin is None:
+        async with database.AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(models.Admin).where(models.Admin.username == username, models.Admin.is_active == True)
+            )
+            admin = result.scalars().first()
+        if admin:
+            admin_cache.set(key, admin)
+    return admin
+
+# Query helpers
+def borrow_response_options():
+    """Loader options for the book and student that BorrowResponse nests"""
+    # Book and student ride along in the same SELECT
+    return (
+        joinedload(models.BorrowRecord.book),
+        joinedload(models.BorrowRecord.student)
+    )
+
+def borrow_records_query(db: Session):
+    return db.query(models.BorrowRecord).options(*borrow_response_options())
+
+def borrow_records_select():
+    return select(models.BorrowRecord).options(*borrow_response_options())
+
+def student_borrow_stats_select(student_ids: List[int]):
+    """Total, active and overdue borrow counts per student in one grouped query"""
+    is_open = models.BorrowRecord.return_date == None
+    return select(
+        models.BorrowRecord.student_id,
+        func.count(models.BorrowRecord.id).label('total_borrows'),
+        func.sum(case((is_open, 1), else_=0)).label('active_borrows'),
+        func.sum(case((and_(is_open, models.BorrowRecord.due_date < datetime.utcnow()), 1), else_=0)).label('overdue_borrows')
+    ).where(
+        models.BorrowRecord.student_id.in_(student_ids)
+    ).group_by(models.BorrowRecord.student_id)
+
+def _student_borrow_stats(student_ids: List[int], rows) -> dict:
+    stats = {
+        student_id: {"total_borrows": 0, "active_borrows": 0, "overdue_borrows": 0}
+        for student_id in student_ids
+    }
+    for row in rows:
+        stats[row.student_id] = {
+            "total_borrows": row.total_borrows,
+            "active_borrows": row.active_borrows,
+            "overdue_borrows": row.overdue_borrows
+        }
+    return stats
+
+def student_borrow_stats(db: Session, student_ids: List[int]) -> dict:
+    if not student_ids:
+        return {}
+    rows = db.execute(student_borrow_stats_select(student_ids)).all()
+    return _student_borrow_stats(student_ids, rows)
+
+async def student_borrow_stats_async(db: AsyncSession, student_ids: List[int]) -> dict:
+    if not student_ids:
+        return {}
+    rows = (await db.execute(student_borrow_stats_select(student_ids))).all()
+    return _student_borrow_stats(student_ids, rows)
+
+def student_overdue_filter(has_overdue: bool):
+    """SQL condition on the students' earliest open due date"""
+    earliest_due = models.Student.earliest_open_due_date
+    if has_overdue:
+        return earliest_due < datetime.utcnow()
+    return or_(earliest_due == None, earliest_due >= datetime.utcnow())
 
 # Single admin creation endpoint
 @app.post("/admin/create/", response_model=schemas.Admin)
@@ -142,7 +300,7 @@ async def create_admin(
         username=admin.username,
         email=admin.email,
         full_name=admin.full_name,
-        hashed_password=get_password_hash(admin.password)
+        hashed_password=await run_password_hashing(get_password_hash, admin.password)
     )
     db.add(db_admin)
     db.commit()
@@ -153,9 +311,9 @@ async def create_admin(
 @app.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    admin = authenticate_admin(db, form_data.username, form_data.password)
+    admin = await authenticate_admin(db, form_data.username, form_data.password)
     if not admin:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -260,7 +418,7 @@ async def get_student(
 
 # Book management endpoints
 @app.post("/api/books/", response_model=schemas.BookResponse)
-async def create_book(
+def create_book(
     book: schemas.BookCreate,
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
@@ -279,24 +437,66 @@ async def create_book(
     db.refresh(db_book)
     return db_book
 
+# Largest number of rejected rows listed in an import response
+IMPORT_REJECTS_SHOWN = 1000
+
+@app.post("/api/import/{kind}", response_model=schemas.ImportResult)
+def import_records(
+    kind: str,
+    file: UploadFile = File(...),
+    db: Session = Depends(database.get_db),
+    current_admin: models.Admin = Depends(get_current_admin)
+):
+    if not current_admin:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if kind not in importer.IMPORTS:
+        raise HTTPException(status_code=404, detail="Unknown import, expected books or students")
+
+    rejects = []
+    def on_reject(line, row, error):
+        if len(rejects) < IMPORT_REJECTS_SHOWN:
+            rejects.append(schemas.ImportReject(line=line, error=error))
+
+    # Parse the upload as it is read instead of loading it whole
+    lines = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    result = importer.import_csv(db, kind, lines, admin_id=current_admin.id, on_reject=on_reject)
+    return schemas.ImportResult(
+        processed=result.processed,
+        inserted=result.inserted,
+        rejected=result.rejected,
+        rejects=rejects
+    )
+
 @app.get("/api/books/{book_id}", response_model=schemas.BookResponse)
+@instrumentation.query_budget(3)
 async def get_book(
     book_id: int,
-    db: Session = Depends(database.get_db),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(database.get_async_db),
     current_admin: models.Admin = Depends(get_current_admin)
 ):
     if not current_admin:
         raise HTTPException(status_code=401, detail="Not authenticated")
         
     # Get book with borrow count
-    book = db.query(models.Book).filter(models.Book.id == book_id).first()
+    book = await db.get(models.Book, book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
+
+    # The client's copy is still current: skip the count and the body
+    etag = conditional.row_etag("book", book.id, book.updated_at)
+    unchanged = conditional.not_modified(request, etag, book.updated_at)
+    if unchanged:
+        return unchanged
+    conditional.set_validators(response, etag, book.updated_at)
         
     # Get borrow count
-    borrow_count = db.query(models.BorrowRecord).filter(
-        models.BorrowRecord.book_id == book_id
-    ).count()
+    borrow_count = await db.scalar(
+        select(func.count(models.BorrowRecord.id)).where(
+            models.BorrowRecord.book_id == book_id
+        )
+    )
     
     return {
         **book.__dict__,
@@ -379,49 +579,72 @@ async def delete_book(
     return {"message": "Book deleted successfully"}
 
 @app.get("/api/books/", response_model=List[schemas.BookResponse])
+@instrumentation.query_budget(4)
 async def list_books(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 10,
+    cursor: Optional[str] = None,
     search: Optional[str] = None,
     category: Optional[BookCategory] = None,
     availability: Optional[str] = None,
-    db: Session = Depends(database.get_db),
+    db: AsyncSession = Depends(database.get_async_db),
     current_admin: models.Admin = Depends(get_current_admin)
 ):
     if not current_admin:
         raise HTTPException(status_code=401, detail="Not authenticated")
+
+    # No book written since the client's copy: answer before querying
+    versions = (await db.execute(conditional.list_validators_select(("books",)))).one()
+    etag = conditional.make_etag("books", *versions)
+    unchanged = conditional.not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    conditional.set_validators(response, etag)
         
     # Base query
-    query = db.query(models.Book)
+    query = select(models.Book)
+    sort_columns = [models.Book.id]
     
     # Apply filters
     if search:
-        query = query.filter(
-            or_(
-                models.Book.title.ilike(f"%{search}%"),
-                models.Book.author.ilike(f"%{search}%"),
-                models.Book.isbn.ilike(f"%{search}%")
-            )
-        )
+        hits = search_module.book_search_hits(search)
+        # Best matches first; the id breaks ties so cursors stay stable
+        query = query.join(hits, hits.c.book_id == models.Book.id)
+        sort_columns = [hits.c.rank, models.Book.id]
     if category:
-        query = query.filter(models.Book.category == category)
+        query = query.where(models.Book.category == category)
     if availability:
         if availability == "available":
-            query = query.filter(models.Book.available_quantity > 0)
+            query = query.where(models.Book.available_quantity > 0)
         elif availability == "borrowed":
-            query = query.filter(models.Book.available_quantity == 0)
+            query = query.where(models.Book.available_quantity == 0)
             
+    # Apply pagination
+    if cursor:
+        query = query.where(pagination.after_cursor(sort_columns, cursor))
+    else:
+        query = query.offset(skip)
+    query = query.add_columns(*sort_columns).order_by(*sort_columns).limit(limit)
+
     # Get books with borrow counts
-    books = query.offset(skip).limit(limit).all()
+    rows = (await db.execute(query)).all()
+    pagination.set_next_cursor(response, rows, limit, key=lambda row: list(row[1:]))
+    books = [row[0] for row in rows]
     
     # Add borrow count to each book
+    borrow_counts = {}
+    if books:
+        borrow_counts = dict((await db.execute(
+            select(models.BorrowRecord.book_id, func.count(models.BorrowRecord.id))
+            .where(models.BorrowRecord.book_id.in_([book.id for book in books]))
+            .group_by(models.BorrowRecord.book_id)
+        )).all())
     book_responses = []
     for book in books:
-        borrow_count = db.query(models.BorrowRecord).filter(
-            models.BorrowRecord.book_id == book.id
-        ).count()
         book_dict = book.__dict__
-        book_dict["borrow_count"] = borrow_count
+        book_dict["borrow_count"] = borrow_counts.get(book.id, 0)
         book_responses.append(book_dict)
     
     return book_responses
@@ -527,7 +750,7 @@ async def get_books_by_category(
 
 # Book borrowing and returning endpoints
 @app.post("/books/borrow/", response_model=schemas.BorrowResponse)
-async def borrow_book(
+def borrow_book(
     borrow_request: schemas.BorrowCreate,
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
@@ -546,7 +769,7 @@ async def borrow_book(
         raise HTTPException(status_code=400, detail="Student is not active")
 
     # Check borrowing limits
-    if student.current_borrowed_count >= student.max_books_allowed:
+    if student.borrowed_books_count >= student.max_books_allowed:
         raise HTTPException(
             status_code=400, 
             detail=f"Student has reached maximum borrowing limit ({student.max_books_allowed} books)"
@@ -570,7 +793,7 @@ async def borrow_book(
     existing_borrow = db.query(models.BorrowRecord).filter(
         models.BorrowRecord.student_id == student.id,
         models.BorrowRecord.book_id == book.id,
-        models.BorrowRecord.is_returned == False
+        models.BorrowRecord.return_date == None
     ).first()
     if existing_borrow:
         raise HTTPException(status_code=400, detail="Student already has this book")
@@ -580,20 +803,27 @@ async def borrow_book(
         book_id=book.id,
         student_id=student.id,
         admin_id=current_admin.id,
-        due_date=borrow_request.due_date,
-        is_returned=False
+        due_date=borrow_request.due_date
     )
     
-    # Update book availability
-    book.available_quantity -= 1
+    # Take the copy and the borrowing slot with conditional UPDATEs; the
+    # checks above can be stale when several desks check out at once
+    if not circulation.take_copy(db, book.id):
+        raise HTTPException(status_code=400, detail="Book is not available")
+    if not circulation.take_borrow_slot(db, student.id, student.max_books_allowed):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Student has reached maximum borrowing limit ({student.max_books_allowed} books)"
+        )
 
     db.add(borrow_record)
+    circulation.record_borrow(db, borrow_record)
     db.commit()
     db.refresh(borrow_record)
     return borrow_record
 
 @app.post("/books/return/", response_model=schemas.BorrowResponse)
-async def return_book(
+def return_book(
     return_request: schemas.BorrowReturn,
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
@@ -606,27 +836,25 @@ async def return_book(
 
     # Get borrow record
     borrow_record = db.query(models.BorrowRecord).filter(
-        models.BorrowRecord.id == return_request.borrow_record_id
+        models.BorrowRecord.id == return_request.borrow_id
     ).first()
     if not borrow_record:
         raise HTTPException(status_code=404, detail="Borrow record not found")
     if borrow_record.is_returned:
         raise HTTPException(status_code=400, detail="Book already returned")
 
-    # Update borrow record
-    borrow_record.is_returned = True
-    borrow_record.return_date = datetime.utcnow()
-
-    # Update book availability
-    book = db.query(models.Book).filter(models.Book.id == borrow_record.book_id).first()
-    book.available_quantity += 1
+    # Close the loan unless another request returned it first
+    if not circulation.close_loan(db, borrow_record):
+        raise HTTPException(status_code=400, detail="Book already returned")
+    circulation.return_copy(db, borrow_record.book_id)
 
+    circulation.record_return(db, borrow_record)
     db.commit()
     db.refresh(borrow_record)
     return borrow_record
 
 @app.get("/books/borrowed/", response_model=List[schemas.BorrowResponse])
-async def get_borrowed_books(
+def get_borrowed_books(
     student_id: Optional[int] = None,
     department: Optional[Department] = None,
     category: Optional[BookCategory] = None,
@@ -643,7 +871,7 @@ async def get_borrowed_books(
             detail="Admin authentication required"
         )
 
-    query = db.query(models.BorrowRecord)
+    query = borrow_records_query(db)
     
     if student_id:
         query = query.filter(models.BorrowRecord.student_id == student_id)
@@ -666,7 +894,9 @@ async def get_borrowed_books(
     return query.all()
 
 @app.get("/books/overdue/", response_model=List[schemas.BorrowResponse])
-async def get_overdue_books(
+def get_overdue_books(
+    skip: int = 0,
+    limit: int = 100,
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
 ):
@@ -677,18 +907,20 @@ async def get_overdue_books(
         )
 
     current_time = datetime.utcnow()
-    overdue_books = db.query(models.BorrowRecord).filter(
+    overdue_books = borrow_records_query(db).filter(
         models.BorrowRecord.due_date < current_time,
-        models.BorrowRecord.is_returned == False
-    ).all()
+        models.BorrowRecord.return_date == None
+    ).order_by(models.BorrowRecord.due_date).offset(skip).limit(limit).all()
     
     return overdue_books
 
 @app.get("/books/search/", response_model=List[schemas.BorrowResponse])
-async def search_borrow_records(
+def search_borrow_records(
     filters: schemas.BorrowHistoryFilter,
+    response: Response,
     skip: int = 0,
     limit: int = 10,
+    cursor: Optional[str] = None,
     sort_by: str = "borrow_date",
     sort_desc: bool = True,
     db: Session = Depends(database.get_db),
@@ -701,7 +933,7 @@ async def search_borrow_records(
         )
 
     # Start with base query
-    query = db.query(models.BorrowRecord)
+    query = borrow_records_query(db)
 
     # Apply date filters
     if filters.start_date:
@@ -745,21 +977,32 @@ async def search_borrow_records(
             )
         )
 
-    # Apply sorting
-    if sort_by == "borrow_date":
-        query = query.order_by(desc(models.BorrowRecord.borrow_date) if sort_desc else asc(models.BorrowRecord.borrow_date))
-    elif sort_by == "due_date":
-        query = query.order_by(desc(models.BorrowRecord.due_date) if sort_desc else asc(models.BorrowRecord.due_date))
-    elif sort_by == "return_date":
-        query = query.order_by(desc(models.BorrowRecord.return_date) if sort_desc else asc(models.BorrowRecord.return_date))
+    # Apply sorting, with the id as tie-breaker so cursors stay stable
+    sort_columns = {
+        "borrow_date": [models.BorrowRecord.borrow_date, models.BorrowRecord.id],
+        "due_date": [models.BorrowRecord.due_date, models.BorrowRecord.id],
+        "return_date": [models.BorrowRecord.return_date, models.BorrowRecord.id]
+    }.get(sort_by, [models.BorrowRecord.id])
+    query = query.order_by(*[desc(column) if sort_desc else asc(column) for column in sort_columns])
 
     # Apply pagination
-    query = query.offset(skip).limit(limit)
-
-    return query.all()
+    if cursor:
+        if sort_by == "return_date":
+            # Open loans have no return date to continue from
+            raise HTTPException(status_code=400, detail="Cursor pagination is not supported when sorting by return_date")
+        query = query.filter(pagination.after_cursor(sort_columns, cursor, descending=sort_desc))
+    else:
+        query = query.offset(skip)
+    borrows = query.limit(limit).all()
+    if sort_by != "return_date":
+        pagination.set_next_cursor(
+            response, borrows, limit,
+            key=lambda borrow: [getattr(borrow, column.key) for column in sort_columns]
+        )
+    return borrows
 
 @app.get("/students/{student_id}/borrow-stats/")
-async def get_student_borrow_stats(
+def get_student_borrow_stats(
     student_id: int,
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
@@ -775,11 +1018,11 @@ async def get_student_borrow_stats(
         raise HTTPException(status_code=404, detail="Student not found")
 
     return {
-        "current_borrowed": student.current_borrowed_count,
+        "current_borrowed": student.borrowed_books_count,
         "max_allowed": student.max_books_allowed,
         "has_overdue": student.has_overdue_books,
         "can_borrow": (
-            student.current_borrowed_count < student.max_books_allowed
+            student.borrowed_books_count < student.max_books_allowed
             and not student.has_overdue_books
         )
     }
@@ -816,40 +1059,38 @@ async def create_student(
     return db_student
 
 @app.get("/api/students/{student_id}", response_model=schemas.StudentResponse)
+@instrumentation.query_budget(3)
 async def get_student(
     student_id: int,
-    db: Session = Depends(database.get_db),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(database.get_async_db),
     current_admin: models.Admin = Depends(get_current_admin)
 ):
     if not current_admin:
         raise HTTPException(status_code=401, detail="Not authenticated")
         
     # Get student
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    student = await db.get(models.Student, student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
+
+    # The client's copy is still current: skip the statistics and the body.
+    # Students from before updated_at existed fall back to created_at.
+    last_modified = student.updated_at or student.created_at
+    etag = conditional.row_etag("student", student.id, last_modified)
+    unchanged = conditional.not_modified(request, etag, last_modified)
+    if unchanged:
+        return unchanged
+    conditional.set_validators(response, etag, last_modified)
         
     # Get borrow statistics
-    total_borrows = db.query(models.BorrowRecord).filter(
-        models.BorrowRecord.student_id == student_id
-    ).count()
-    
-    active_borrows = db.query(models.BorrowRecord).filter(
-        models.BorrowRecord.student_id == student_id,
-        models.BorrowRecord.return_date == None
-    ).count()
-    
-    overdue_borrows = db.query(models.BorrowRecord).filter(
-        models.BorrowRecord.student_id == student_id,
-        models.BorrowRecord.return_date == None,
-        models.BorrowRecord.due_date < datetime.utcnow()
-    ).count()
+    stats = (await student_borrow_stats_async(db, [student.id]))[student.id]
     
     return {
         **student.__dict__,
-        "total_borrows": total_borrows,
-        "active_borrows": active_borrows,
-        "overdue_borrows": overdue_borrows
+        **stats,
+        "borrowed_books_count": stats["active_borrows"]
     }
 
 @app.put("/api/students/{student_id}", response_model=schemas.Student)
@@ -920,9 +1161,13 @@ async def delete_student(
     return {"message": "Student deleted successfully"}
 
 @app.get("/api/students/", response_model=List[schemas.StudentResponse])
-async def list_students(
+@instrumentation.query_budget(4)
+def list_students(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 10,
+    cursor: Optional[str] = None,
     search: Optional[str] = None,
     department: Optional[Department] = None,
     year_level: Optional[YearLevel] = None,
@@ -933,6 +1178,17 @@ async def list_students(
 ):
     if not current_admin:
         raise HTTPException(status_code=401, detail="Not authenticated")
+
+    # Nothing written since the client's copy (and, when filtering on
+    # overdue loans, none has turned overdue): answer before querying
+    versions = db.execute(conditional.list_validators_select(
+        ("students", "borrow_records"), due_dates=has_overdue is not None
+    )).one()
+    etag = conditional.make_etag("students", *versions)
+    unchanged = conditional.not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    conditional.set_validators(response, etag)
         
     # Base query
     query = db.query(models.Student)
@@ -952,82 +1208,110 @@ async def list_students(
         query = query.filter(models.Student.year_level == year_level)
     if is_active is not None:
         query = query.filter(models.Student.is_active == is_active)
+    if has_overdue is not None:
+        query = query.filter(student_overdue_filter(has_overdue))
         
     # Get students
-    students = query.offset(skip).limit(limit).all()
+    query = query.order_by(models.Student.id)
+    if cursor:
+        query = query.filter(pagination.after_cursor([models.Student.id], cursor))
+    else:
+        query = query.offset(skip)
+    students = query.limit(limit).all()
+    pagination.set_next_cursor(response, students, limit, key=lambda student: [student.id])
     
     # Add borrow statistics to each student
+    borrow_stats = student_borrow_stats(db, [student.id for student in students])
     student_responses = []
     for student in students:
-        total_borrows = db.query(models.BorrowRecord).filter(
-            models.BorrowRecord.student_id == student.id
-        ).count()
-        
-        active_borrows = db.query(models.BorrowRecord).filter(
-            models.BorrowRecord.student_id == student.id,
-            models.BorrowRecord.return_date == None
-        ).count()
-        
-        overdue_borrows = db.query(models.BorrowRecord).filter(
-            models.BorrowRecord.student_id == student.id,
-            models.BorrowRecord.return_date == None,
-            models.BorrowRecord.due_date < datetime.utcnow()
-        ).count()
-        
-        # Filter by overdue status if requested
-        if has_overdue is not None:
-            if has_overdue and overdue_borrows == 0:
-                continue
-            if not has_overdue and overdue_borrows > 0:
-                continue
-        
-        student_dict = student.__dict__
-        student_dict.update({
-            "total_borrows": total_borrows,
-            "active_borrows": active_borrows,
-            "overdue_borrows": overdue_borrows
+        stats = borrow_stats[student.id]
+        student_responses.append({
+            **student.__dict__,
+            **stats,
+            "borrowed_books_count": stats["active_borrows"]
         })
-        student_responses.append(student_dict)
     
     return student_responses
 
+# Typeahead lookups for the borrow forms
+@app.get("/api/lookup/students", response_model=List[schemas.StudentLookup])
+@instrumentation.query_budget(6)
+def lookup_students(
+    q: str,
+    limit: int = 10,
+    active_only: bool = True,
+    db: Session = Depends(database.get_db),
+    current_admin: models.Admin = Depends(get_current_admin)
+):
+    if not current_admin:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    lookup.students.refresh(db, table_versions.get("students"))
+    filters = [models.Student.is_active == True] if active_only else []
+    return lookup.students.search(db, q, min(max(limit, 1), lookup.LOOKUP_LIMIT), *filters)
+
+@app.get("/api/lookup/books", response_model=List[schemas.BookLookup])
+@instrumentation.query_budget(6)
+def lookup_books(
+    q: str,
+    limit: int = 10,
+    available_only: bool = True,
+    db: Session = Depends(database.get_db),
+    current_admin: models.Admin = Depends(get_current_admin)
+):
+    if not current_admin:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    lookup.books.refresh(db, table_versions.get("books"))
+    filters = [models.Book.available_quantity > 0] if available_only else []
+    return lookup.books.search(db, q, min(max(limit, 1), lookup.LOOKUP_LIMIT), *filters)
+
 # Borrow management endpoints
+BORROW_LIMIT = 3  # Maximum 3 books per student
+
+def checkout_refusal(student, book, copies_left: int, slots_left: int, has_book: bool) -> Optional[str]:
+    """Why a checkout is refused, or None; single and batch checkouts share these rules"""
+    if not book:
+        return "Book not found"
+    if not student:
+        return "Student not found"
+    if not student.is_active:
+        return "Student is not active"
+    if student.has_overdue_books:
+        return "Student has overdue books and cannot borrow more books"
+    if copies_left <= 0:
+        return "No copies available for borrowing"
+    if slots_left <= 0:
+        return f"Student has reached maximum borrow limit ({BORROW_LIMIT} books)"
+    if has_book:
+        return "Student already has this book"
+    return None
+
 @app.post("/api/borrows/", response_model=schemas.BorrowResponse)
-async def create_borrow(
+@instrumentation.query_budget(13)
+def create_borrow(
     borrow: schemas.BorrowCreate,
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
 ):
     if not current_admin:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    # Check if book exists and is available
-    book = db.query(models.Book).filter(models.Book.id == borrow.book_id).first()
-    if not book:
-        raise HTTPException(status_code=404, detail="Book not found")
-    
-    if book.available_quantity <= 0:
-        raise HTTPException(status_code=400, detail="No copies available for borrowing")
 
-    # Check if student exists and is active
+    book = db.query(models.Book).filter(models.Book.id == borrow.book_id).first()
     student = db.query(models.Student).filter(models.Student.id == borrow.student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-
-    if not student.is_active:
-        raise HTTPException(status_code=400, detail="Student is not active")
-
-    # Check if student has reached their limit
-    active_borrows = db.query(models.BorrowRecord).filter(
-        models.BorrowRecord.student_id == student.id,
-        models.BorrowRecord.return_date == None
-    ).count()
-    
-    if active_borrows >= 3:  # Maximum 3 books per student
-        raise HTTPException(
-            status_code=400,
-            detail="Student has reached maximum borrow limit (3 books)"
-        )
+    has_book = book is not None and student is not None and db.query(
+        db.query(models.BorrowRecord).filter(
+            models.BorrowRecord.student_id == student.id,
+            models.BorrowRecord.book_id == book.id,
+            models.BorrowRecord.return_date == None
+        ).exists()
+    ).scalar()
+    error = checkout_refusal(
+        student, book,
+        book.available_quantity if book else 0,
+        BORROW_LIMIT - student.borrowed_books_count if student else 0,
+        has_book
+    )
+    if error:
+        raise HTTPException(status_code=404 if book is None or student is None else 400, detail=error)
 
     # Create borrow record
     db_borrow = models.BorrowRecord(
@@ -1039,16 +1323,25 @@ async def create_borrow(
     
     )
     
-    # Update available quantity
-    book.available_quantity -= 1
-    
+    # Take the copy and the borrowing slot with conditional UPDATEs; the
+    # checks above can be stale when several desks check out at once
+    if not circulation.take_copy(db, book.id):
+        raise HTTPException(status_code=400, detail="No copies available for borrowing")
+    if not circulation.take_borrow_slot(db, student.id, BORROW_LIMIT):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Student has reached maximum borrow limit ({BORROW_LIMIT} books)"
+        )
+
     db.add(db_borrow)
+    circulation.record_borrow(db, db_borrow)
     db.commit()
     db.refresh(db_borrow)
     return db_borrow
 
 @app.post("/api/borrows/{borrow_id}/return", response_model=schemas.BorrowResponse)
-async def return_book(
+@instrumentation.query_budget(9)
+def return_book(
     borrow_id: int,
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
@@ -1069,61 +1362,270 @@ async def return_book(
     if borrow.return_date:
         raise HTTPException(status_code=400, detail="Book already returned")
 
-    # Update borrow record
-    borrow.return_date = datetime.utcnow()
-    
-    # Increase available quantity
-    book = borrow.book
-    book.available_quantity += 1
+    # Close the loan unless another request returned it first
+    if not circulation.close_loan(db, borrow):
+        raise HTTPException(status_code=400, detail="Book already returned")
+    circulation.return_copy(db, borrow.book_id)
     
+    circulation.record_return(db, borrow)
     db.commit()
     db.refresh(borrow)
     return borrow
 
+# Largest number of items accepted by one batch checkout or return
+BORROW_BATCH_LIMIT = 500
+
+def batch_result(index: int, borrow=None, error: str = None) -> schemas.BorrowBatchItemResult:
+    return schemas.BorrowBatchItemResult(
+        index=index,
+        success=error is None,
+        borrow=schemas.BorrowResponse.model_validate(borrow) if borrow is not None else None,
+        error=error
+    )
+
+def batch_response(results: List[schemas.BorrowBatchItemResult]) -> schemas.BorrowBatchResponse:
+    succeeded = sum(1 for result in results if result.success)
+    return schemas.BorrowBatchResponse(
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+        results=sorted(results, key=lambda result: result.index)
+    )
+
+@app.post("/api/borrows/batch", response_model=schemas.BorrowBatchResponse)
+@instrumentation.query_budget(12)
+def create_borrow_batch(
+    batch: schemas.BorrowBatchCreate,
+    db: Session = Depends(database.get_db),
+    current_admin: models.Admin = Depends(get_current_admin)
+):
+    if not current_admin:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if len(batch.items) > BORROW_BATCH_LIMIT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch can hold at most {BORROW_BATCH_LIMIT} items"
+        )
+
+    # Load every student, book and open loan the batch refers to at once
+    students = {
+        student.id: student for student in db.query(models.Student).filter(
+            models.Student.id.in_({item.student_id for item in batch.items})
+        )
+    }
+    books = {
+        book.id: book for book in db.query(models.Book).filter(
+            models.Book.id.in_({item.book_id for item in batch.items})
+        )
+    }
+    open_loans = set(db.query(
+        models.BorrowRecord.student_id, models.BorrowRecord.book_id
+    ).filter(
+        models.BorrowRecord.student_id.in_(list(students)),
+        models.BorrowRecord.book_id.in_(list(books)),
+        models.BorrowRecord.return_date == None
+    ).all())
+
+    # Validate the items in order, counting the copies and borrow slots
+    # that earlier items of the batch already use
+    results = []
+    accepted = []
+    copies_left = {book.id: book.available_quantity for book in books.values()}
+    slots_left = {student.id: BORROW_LIMIT - student.borrowed_books_count for student in students.values()}
+    for index, item in enumerate(batch.items):
+        error = checkout_refusal(
+            students.get(item.student_id), books.get(item.book_id),
+            copies_left.get(item.book_id, 0),
+            slots_left.get(item.student_id, 0),
+            (item.student_id, item.book_id) in open_loans
+        )
+        if error:
+            results.append(batch_result(index, error=error))
+            continue
+        copies_left[item.book_id] -= 1
+        slots_left[item.student_id] -= 1
+        open_loans.add((item.student_id, item.book_id))
+        accepted.append((index, item))
+
+    # Take the copies and borrow slots with one guarded UPDATE each, in case
+    # another desk changed them since they were read
+    taken_books = circulation.take_copies(db, Counter(item.book_id for _, item in accepted))
+    for index, item in accepted:
+        if item.book_id not in taken_books:
+            results.append(batch_result(index, error="No copies available for borrowing"))
+    accepted = [(index, item) for index, item in accepted if item.book_id in taken_books]
+
+    granted = circulation.take_borrow_slots(
+        db, Counter(item.student_id for _, item in accepted), BORROW_LIMIT
+    )
+    refused = [(index, item) for index, item in accepted if item.student_id not in granted]
+    for index, item in refused:
+        results.append(batch_result(index, error=f"Student has reached maximum borrow limit ({BORROW_LIMIT} books)"))
+    circulation.return_copies(db, Counter(item.book_id for _, item in refused))
+    accepted = [(index, item) for index, item in accepted if item.student_id in granted]
+
+    # Insert all borrow records with one executemany. The UPDATEs above hold
+    # the write lock, so the new rows are the ones after the current last id;
+    # a student holds at most one open loan per book, which tells them apart.
+    now = datetime.utcnow()
+    last_id = db.query(func.max(models.BorrowRecord.id)).scalar() or 0
+    if accepted:
+        db.execute(insert(models.BorrowRecord), [
+            {
+                "book_id": item.book_id,
+                "student_id": item.student_id,
+                "admin_id": current_admin.id,
+                "borrow_date": now,
+                "due_date": item.due_date
+            }
+            for _, item in accepted
+        ])
+
+    def load_new_records():
+        return {
+            (borrow.student_id, borrow.book_id): borrow
+            for borrow in borrow_records_query(db).filter(
+                models.BorrowRecord.id > last_id,
+                tuple_(models.BorrowRecord.student_id, models.BorrowRecord.book_id).in_(
+                    [(item.student_id, item.book_id) for _, item in accepted]
+                )
+            ).populate_existing()
+        }
+
+    if accepted:
+        circulation.record_borrows(db, list(load_new_records().values()))
+        # Reload once more: the counter update expired the loaded students
+        loaded = load_new_records()
+        for index, item in accepted:
+            results.append(batch_result(index, borrow=loaded[(item.student_id, item.book_id)]))
+
+    response = batch_response(results)
+    db.commit()
+    return response
+
+@app.post("/api/borrows/batch-return", response_model=schemas.BorrowBatchResponse)
+@instrumentation.query_budget(7)
+def return_borrow_batch(
+    batch: schemas.BorrowBatchReturn,
+    db: Session = Depends(database.get_db),
+    current_admin: models.Admin = Depends(get_current_admin)
+):
+    if not current_admin:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if len(batch.borrow_ids) > BORROW_BATCH_LIMIT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch can hold at most {BORROW_BATCH_LIMIT} items"
+        )
+
+    # Close every open loan of the batch with one guarded UPDATE
+    closed = circulation.close_loans(db, set(batch.borrow_ids))
+    records = {
+        borrow.id: borrow for borrow in borrow_records_query(db).filter(
+            models.BorrowRecord.id.in_(set(batch.borrow_ids))
+        )
+    }
+    circulation.return_copies(db, Counter(records[borrow_id].book_id for borrow_id in closed))
+    circulation.record_returns(db, [records[borrow_id] for borrow_id in closed])
+    if closed:
+        # Reload once: the counter update expired the loaded students
+        records.update(
+            (borrow.id, borrow) for borrow in borrow_records_query(db).filter(
+                models.BorrowRecord.id.in_(closed)
+            ).populate_existing()
+        )
+
+    results = []
+    reported = set()
+    for index, borrow_id in enumerate(batch.borrow_ids):
+        if borrow_id not in records:
+            results.append(batch_result(index, error="Borrow record not found"))
+        elif borrow_id in closed and borrow_id not in reported:
+            reported.add(borrow_id)
+            results.append(batch_result(index, borrow=records[borrow_id]))
+        else:
+            results.append(batch_result(index, error="Book already returned"))
+
+    response = batch_response(results)
+    db.commit()
+    return response
+
 @app.get("/api/borrows/", response_model=List[schemas.BorrowResponse])
+@instrumentation.query_budget(3)
 async def list_borrows(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 10,
+    cursor: Optional[str] = None,
     student_id: Optional[int] = None,
     book_id: Optional[int] = None,
     status: Optional[str] = None,  # active, returned, overdue
-    db: Session = Depends(database.get_db),
+    fast: bool = False,
+    db: AsyncSession = Depends(database.get_async_db),
     current_admin: models.Admin = Depends(get_current_admin)
 ):
     if not current_admin:
         raise HTTPException(status_code=401, detail="Not authenticated")
+
+    # Nothing written and no loan turned overdue since the client's copy
+    versions = (await db.execute(conditional.list_validators_select(
+        ("books", "students", "borrow_records"), due_dates=True
+    ))).one()
+    etag = conditional.make_etag("borrows", *versions)
+    unchanged = conditional.not_modified(request, etag)
+    if unchanged:
+        return unchanged
     
-    # Base query
-    query = db.query(models.BorrowRecord)
+    # Base query; fast=true reads plain rows for the fast JSON path,
+    # skipping the response_model validation (see fastjson.py)
+    query = fastjson.borrow_rows_select() if fast else borrow_records_select()
     
     # Apply filters
     if student_id:
-        query = query.filter(models.BorrowRecord.student_id == student_id)
+        query = query.where(models.BorrowRecord.student_id == student_id)
     if book_id:
-        query = query.filter(models.BorrowRecord.book_id == book_id)
+        query = query.where(models.BorrowRecord.book_id == book_id)
     if status:
         if status == "active":
-            query = query.filter(models.BorrowRecord.return_date == None)
+            query = query.where(models.BorrowRecord.return_date == None)
         elif status == "returned":
-            query = query.filter(models.BorrowRecord.return_date != None)
+            query = query.where(models.BorrowRecord.return_date != None)
         elif status == "overdue":
-            query = query.filter(
+            query = query.where(
                 models.BorrowRecord.return_date == None,
                 models.BorrowRecord.due_date < datetime.utcnow()
             )
     
-    return query.offset(skip).limit(limit).all()
+    # Apply pagination
+    if cursor:
+        query = query.where(pagination.after_cursor([models.BorrowRecord.id], cursor))
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.order_by(models.BorrowRecord.id).limit(limit))
+    if not fast:
+        borrows = result.scalars().all()
+        pagination.set_next_cursor(response, borrows, limit, key=lambda borrow: [borrow.id])
+        conditional.set_validators(response, etag)
+        return borrows
+    rows = result.all()
+    page = fastjson.FastJSONResponse(fastjson.borrow_payload(rows))
+    pagination.set_next_cursor(page, rows, limit, key=lambda row: [row.id])
+    conditional.set_validators(page, etag)
+    return page
 
 @app.get("/api/borrows/{borrow_id}", response_model=schemas.BorrowResponse)
+@instrumentation.query_budget(2)
 async def get_borrow(
     borrow_id: int,
-    db: Session = Depends(database.get_db),
+    db: AsyncSession = Depends(database.get_async_db),
     current_admin: models.Admin = Depends(get_current_admin)
 ):
     if not current_admin:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    db_borrow = db.query(models.BorrowRecord).filter(models.BorrowRecord.id == borrow_id).first()
+    db_borrow = (await db.execute(
+        borrow_records_select().where(models.BorrowRecord.id == borrow_id)
+    )).scalars().first()
     if not db_borrow:
         raise HTTPException(status_code=404, detail="Borrow record not found")
 
@@ -1131,7 +1633,8 @@ async def get_borrow(
 
 # Reports endpoints
 @app.get("/api/reports/", response_model=schemas.ReportResponse)
-async def get_reports(
+@instrumentation.query_budget(6)
+def get_reports(
     date_range: schemas.DateRangeFilter = Depends(),
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
@@ -1147,27 +1650,36 @@ async def get_reports(
         query = query.filter(models.BorrowRecord.borrow_date <= date_range.end_date)
     
     # Get borrow statistics
-    total_borrows = query.count()
-    active_borrows = query.filter(models.BorrowRecord.return_date == None).count()
-    overdue_borrows = query.filter(
-        models.BorrowRecord.return_date == None,
-        models.BorrowRecord.due_date < datetime.utcnow()
-    ).count()
-    returned_borrows = query.filter(models.BorrowRecord.return_date != None).count()
-    
-    # Get books by category
-    books_by_category = {}
-    for category in BookCategory:
-        count = query.join(models.Book).filter(models.Book.category == category).count()
-        if count > 0:
-            books_by_category[category] = count
+    is_open = models.BorrowRecord.return_date == None
+    counts = query.with_entities(
+        func.count(models.BorrowRecord.id).label('total'),
+        func.sum(case((is_open, 1), else_=0)).label('active'),
+        func.sum(case((and_(is_open, models.BorrowRecord.due_date < datetime.utcnow()), 1), else_=0)).label('overdue')
+    ).one()
+    total_borrows = counts.total
+    active_borrows = counts.active or 0
+    overdue_borrows = counts.overdue or 0
+    returned_borrows = total_borrows - active_borrows
+    
+    # Get borrows by book category
+    category_counts = dict(query.join(models.Book).with_entities(
+        models.Book.category, func.count(models.BorrowRecord.id)
+    ).group_by(models.Book.category).all())
+    books_by_category = {
+        category.value: category_counts[category]
+        for category in BookCategory
+        if category_counts.get(category)
+    }
     
     # Get borrows by department
-    borrows_by_department = {}
-    for department in Department:
-        count = query.join(models.Student).filter(models.Student.department == department).count()
-        if count > 0:
-            borrows_by_department[department] = count
+    department_counts = dict(query.join(models.Student).with_entities(
+        models.Student.department, func.count(models.BorrowRecord.id)
+    ).group_by(models.Student.department).all())
+    borrows_by_department = {
+        department.value: department_counts[department]
+        for department in Department
+        if department_counts.get(department)
+    }
     
     # Get popular books
     popular_books_query = db.query(
@@ -1178,15 +1690,19 @@ async def get_reports(
     popular_books = []
     for book, count in popular_books_query.all():
         popular_books.append({
-            "id": book.id,
+            "book_id": book.id,
             "title": book.title,
-            "author": book.author,
-            "category": book.category,
             "borrow_count": count
         })
     
-    # Get recent borrows
-    recent_borrows = query.order_by(desc(models.BorrowRecord.borrow_date)).limit(5).all()
+    # Get daily borrows
+    borrow_day = func.date(models.BorrowRecord.borrow_date)
+    daily_borrows = [
+        {"date": day, "count": count}
+        for day, count in query.with_entities(
+            borrow_day, func.count(models.BorrowRecord.id)
+        ).group_by(borrow_day).order_by(borrow_day).all()
+    ]
     
     return {
         "stats": {
@@ -1194,26 +1710,30 @@ async def get_reports(
             "active_borrows": active_borrows,
             "overdue_borrows": overdue_borrows,
             "returned_borrows": returned_borrows,
+            "return_rate": returned_borrows / total_borrows if total_borrows else 0.0,
             "books_by_category": books_by_category,
             "borrows_by_department": borrows_by_department
         },
         "popular_books": popular_books,
-        "recent_borrows": recent_borrows
+        "department_distribution": borrows_by_department,
+        "daily_borrows": daily_borrows
     }
 
 
+# Paths served without a login; /metrics is scraped by Prometheus, and the
+# static files are the same for everyone
+PUBLIC_PATHS = ("/login", "/metrics", "/static/")
+
+# Compress pages and API responses. Added first so that it runs innermost,
+# where route responses still arrive whole and keep a Content-Length, and
+# inside the timing middleware so its cost shows in the request metrics
+app.add_middleware(compression.CompressionMiddleware)
+
 # Middleware to handle authentication redirects
 @app.middleware("http")
 async def auth_middleware(request: Request, call_next):
-    if not request.url.path.startswith("/login"):
-        token = request.cookies.get("access_token")
-        if not token or not token.startswith("Bearer "):
-            return RedirectResponse(url="/login", status_code=303)
-        try:
-            token_data = verify_token(token.split(" ")[1])
-            if not token_data:
-                return RedirectResponse(url="/login", status_code=303)
-        except:
+    if not request.url.path.startswith(PUBLIC_PATHS):
+        if not get_token_payload(request):
             return RedirectResponse(url="/login", status_code=303)
     response = await call_next(request)
     return response
@@ -1225,16 +1745,61 @@ def get_categories():
 def get_departments():
     return [{"value": dept.value} for dept in Department]
 
-# Setup templates and static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Setup templates and static files; templates link the static files with
+# asset_url('css/style.css'), which gives their content-hashed URL
+static_assets = assets.StaticAssets("static", prefix="/static")
+app.mount("/static", static_assets, name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["asset_url"] = static_assets.url
 
 # Add session middleware with a secret key
 app.add_middleware(SessionMiddleware, secret_key="your-secret-key-here")
 
+# Count and time the SQL statements of every request
+instrumentation.install_query_hooks(database.engine)
+instrumentation.install_query_hooks(database.async_engine.sync_engine)
+route_paths = {}
+
+def route_path(request: Request) -> str:
+    """Path template ('/path/{param}') of the route that served request, not its raw URL"""
+    endpoint = request.scope.get("endpoint")
+    if not route_paths:
+        route_paths.update(
+            (route.endpoint, route.path) for route in app.routes if hasattr(route, "endpoint")
+        )
+    return route_paths.get(endpoint, "unmatched")
+
+# Request and pool metrics for GET /metrics
+metrics_engines = {"sync": database.engine, "async": database.async_engine.sync_engine}
+for engine_name, metrics_engine in metrics_engines.items():
+    metrics.sqlite_errors.install(metrics_engine, engine_name)
+
+@app.middleware("http")
+async def query_stats_middleware(request: Request, call_next):
+    stats = instrumentation.start_request()
+    metrics.request_metrics.in_flight += 1
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.request_metrics.in_flight -= 1
+    path = route_path(request)
+    route = f"{request.method} {path}"
+    response.headers["Server-Timing"] = stats.server_timing()
+    if metrics.METRICS_ENABLED:
+        metrics.request_metrics.observe(request.method, path, response.status_code, stats.total_seconds)
+    instrumentation.log_request(request.method, route, response.status_code, stats)
+    instrumentation.check_query_budget(request.scope.get("endpoint"), route, stats)
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    caches = {"admin": admin_cache, "dashboard": dashboard_cache}
+    return Response(content=metrics.render(metrics_engines, caches, password_hash_stats), media_type=metrics.CONTENT_TYPE)
+
 # Frontend routes
 @app.get("/books")
-async def books_page(
+@instrumentation.query_budget(3)
+def books_page(
     request: Request,
     page: int = 1,
     search: str = None,
@@ -1249,13 +1814,7 @@ async def books_page(
     # Query books with filters
     query = db.query(models.Book)
     if search:
-        query = query.filter(
-            or_(
-                models.Book.title.ilike(f"%{search}%"),
-                models.Book.author.ilike(f"%{search}%"),
-                models.Book.isbn.ilike(f"%{search}%")
-            )
-        )
+        query = search_module.apply_book_search(query, search)
     if category:
         query = query.filter(models.Book.category == category)
     if availability:
@@ -1264,29 +1823,34 @@ async def books_page(
         elif availability == "borrowed":
             query = query.filter(models.Book.available_quantity == 0)
             
-    # Pagination
-    total = query.count()
+    # Pagination; one extra row tells whether there is a next page
     per_page = 10
-    total_pages = (total + per_page - 1) // per_page
-    
-    books = query.offset((page - 1) * per_page).limit(per_page).all()
+    count = counts_module.page_count(
+        db, "books", query,
+        {"search": search, "category": category, "availability": availability},
+        table_versions.get("books"), estimate=bool(search)
+    )
+    books = query.offset((page - 1) * per_page).limit(per_page + 1).all()
     
     return templates.TemplateResponse(
         "books.html",
         {
             "request": request,
-            "books": books,
+            "books": books[:per_page],
             "current_admin": current_admin,
             "categories": get_categories(),
             "current_page": page,
+            "total_pages": count.pages(per_page),
+            "count": count,
             "prev_page": page - 1 if page > 1 else None,
-            "next_page": page + 1 if page < total_pages else None,
+            "next_page": page + 1 if len(books) > per_page else None,
             "active_page": "books"
         }
     )
 
 @app.get("/students")
-async def students_page(
+@instrumentation.query_budget(3)
+def students_page(
     request: Request,
     page: int = 1,
     search: str = None,
@@ -1316,29 +1880,34 @@ async def students_page(
         elif status == "inactive":
             query = query.filter(models.Student.is_active == False)
             
-    # Pagination
-    total = query.count()
+    # Pagination; one extra row tells whether there is a next page
     per_page = 10
-    total_pages = (total + per_page - 1) // per_page
-    
-    students = query.offset((page - 1) * per_page).limit(per_page).all()
+    count = counts_module.page_count(
+        db, "students", query,
+        {"search": search, "department": department, "status": status},
+        table_versions.get("students"), estimate=bool(search)
+    )
+    students = query.offset((page - 1) * per_page).limit(per_page + 1).all()
     
     return templates.TemplateResponse(
         "students.html",
         {
             "request": request,
-            "students": students,
+            "students": students[:per_page],
             "current_admin": current_admin,
             "departments": get_departments(),
             "current_page": page,
+            "total_pages": count.pages(per_page),
+            "count": count,
             "prev_page": page - 1 if page > 1 else None,
-            "next_page": page + 1 if page < total_pages else None,
+            "next_page": page + 1 if len(students) > per_page else None,
             "active_page": "students"
         }
     )
 
 @app.get("/borrows")
-async def borrows_page(
+@instrumentation.query_budget(4)
+def borrows_page(
     request: Request,
     page: int = 1,
     search: str = None,
@@ -1354,13 +1923,11 @@ async def borrows_page(
     # Query borrows with filters
     query = db.query(models.BorrowRecord)
     if search:
-        query = query.join(models.Book).join(models.Student).filter(
-            or_(
-                models.Book.title.ilike(f"%{search}%"),
-                models.Student.fullname.ilike(f"%{search}%"),
-                models.Student.student_id.ilike(f"%{search}%")
-            )
-        )
+        query = query.join(models.Student).filter(or_(
+            models.Student.fullname.ilike(f"%{search}%"),
+            models.Student.student_id.ilike(f"%{search}%"),
+            models.BorrowRecord.book_id.in_(search_module.book_search_ids(search))
+        ))
     if status:
         if status == "borrowed":
             query = query.filter(models.BorrowRecord.return_date == None)
@@ -1378,33 +1945,34 @@ async def borrows_page(
     if end_date:
         query = query.filter(models.BorrowRecord.borrow_date <= end_date)
             
-    # Pagination
-    total = query.count()
+    # Pagination; one extra row tells whether there is a next page
     per_page = 10
-    total_pages = (total + per_page - 1) // per_page
-    
-    borrows = query.offset((page - 1) * per_page).limit(per_page).all()
-    
-    # Get available books for new borrow
-    available_books = db.query(models.Book).filter(models.Book.available_quantity > 0).all()
+    count = counts_module.page_count(
+        db, "borrow_records", query,
+        {"search": search, "status": status, "start_date": start_date, "end_date": end_date},
+        table_versions.get("borrow_records", "students", "books"), estimate=bool(search)
+    )
+    borrows = query.options(*borrow_response_options()).offset((page - 1) * per_page).limit(per_page + 1).all()
     
+    # The new borrow form finds students and books through /api/lookup/
     return templates.TemplateResponse(
         "borrows.html",
         {
             "request": request,
-            "borrows": borrows,
+            "borrows": borrows[:per_page],
             "current_admin": current_admin,
-            "available_books": available_books,
-            "students": db.query(models.Student).filter(models.Student.is_active == True).all(),
             "current_page": page,
+            "total_pages": count.pages(per_page),
+            "count": count,
             "prev_page": page - 1 if page > 1 else None,
-            "next_page": page + 1 if page < total_pages else None,
+            "next_page": page + 1 if len(borrows) > per_page else None,
             "active_page": "borrows"
         }
     )
 
 @app.get("/reports")
-async def reports_page(
+@instrumentation.query_budget(8)
+def reports_page(
     request: Request,
     report_type: str = "borrows",
     start_date: str = None,
@@ -1431,24 +1999,13 @@ async def reports_page(
     # Get borrow trends (last 7 days)
     today = datetime.now().date()
     week_ago = today - timedelta(days=7)
-    trends_query = db.query(
-        func.date(models.BorrowRecord.borrow_date).label('date'),
-        func.count().label('count')
-    ).filter(
-        func.date(models.BorrowRecord.borrow_date) >= week_ago
-    ).group_by(
-        func.date(models.BorrowRecord.borrow_date)
-    ).order_by(
-        func.date(models.BorrowRecord.borrow_date)
-    )
-    
     borrow_trends = {
         "labels": [],
         "data": []
     }
-    for trend in trends_query.all():
-        borrow_trends["labels"].append(datetime.strptime(trend.date, "%Y-%m-%d").strftime("%Y-%m-%d"))
-        borrow_trends["data"].append(trend.count)
+    for day, count in circulation.daily_borrow_counts(db, start=week_ago):
+        borrow_trends["labels"].append(day.strftime("%Y-%m-%d"))
+        borrow_trends["data"].append(count)
         
     # Get popular books
     popular_books_query = db.query(
@@ -1471,7 +2028,9 @@ async def reports_page(
         popular_books["data"].append(book.borrow_count)
     
     # Get recent borrows
-    recent_borrows = trends_query.order_by(desc(models.BorrowRecord.borrow_date)).limit(5).all()
+    recent_borrows = borrow_records_query(db).order_by(
+        desc(models.BorrowRecord.borrow_date)
+    ).limit(5).all()
     
     return templates.TemplateResponse(
         "reports.html",
@@ -1486,18 +2045,31 @@ async def reports_page(
     )
 
 @app.get("/reports/export")
-async def export_report(
+def export_report(
     report_type: str = "borrows",
     start_date: str = None,
     end_date: str = None,
-    current_admin: models.Admin = Depends(get_current_admin),
-    db: Session = Depends(database.get_db)
+    export_format: str = Query("csv", alias="format"),
+    current_admin: models.Admin = Depends(get_current_admin)
 ):
     if not current_admin:
         return RedirectResponse(url="/login", status_code=303)
-        
-    # Implementation for report export
-    pass
+
+    if export_format not in export_module.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown export format, expected csv or ndjson")
+    stmt = export_module.report_select(
+        report_type,
+        export_module.parse_report_date(start_date, "start_date"),
+        export_module.parse_report_date(end_date, "end_date")
+    )
+
+    # Rows are streamed from the database in batches instead of built up in memory
+    filename = f"{report_type}-report-{datetime.utcnow():%Y%m%d}.{export_format}"
+    return StreamingResponse(
+        export_module.stream_report(stmt, export_format),
+        media_type=export_module.EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request, current_admin: Optional[models.Admin] = Depends(get_current_admin)):
@@ -1521,9 +2093,9 @@ async def login_page(
 async def login(
     request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    admin = authenticate_admin(db, form_data.username, form_data.password)
+    admin = await authenticate_admin(db, form_data.username, form_data.password)
     if not admin:
         return templates.TemplateResponse(
             "login.html",
@@ -1551,36 +2123,13 @@ async def logout():
     response.delete_cookie("access_token")
     return response
 
-@app.get("/books/", response_class=HTMLResponse)
-async def books_page(
-    request: Request,
-    current_admin: Optional[models.Admin] = Depends(get_current_admin),
-    db: Session = Depends(database.get_db)
-):
-    if not current_admin:
-        return RedirectResponse(url="/login")
-    
-    books = db.query(models.Book).all()
-    categories = [category.value for category in BookCategory]
-    departments = [dept.value for dept in Department]
-    
-    return templates.TemplateResponse(
-        "books.html",
-        {
-            "request": request,
-            "current_admin": current_admin,
-            "books": books,
-            "categories": categories,
-            "departments": departments
-        }
-    )
-
 def get_current_time():
     """Get current time in UTC with timezone info"""
     return datetime.now(timezone.utc)
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(
+@instrumentation.query_budget(8)
+def dashboard(
     request: Request,
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
@@ -1591,6 +2140,30 @@ async def dashboard(
     # Get current time in UTC
     current_time = get_current_time()
 
+    # Versions are read before the queries run: a write committed meanwhile
+    # moves the key on, so the result is never cached as newer than it is.
+    # The next due date of an open loan moves it on when that loan turns
+    # overdue, which changes the overdue count without any write.
+    next_due_date = db.execute(conditional.list_validators_select((), due_dates=True)).scalar()
+    key = (*table_versions.get("books", "students", "borrow_records"), next_due_date)
+    dashboard_data = dashboard_cache.get(key)
+    if dashboard_data is None:
+        dashboard_data = dashboard_stats(db, current_time)
+        dashboard_cache.set(key, dashboard_data)
+
+    return templates.TemplateResponse(
+        "dashboard.html",
+        {
+            "request": request,
+            "current_admin": current_admin,
+            "active_page": "dashboard",
+            **dashboard_data,
+            "now": current_time
+        }
+    )
+
+def dashboard_stats(db: Session, current_time: datetime) -> dict:
+    """Counts, recent borrows and department distribution shown on the dashboard"""
     # Get statistics
     stats = {
         "total_books": db.query(models.Book).count(),
@@ -1604,59 +2177,59 @@ async def dashboard(
         ).count()
     }
 
-    # Get recent borrows
-    recent_borrows = db.query(models.BorrowRecord).order_by(
-        desc(models.BorrowRecord.borrow_date)
-    ).limit(5).all()
+    # Recent borrows as plain values: the result is cached and shared
+    # between requests, so it must not hold ORM instances of this session
+    def as_utc(value):
+        return value.replace(tzinfo=timezone.utc) if value and value.tzinfo is None else value
 
-    # Make datetime objects timezone-aware
-    for borrow in recent_borrows:
-        if borrow.borrow_date and borrow.borrow_date.tzinfo is None:
-            borrow.borrow_date = borrow.borrow_date.replace(tzinfo=timezone.utc)
-        if borrow.due_date and borrow.due_date.tzinfo is None:
-            borrow.due_date = borrow.due_date.replace(tzinfo=timezone.utc)
-        if borrow.return_date and borrow.return_date.tzinfo is None:
-            borrow.return_date = borrow.return_date.replace(tzinfo=timezone.utc)
+    recent_borrows = [
+        {
+            "student_name": borrow.student.fullname,
+            "book_title": borrow.book.title,
+            "borrow_date": as_utc(borrow.borrow_date),
+            "due_date": as_utc(borrow.due_date),
+            "return_date": as_utc(borrow.return_date),
+        }
+        for borrow in borrow_records_query(db).order_by(
+            desc(models.BorrowRecord.borrow_date)
+        ).limit(5)
+    ]
 
     # Format recent activities
     recent_activities = [
         {
-            "timestamp": borrow.borrow_date.strftime("%Y-%m-%d %H:%M"),
+            "timestamp": borrow["borrow_date"].strftime("%Y-%m-%d %H:%M"),
             "description": (
-                f"{'Returned' if borrow.return_date else 'Borrowed'}: "
-                f"{borrow.book.title} by {borrow.student.fullname}"
+                f"{'Returned' if borrow['return_date'] else 'Borrowed'}: "
+                f"{borrow['book_title']} by {borrow['student_name']}"
             )
         }
         for borrow in recent_borrows
     ]
 
     # Get department distribution
-    department_stats = {}
-    for dept in Department:
-        count = db.query(models.Student).filter(
-            models.Student.department == dept,
-            models.Student.is_active == True
-        ).count()
-        if count > 0:
-            department_stats[dept.value] = count
+    department_counts = dict(db.query(
+        models.Student.department, func.count(models.Student.id)
+    ).filter(
+        models.Student.is_active == True
+    ).group_by(models.Student.department).all())
+    department_stats = {
+        dept.value: department_counts[dept]
+        for dept in Department
+        if department_counts.get(dept)
+    }
 
-    return templates.TemplateResponse(
-        "dashboard.html",
-        {
-            "request": request,
-            "current_admin": current_admin,
-            "active_page": "dashboard",
-            "stats": stats,
-            "recent_borrows": recent_borrows,
-            "recent_activities": recent_activities,
-            "department_labels": list(department_stats.keys()),
-            "department_data": list(department_stats.values()),
-            "now": current_time
-        }
-    )
+    return {
+        "stats": stats,
+        "recent_borrows": recent_borrows,
+        "recent_activities": recent_activities,
+        "department_labels": list(department_stats.keys()),
+        "department_data": list(department_stats.values()),
+    }
 
 @app.get("/reports/data")
-async def get_report_data(
+@instrumentation.query_budget(16)
+def get_report_data(
     request: Request,
     report_type: str = "all",
     start_date: Optional[str] = None,
@@ -1688,21 +2261,12 @@ async def get_report_data(
         ).count()
     }
 
-    # Get borrow trends
-    trends_query = db.query(
-        func.date(models.BorrowRecord.borrow_date).label('date'),
-        func.count(models.BorrowRecord.id).label('count')
+    # Get borrow trends from the daily rollup
+    trends = circulation.daily_borrow_counts(
+        db,
+        start=start_datetime.date() if start_datetime else None,
+        end=end_datetime.date() if end_datetime else None
     )
-    if start_datetime:
-        trends_query = trends_query.filter(models.BorrowRecord.borrow_date >= start_datetime)
-    if end_datetime:
-        trends_query = trends_query.filter(models.BorrowRecord.borrow_date <= end_datetime)
-    
-    trends = trends_query.group_by(
-        func.date(models.BorrowRecord.borrow_date)
-    ).order_by(
-        func.date(models.BorrowRecord.borrow_date)
-    ).all()
 
     borrow_trends = {
         "labels": [],
@@ -1846,7 +2410,8 @@ async def delete_book(
     return {"message": "Book deleted successfully"}
 
 @app.post("/api/borrows/", response_model=schemas.BorrowResponse)
-async def create_borrow(
+@instrumentation.query_budget(12)
+def create_borrow(
     borrow: schemas.BorrowCreate,
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
@@ -1868,11 +2433,7 @@ async def create_borrow(
         raise HTTPException(status_code=400, detail="No copies available for borrowing")
     
     # Check if student has reached their limit
-    active_borrows = db.query(models.BorrowRecord).filter(
-        models.BorrowRecord.student_id == student.id,
-        models.BorrowRecord.return_date == None
-    ).count()
-    if active_borrows >= 3:  # Maximum 3 books per student
+    if student.borrowed_books_count >= 3:  # Maximum 3 books per student
         raise HTTPException(
             status_code=400,
             detail="Student has reached maximum borrow limit (3 books)"
@@ -1893,17 +2454,26 @@ async def create_borrow(
         due_date=borrow.due_date
     )
     
-    # Update book status
-    book.available_quantity -= 1
+    # Take the copy and the borrowing slot with conditional UPDATEs; the
+    # checks above can be stale when several desks check out at once
+    if not circulation.take_copy(db, book.id):
+        raise HTTPException(status_code=400, detail="No copies available for borrowing")
+    if not circulation.take_borrow_slot(db, student.id, 3):
+        raise HTTPException(
+            status_code=400,
+            detail="Student has reached maximum borrow limit (3 books)"
+        )
 
     db.add(db_borrow)
+    circulation.record_borrow(db, db_borrow)
     db.commit()
     db.refresh(db_borrow)
     
     return db_borrow
 
 @app.post("/api/borrows/{borrow_id}/return", response_model=schemas.BorrowResponse)
-async def return_book(
+@instrumentation.query_budget(9)
+def return_book(
     borrow_id: int,
     db: Session = Depends(database.get_db),
     current_admin: models.Admin = Depends(get_current_admin)
@@ -1920,59 +2490,30 @@ async def return_book(
     if borrow.return_date:
         raise HTTPException(status_code=400, detail="Book already returned")
     
-    # Update borrow record and book status
-    borrow.return_date = datetime.utcnow()
-    borrow.book.available_quantity += 1
+    # Close the loan unless another request returned it first
+    if not circulation.close_loan(db, borrow):
+        raise HTTPException(status_code=400, detail="Book already returned")
+    circulation.return_copy(db, borrow.book_id)
     
+    circulation.record_return(db, borrow)
     db.commit()
     db.refresh(borrow)
     
     return borrow
 
-@app.get("/api/borrows/", response_model=List[schemas.BorrowResponse])
-async def list_borrows(
-    skip: int = 0,
-    limit: int = 10,
-    student_id: Optional[int] = None,
-    book_id: Optional[int] = None,
-    status: Optional[str] = None,  # active, returned, overdue
-    db: Session = Depends(database.get_db),
-    current_admin: models.Admin = Depends(get_current_admin)
-):
-    if not current_admin:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    # Base query
-    query = db.query(models.BorrowRecord)
-    
-    # Apply filters
-    if student_id:
-        query = query.filter(models.BorrowRecord.student_id == student_id)
-    if book_id:
-        query = query.filter(models.BorrowRecord.book_id == book_id)
-    if status:
-        if status == "active":
-            query = query.filter(models.BorrowRecord.return_date == None)
-        elif status == "returned":
-            query = query.filter(models.BorrowRecord.return_date != None)
-        elif status == "overdue":
-            query = query.filter(
-                models.BorrowRecord.return_date == None,
-                models.BorrowRecord.due_date < datetime.utcnow()
-            )
-    
-    return query.offset(skip).limit(limit).all()
-
 @app.get("/api/borrows/{borrow_id}", response_model=schemas.BorrowResponse)
+@instrumentation.query_budget(2)
 async def get_borrow(
     borrow_id: int,
-    db: Session = Depends(database.get_db),
+    db: AsyncSession = Depends(database.get_async_db),
     current_admin: models.Admin = Depends(get_current_admin)
 ):
     if not current_admin:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    db_borrow = db.query(models.BorrowRecord).filter(models.BorrowRecord.id == borrow_id).first()
+    db_borrow = (await db.execute(
+        borrow_records_select().where(models.BorrowRecord.id == borrow_id)
+    )).scalars().first()
     if not db_borrow:
         raise HTTPException(status_code=404, detail="Borrow record not found")
 
@@ -2042,7 +2583,7 @@ async def delete_student(
 
 # Borrow CRUD Operations
 @app.put("/api/borrows/{borrow_id}", response_model=schemas.BorrowResponse)
-async def update_borrow(
+def update_borrow(
     borrow_id: int,
     borrow_update: schemas.BorrowUpdate,
     db: Session = Depends(database.get_db),
@@ -2055,11 +2596,23 @@ async def update_borrow(
     if not db_borrow:
         raise HTTPException(status_code=404, detail="Borrow record not found")
 
+    previous_state = circulation.loan_state(db_borrow)
+
     # Only allow updating certain fields
     for field, value in borrow_update.dict(exclude_unset=True).items():
         if field in ['due_date', 'notes']:
             setattr(db_borrow, field, value)
 
+    # A new due date on an open loan can move the student's earliest due date
+    if not db_borrow.return_date:
+        circulation.sync_student_circulation(db, [db_borrow.student_id])
+    # and moves (or takes back) the loan's overdue transition in the rollup
+    circulation.update_daily_circulation(
+        db, db_borrow.id,
+        before=previous_state,
+        after=circulation.loan_state(db_borrow)
+    )
+
     db.commit()
     db.refresh(db_borrow)
     return db_borrow
@@ -2084,6 +2637,9 @@ async def delete_borrow(
             detail="Cannot delete active borrow record"
         )
 
+    circulation.update_daily_circulation(
+        db, db_borrow.id, before=circulation.loan_state(db_borrow)
+    )
     db.delete(db_borrow)
     db.commit()
     return {"success": True}
@@ -0,0 +1,189 @@
+import argparse
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+import database
+import models
+import circulation
+import search
+import counts as counts_module
+import importer
+import datagen
+
+def upgrade(args):
+    with database.engine.begin() as conn:
+        added_tables = database.missing_tables(conn)
+        models.Base.metadata.create_all(conn)
+        added = added_tables + database.add_missing_columns(conn)
+        added += [f"index {name}" for name in database.add_missing_indexes(conn)]
+        if search.ensure_book_search_index(conn):
+            added.append("books_fts search index")
+        if counts_module.ensure_row_counts(conn):
+            added.append("row_counts table counters")
+        if counts_module.ensure_table_versions(conn):
+            added.append("table_versions write counters")
+        if added:
+            # Refresh the planner statistics for the new tables and indexes
+            conn.exec_driver_sql("PRAGMA optimize")
+    with database.SessionLocal() as db:
+        if "students.active_borrow_count" in added or circulation.student_circulation_missing(db):
+            updated = circulation.sync_student_circulation(db)
+            db.commit()
+            added.append(f"circulation counters for {updated} students")
+    if "daily_circulation" in added_tables:
+        with database.SessionLocal() as db:
+            circulation.backfill_daily_circulation(db)
+            db.commit()
+    for item in added:
+        print(f"Added {item}")
+    print("Schema is up to date")
+
+def reconcile(args):
+    with database.SessionLocal() as db:
+        updated = circulation.sync_student_circulation(db)
+        db.commit()
+    with database.engine.begin() as conn:
+        counts_module.rebuild_row_counts(conn)
+    print(f"Rebuilt circulation counters for {updated} students and the table row counts")
+
+def backfill_circulation(args):
+    with database.SessionLocal() as db:
+        written = circulation.backfill_daily_circulation(db)
+        db.commit()
+    print(f"Rebuilt daily circulation rollup ({written} rows)")
+
+def import_file(args):
+    with database.SessionLocal() as db:
+        if args.admin:
+            admin = db.query(models.Admin).filter(models.Admin.username == args.admin).first()
+            if not admin:
+                sys.exit(f"No admin named {args.admin}")
+        else:
+            admin = db.query(models.Admin).order_by(models.Admin.id).first()
+
+        def on_progress(result):
+            print(
+                f"{result.processed} rows read, {result.inserted} imported, {result.rejected} rejected",
+                file=sys.stderr
+            )
+
+        rejects_path = args.rejects or f"{args.file}.rejects.csv"
+        with open(args.file, encoding="utf-8-sig", newline="") as lines, \
+                open(rejects_path, "w", newline="") as rejects_file:
+            result = importer.import_csv(
+                db, args.kind, lines,
+                admin_id=admin.id if admin else None,
+                on_reject=importer.RejectsWriter(rejects_file),
+                on_progress=on_progress
+            )
+    print(f"Imported {result.inserted} {args.kind}, rejected {result.rejected}")
+    if result.rejected:
+        print(f"Rejected rows written to {rejects_path}")
+
+def seed(args):
+    with database.engine.begin() as conn:
+        models.Base.metadata.create_all(conn)
+        search.ensure_book_search_index(conn)
+        counts_module.ensure_row_counts(conn)
+        counts_module.ensure_table_versions(conn)
+    borrows = datagen.SCALES.get(args.scale) or int(args.scale)
+    with database.SessionLocal() as db:
+        try:
+            counts = datagen.generate(
+                db, borrows, seed=args.seed,
+                progress=lambda message: print(f"Generated {message}", file=sys.stderr),
+                books=args.books
+            )
+        except ValueError as error:
+            sys.exit(str(error))
+    print(", ".join(f"{count} {name}" for name, count in counts.items()))
+
+def hot_queries():
+    """(description, indexes it may use, statement) for the circulation queries"""
+    record = models.BorrowRecord
+    now = datetime.utcnow()
+    is_open = record.return_date == None
+    return [
+        ("open loans of a student (limits, counters)", ("ix_borrow_records_open_student",),
+            select(func.count(record.id), func.min(record.due_date)).where(record.student_id == 1, is_open)),
+        # Either open loan index narrows this to a handful of rows
+        ("open loan of a title by a student", ("ix_borrow_records_open_student", "ix_borrow_records_open_book"),
+            select(record.id).where(record.student_id == 1, record.book_id == 1, is_open)),
+        ("overdue loans by due date", ("ix_borrow_records_open_due",),
+            select(record).where(is_open, record.due_date < now).order_by(record.due_date).limit(50)),
+        ("overdue loan count", ("ix_borrow_records_open_due",),
+            select(func.count(record.id)).where(is_open, record.due_date < now)),
+        ("open loans of a book", ("ix_borrow_records_open_book",),
+            select(record.id).where(record.book_id == 1, is_open)),
+        ("borrow history of a student", ("ix_borrow_records_student_borrowed",),
+            select(record).where(record.student_id == 1).order_by(record.borrow_date.desc()).limit(20)),
+        ("borrows of a book within dates", ("ix_borrow_records_book_borrowed",),
+            select(func.count(record.id)).where(record.book_id == 1, record.borrow_date >= now - timedelta(days=30))),
+        ("recent borrows", ("ix_borrow_records_borrow_date",),
+            select(record).order_by(record.borrow_date.desc()).limit(5)),
+        ("borrows within dates", ("ix_borrow_records_borrow_date",),
+            select(record).where(record.borrow_date >= now - timedelta(days=7)).order_by(record.borrow_date)),
+    ]
+
+def explain(args):
+    failed = 0
+    with database.engine.connect() as conn:
+        for description, indexes, stmt in hot_queries():
+            plan = database.explain_query_plan(conn, stmt)
+            uses_index = any(index in step for step in plan for index in indexes)
+            failed += not uses_index
+            print(f"{'ok' if uses_index else 'MISSING'}  {description} (expects {' or '.join(indexes)})")
+            for step in plan:
+                print(f"      {step}")
+    if failed:
+        sys.exit(f"{failed} queries do not use their index; `python manage.py upgrade` adds missing indexes")
+
+def reindex(args):
+    with database.engine.begin() as conn:
+        search.ensure_book_search_index(conn)
+        search.rebuild_book_search_index(conn)
+    print("Rebuilt the book search index")
+
+def main():
+    parser = argparse.ArgumentParser(description="Library Management System maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser(
+        "upgrade", help="Create missing tables and columns in an existing database"
+    ).set_defaults(func=upgrade)
+    commands.add_parser(
+        "reconcile", help="Rebuild per-student circulation counters and table row counts"
+    ).set_defaults(func=reconcile)
+    commands.add_parser(
+        "backfill-circulation", help="Rebuild the daily_circulation rollup from borrow_records"
+    ).set_defaults(func=backfill_circulation)
+    import_parser = commands.add_parser(
+        "import", help="Bulk import books or students from a CSV file"
+    )
+    import_parser.add_argument("kind", choices=sorted(importer.IMPORTS))
+    import_parser.add_argument("file", help="CSV file with a header row of field names")
+    import_parser.add_argument("--rejects", help="where to write rejected rows (default FILE.rejects.csv)")
+    import_parser.add_argument("--admin", help="username recorded as the creator (default the first admin)")
+    import_parser.set_defaults(func=import_file)
+    seed_parser = commands.add_parser(
+        "seed", help="Fill an empty database with a synthetic library for benchmarks"
+    )
+    seed_parser.add_argument(
+        "--scale", default="10k",
+        help=f"number of borrow records: {', '.join(datagen.SCALES)} or a count (default 10k)"
+    )
+    seed_parser.add_argument("--seed", type=int, default=42, help="random seed (default 42)")
+    seed_parser.add_argument("--books", type=int, help="catalog size (default a tenth of the borrows, at most 500k)")
+    seed_parser.set_defaults(func=seed)
+    commands.add_parser(
+        "reindex", help="Rebuild the full-text book search index"
+    ).set_defaults(func=reindex)
+    commands.add_parser(
+        "explain", help="Check that the circulation queries use their indexes (EXPLAIN QUERY PLAN)"
+    ).set_defaults(func=explain)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import bisect
+import os
+import threading
+import time
+from sqlalchemy import event
+
+# Process metrics in the Prometheus text format, served by GET /metrics.
+# Request metrics are recorded by the HTTP middleware, which always runs on
+# the event loop thread, so they are plain dicts updated without a lock.
+# Pool gauges are read from the pools when scraped. Each uvicorn worker
+# keeps its own numbers; scrape the workers separately.
+
+# LIBRARY_METRICS=0 turns request recording off (to measure its overhead)
+METRICS_ENABLED = os.getenv("LIBRARY_METRICS", "1") != "0"
+
+# Request duration buckets in seconds (the Prometheus client defaults)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class RequestMetrics:
+    """Request counts, latency histograms and in-flight requests per route"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.in_flight = 0
+        self.requests = {}    # (method, route, status) -> count
+        self.latency = {}     # (method, route) -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        series = self.latency.get((method, route))
+        if series is None:
+            series = self.latency[(method, route)] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def render(self) -> list:
+        lines = [
+            "# HELP library_http_requests_in_flight Requests being served",
+            "# TYPE library_http_requests_in_flight gauge",
+            f"library_http_requests_in_flight {self.in_flight}",
+            "# HELP library_http_requests_total Requests served, by route and status",
+            "# TYPE library_http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(
+                f'library_http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}'
+            )
+        lines += [
+            "# HELP library_http_request_duration_seconds Request latency, by route",
+            "# TYPE library_http_request_duration_seconds histogram",
+        ]
+        for (method, route), series in sorted(self.latency.items()):
+            labels = f'method="{method}",route="{_escape(route)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f'library_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"library_http_request_duration_seconds_sum{{{labels}}} {series[-1]:.6f}")
+            lines.append(f"library_http_request_duration_seconds_count{{{labels}}} {cumulative}")
+        return lines
+
+class SQLiteErrors:
+    """Statements that failed because SQLite stayed locked past busy_timeout.
+
+    SQLite waits and retries on a locked database itself, inside busy_timeout;
+    only the statements that ran out of it reach Python and are counted here.
+    These come from the threadpool, so the counters take a lock (rarely).
+    """
+
+    def __init__(self):
+        self.busy = {}
+        self._lock = threading.Lock()
+
+    def install(self, sync_engine, name: str):
+        self.busy.setdefault(name, 0)
+
+        @event.listens_for(sync_engine, "handle_error")
+        def count_busy(context):
+            message = str(context.original_exception).lower()
+            if "database is locked" in message or "database is busy" in message:
+                with self._lock:
+                    self.busy[name] += 1
+
+    def render(self) -> list:
+        lines = [
+            "# HELP library_sqlite_busy_errors_total Statements that gave up waiting for a SQLite lock",
+            "# TYPE library_sqlite_busy_errors_total counter",
+        ]
+        lines += [f'library_sqlite_busy_errors_total{{engine="{name}"}} {count}' for name, count in sorted(self.busy.items())]
+        return lines
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+def pool_lines(engines: dict) -> list:
+    """Gauges of the connection pools, read when scraped"""
+    gauges = {
+        "library_db_pool_size": ("Connections the pool keeps open", "size"),
+        "library_db_pool_checked_out": ("Connections in use", "checkedout"),
+        "library_db_pool_checked_in": ("Idle connections in the pool", "checkedin"),
+        "library_db_pool_overflow": ("Connections open beyond the pool size (negative while below it)", "overflow"),
+    }
+    lines = []
+    for metric, (help_text, method) in gauges.items():
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for name, engine in engines.items():
+            # StaticPool (in-memory databases) has no size or overflow
+            read = getattr(engine.pool, method, None)
+            if read is not None:
+                lines.append(f'{metric}{{engine="{name}"}} {read()}')
+    return lines
+
+def cache_lines(caches: dict) -> list:
+    """Hit and miss counters and sizes of the in-process caches"""
+    lines = [
+        "# HELP library_cache_hits_total Cache lookups answered from memory",
+        "# TYPE library_cache_hits_total counter",
+    ]
+    lines += [f'library_cache_hits_total{{cache="{name}"}} {cache.hits}' for name, cache in caches.items()]
+    lines += [
+        "# HELP library_cache_misses_total Cache lookups that had to be computed",
+        "# TYPE library_cache_misses_total counter",
+    ]
+    lines += [f'library_cache_misses_total{{cache="{name}"}} {cache.misses}' for name, cache in caches.items()]
+    lines += [
+        "# HELP library_cache_entries Entries held by the cache",
+        "# TYPE library_cache_entries gauge",
+    ]
+    lines += [f'library_cache_entries{{cache="{name}"}} {len(cache)}' for name, cache in caches.items()]
+    return lines
+
+def password_hash_lines(stats: dict) -> list:
+    """The bcrypt pool queue: logins waiting for a slot, hashing, and done"""
+    return [
+        "# HELP library_password_hash_waiting Password hashes waiting for a slot on the pool",
+        "# TYPE library_password_hash_waiting gauge",
+        f"library_password_hash_waiting {stats['waiting']}",
+        "# HELP library_password_hash_running Password hashes running on the pool",
+        "# TYPE library_password_hash_running gauge",
+        f"library_password_hash_running {stats['running']}",
+        "# HELP library_password_hash_completed_total Password hashes and verifications finished",
+        "# TYPE library_password_hash_completed_total counter",
+        f"library_password_hash_completed_total {stats['completed']}",
+        "# HELP library_password_hash_queue_wait_seconds_total Time spent waiting for a pool slot",
+        "# TYPE library_password_hash_queue_wait_seconds_total counter",
+        f"library_password_hash_queue_wait_seconds_total {stats['queue_wait_seconds']:.6f}",
+    ]
+
+request_metrics = RequestMetrics()
+sqlite_errors = SQLiteErrors()
+started = time.time()
+
+def render(engines: dict, caches: dict, password_hashing: dict) -> str:
+    lines = [
+        "# HELP library_process_start_time_seconds Start time of the process since the epoch",
+        "# TYPE library_process_start_time_seconds gauge",
+        f"library_process_start_time_seconds {started:.3f}",
+    ]
+    lines += request_metrics.render()
+    lines += pool_lines(engines)
+    lines += sqlite_errors.render()
+    lines += cache_lines(caches)
+    lines += password_hash_lines(password_hashing)
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Enum, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Enum, Date, DateTime, Boolean, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -31,19 +31,23 @@ class Student(Base):
     phone = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Also set by the circulation counter UPDATEs; validates API responses
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     admin_id = Column(Integer, ForeignKey("admins.id"))
+    # Circulation counters, kept in step with borrow_records by circulation.py
+    active_borrow_count = Column(Integer, default=0, server_default="0", nullable=False)
+    earliest_open_due_date = Column(DateTime, nullable=True)
     borrow_history = relationship("BorrowRecord", back_populates="student")
 
     @property
     def borrowed_books_count(self):
-        return sum(1 for record in self.borrow_history if not record.return_date)
+        return self.active_borrow_count or 0
 
     @property
     def has_overdue_books(self):
-        current_time = datetime.utcnow()
-        return any(
-            not record.return_date and record.due_date < current_time
-            for record in self.borrow_history
+        return (
+            self.earliest_open_due_date is not None
+            and self.earliest_open_due_date < datetime.utcnow()
         )
 
     @property
@@ -89,6 +93,23 @@ class BorrowRecord(Base):
     book = relationship("Book", back_populates="borrow_records")
     student = relationship("Student", back_populates="borrow_history")
 
+    # Access paths of the circulation queries. The partial indexes hold open
+    # loans only; SQLite uses them for queries filtering on return_date IS NULL.
+    # Existing databases get them from `manage.py upgrade`.
+    __table_args__ = (
+        # Open loans of a student: limits, duplicate checks, earliest due date
+        Index("ix_borrow_records_open_student", student_id, due_date, sqlite_where=return_date.is_(None)),
+        # Open and overdue loans by due date
+        Index("ix_borrow_records_open_due", due_date, sqlite_where=return_date.is_(None)),
+        # Open loans of a book
+        Index("ix_borrow_records_open_book", book_id, sqlite_where=return_date.is_(None)),
+        # Borrow history of a student or a book, newest first or within dates
+        Index("ix_borrow_records_student_borrowed", student_id, borrow_date),
+        Index("ix_borrow_records_book_borrowed", book_id, borrow_date),
+        # Recent borrows and date range reports
+        Index("ix_borrow_records_borrow_date", borrow_date),
+    )
+
     @property
     def is_overdue(self):
         return not self.return_date and self.due_date < datetime.utcnow()
@@ -96,3 +117,15 @@ class BorrowRecord(Base):
     @property
     def is_returned(self):
         return self.return_date is not None
+
+class DailyCirculation(Base):
+    """Per-day borrow/return rollup, maintained by circulation.py with each write"""
+    __tablename__ = "daily_circulation"
+
+    date = Column(Date, primary_key=True)
+    category = Column(Enum(BookCategory), primary_key=True)
+    department = Column(Enum(Department), primary_key=True)
+    borrows = Column(Integer, default=0, nullable=False)
+    returns = Column(Integer, default=0, nullable=False)
+    # Loans that passed their due date unreturned, counted on the due date
+    overdue_transitions = Column(Integer, default=0, nullable=False)
@@ -0,0 +1,58 @@
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+
+# Keyset ("cursor") pagination for the JSON list endpoints. A cursor is the
+# sort key of the last row of a page, JSON encoded and base64url wrapped so
+# clients treat it as opaque. The next page starts strictly after that key,
+# so page N costs the same as page 1 instead of re-scanning N * limit rows.
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps([_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = [_decode_value(value) for value in json.loads(raw)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def after_cursor(columns: list, cursor: str, descending: bool = False):
+    """Condition selecting the rows that sort after cursor on columns"""
+    values = decode_cursor(cursor, len(columns))
+    if len(columns) == 1:
+        return columns[0] < values[0] if descending else columns[0] > values[0]
+    if descending:
+        return tuple_(*columns) < tuple_(*values)
+    return tuple_(*columns) > tuple_(*values)
+
+def set_next_cursor(response: Response, rows: List, limit: int, key) -> Optional[str]:
+    """Put the cursor of the page after rows in the response headers.
+
+    key maps a row to its sort key values. No cursor is sent for a short
+    page, since there is nothing after it.
+    """
+    if not rows or len(rows) < limit:
+        return None
+    cursor = encode_cursor(key(rows[-1]))
+    response.headers[NEXT_CURSOR_HEADER] = cursor
+    return cursor
@@ -103,6 +103,28 @@ class BookResponse(BookBase):
     class Config:
         from_attributes = True
 
+# Typeahead lookup results
+class StudentLookup(BaseModel):
+    id: int
+    student_id: str
+    fullname: str
+    department: Department
+    borrowed_books_count: int
+    max_books_allowed: int
+
+    class Config:
+        from_attributes = True
+
+class BookLookup(BaseModel):
+    id: int
+    title: str
+    author: str
+    isbn: str
+    available_quantity: int
+
+    class Config:
+        from_attributes = True
+
 # Borrow schemas
 class BorrowBase(BaseModel):
     student_id: int
@@ -136,6 +158,36 @@ class BorrowResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# Batch circulation schemas
+class BorrowBatchCreate(BaseModel):
+    items: List[BorrowCreate]
+
+class BorrowBatchReturn(BaseModel):
+    borrow_ids: List[int]
+
+class BorrowBatchItemResult(BaseModel):
+    index: int
+    success: bool
+    borrow: Optional[BorrowResponse] = None
+    error: Optional[str] = None
+
+class BorrowBatchResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BorrowBatchItemResult]
+
+# Import schemas
+class ImportReject(BaseModel):
+    line: int
+    error: str
+
+class ImportResult(BaseModel):
+    processed: int
+    inserted: int
+    rejected: int
+    # The first rejected rows; the import CLI writes all of them to a file
+    rejects: List[ImportReject]
+
 # Report schemas
 class DateRangeFilter(BaseModel):
     start_date: Optional[datetime] = None
@@ -146,6 +198,9 @@ class BorrowStats(BaseModel):
     active_borrows: int
     overdue_borrows: int
     return_rate: float
+    returned_borrows: int = 0
+    books_by_category: Dict[str, int] = {}
+    borrows_by_department: Dict[str, int] = {}
 
 class PopularBook(BaseModel):
     book_id: int
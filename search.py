@@ -0,0 +1,73 @@
+import re
+from sqlalchemy import column, false, literal_column, select, table
+import models
+
+# External-content FTS5 index over the searchable book columns. The books
+# table stays the source of truth; the triggers keep the index in step with
+# every insert, update and delete, whichever code path makes them.
+BOOK_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, isbn, description,
+        content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, isbn, description)
+        VALUES (new.id, new.title, new.author, new.isbn, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, isbn, description)
+        VALUES ('delete', old.id, old.title, old.author, old.isbn, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author, isbn, description ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, isbn, description)
+        VALUES ('delete', old.id, old.title, old.author, old.isbn, old.description);
+        INSERT INTO books_fts(rowid, title, author, isbn, description)
+        VALUES (new.id, new.title, new.author, new.isbn, new.description);
+    END""",
+]
+
+books_fts = table("books_fts", column("rowid"), column("rank"))
+
+def ensure_book_search_index(conn) -> bool:
+    """Create the FTS index and its triggers if missing; returns True if created"""
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+    ).first()
+    for ddl in BOOK_SEARCH_DDL:
+        conn.exec_driver_sql(ddl)
+    if not exists:
+        rebuild_book_search_index(conn)
+    return not exists
+
+def rebuild_book_search_index(conn):
+    conn.exec_driver_sql("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+def book_match_query(term: str) -> str:
+    """FTS5 query matching every word of term as a prefix, e.g. 'dune her' -> "dune"* "her"*"""
+    words = re.findall(r"\w+", term or "")
+    return " ".join(f'"{word}"*' for word in words)
+
+def book_match(term: str):
+    """WHERE clause for books_fts rows matching term. A term without any
+    searchable words (e.g. "!!!") matches nothing, as the LIKE filter did."""
+    match = book_match_query(term)
+    if not match:
+        return false()
+    return literal_column("books_fts").op("MATCH")(match)
+
+def book_search_hits(term: str):
+    """Subquery of (book_id, rank) for books matching term, best match has the lowest rank"""
+    return select(
+        books_fts.c.rowid.label("book_id"),
+        books_fts.c.rank.label("rank")
+    ).where(book_match(term)).subquery()
+
+def book_search_ids(term: str):
+    """Select of the ids of books matching term for IN filters"""
+    return select(books_fts.c.rowid).where(book_match(term))
+
+def apply_book_search(query, term: str):
+    """Restrict a select(Book)/Query(Book) to search hits, ordered by relevance"""
+    hits = book_search_hits(term)
+    return query.join(hits, hits.c.book_id == models.Book.id).order_by(hits.c.rank)
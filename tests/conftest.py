@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+
+# The app reads its database settings when imported, so point it at a
+# scratch database before anything imports database or main. Routes that
+# go over their query budget fail the request instead of only logging.
+_scratch = tempfile.mkdtemp(prefix="library-tests-")
+os.environ["LIBRARY_DATABASE_URL"] = f"sqlite:///{_scratch}/library.db"
+os.environ["LIBRARY_QUERY_BUDGET_STRICT"] = "1"
+
+# The modules live at the repository root, and main reads templates/ and
+# static/ relative to the working directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+# Borrow records of the generated library
+LIBRARY_BORROWS = 2000
+
+@pytest.fixture(scope="session")
+def app_module():
+    import datagen
+    import database
+    import main
+
+    with database.SessionLocal() as db:
+        datagen.generate(db, LIBRARY_BORROWS, seed=7)
+    return main
+
+@pytest.fixture
+def db(app_module):
+    import database
+
+    with database.SessionLocal() as session:
+        yield session
+
+@pytest.fixture
+def token(app_module):
+    return app_module.create_access_token({"sub": "admin"})
+
+@pytest.fixture
+def client(app_module, token):
+    client = TestClient(app_module.app)
+    client.cookies.set("access_token", f"Bearer {token}")
+    return client
+
+class Statements:
+    """Counts the SQL statements run on the sync and async engines"""
+
+    def __init__(self, database):
+        self.engines = (database.engine, database.async_engine.sync_engine)
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._count)
+
+@pytest.fixture
+def statements(app_module):
+    import database
+
+    return Statements(database)
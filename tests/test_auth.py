@@ -0,0 +1,65 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+import models
+
+def add_admin(db) -> models.Admin:
+    stamp = time.time_ns()
+    admin = models.Admin(
+        username=f"auth-{stamp}", email=f"auth-{stamp}@example.com",
+        full_name="Cached Admin", hashed_password="-", is_active=True
+    )
+    db.add(admin)
+    db.commit()
+    return admin
+
+def admin_client(app_module, admin) -> TestClient:
+    client = TestClient(app_module.app)
+    client.cookies.set("access_token", f"Bearer {app_module.create_access_token({'sub': admin.username})}")
+    return client
+
+def current_admin(client):
+    """The admin the books page was rendered for, or None when sent to the login page"""
+    response = client.get("/books", follow_redirects=False)
+    if response.status_code == 303:
+        return None
+    assert response.status_code == 200, response.text
+    return response.context["current_admin"]
+
+def test_cached_admin_follows_updates(app_module, db):
+    admin = add_admin(db)
+    client = admin_client(app_module, admin)
+    assert current_admin(client).full_name == "Cached Admin"
+    hits = app_module.admin_cache.hits
+    assert current_admin(client).full_name == "Cached Admin"
+    assert app_module.admin_cache.hits == hits + 1
+
+    admin.full_name = "Renamed Admin"
+    db.commit()
+    assert current_admin(client).full_name == "Renamed Admin"
+
+    db.delete(admin)
+    db.commit()
+    assert current_admin(client) is None
+
+@pytest.mark.parametrize("write", ["orm", "statement"])
+def test_deactivated_admin_is_refused_on_the_next_request(app_module, db, write):
+    admin = add_admin(db)
+    client = admin_client(app_module, admin)
+    assert current_admin(client).id == admin.id
+    assert current_admin(client).id == admin.id  # now served from the cache
+
+    def set_active(is_active):
+        if write == "orm":
+            admin.is_active = is_active
+        else:
+            db.execute(update(models.Admin).where(models.Admin.id == admin.id).values(is_active=is_active))
+        db.commit()
+
+    set_active(False)
+    assert current_admin(client) is None
+    assert client.get("/api/books/", follow_redirects=False).status_code != 200
+
+    set_active(True)
+    assert current_admin(client).id == admin.id
@@ -0,0 +1,45 @@
+import pytest
+
+# Every endpoint listing BorrowResponse rows, with the book and student each
+# row nests, must run the same number of statements for any page size
+BORROW_LISTINGS = [
+    ("/api/borrows/", {}),
+    ("/api/borrows/", {"status": "active"}),
+    ("/api/borrows/", {"fast": "true"}),
+    ("/books/borrowed/", {}),
+    ("/books/overdue/", {}),
+    ("/books/search/", {"json": {}}),
+]
+
+def page(client, url, spec, limit):
+    spec = dict(spec)
+    json = spec.pop("json", None)
+    response = client.request("GET", url, params={**spec, "limit": limit}, json=json)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+@pytest.mark.parametrize("url, spec", BORROW_LISTINGS)
+def test_borrow_listing_statements_do_not_grow_with_page_size(client, statements, url, spec):
+    page(client, url, spec, 10)  # warm up: logs the admin in and fills the caches
+
+    with statements:
+        small = page(client, url, spec, 10)
+    small_statements = statements.count
+    with statements:
+        large = page(client, url, spec, 1000)
+    large_statements = statements.count
+
+    assert len(small) == 10
+    assert len(large) > 10
+    assert all(row["book"]["id"] == row["book_id"] and row["student"]["id"] == row["student_id"] for row in large)
+    assert large_statements == small_statements
+
+@pytest.mark.parametrize("status", [None, "active", "returned", "overdue"])
+def test_fast_borrow_page_matches_validated_page(client, status):
+    params = {"limit": 500, **({"status": status} if status else {})}
+    validated = client.get("/api/borrows/", params=params)
+    fast = client.get("/api/borrows/", params={**params, "fast": "true"})
+    assert validated.status_code == fast.status_code == 200
+    assert validated.json()
+    assert fast.content == validated.content
+    assert fast.headers.get("x-next-cursor") == validated.headers.get("x-next-cursor")
@@ -0,0 +1,182 @@
+import asyncio
+from datetime import datetime, timedelta
+import httpx
+import pytest
+from sqlalchemy import func
+import models
+from enums import BookCategory, Department, YearLevel
+
+# Checkouts racing for the last copies of a book or the last slots of a
+# student. The checkout handler runs on the threadpool, so requests sent
+# together really run at the same time against SQLite.
+CONCURRENT_CHECKOUTS = 16
+
+def checkout_all(app, token, pairs) -> list:
+    """POST one checkout per (student_id, book_id) pair, all at once; the status codes"""
+    due = (datetime.utcnow() + timedelta(days=14)).isoformat()
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            client.cookies.set("access_token", f"Bearer {token}")
+            responses = await asyncio.gather(*[
+                client.post("/api/borrows/", json={"student_id": student_id, "book_id": book_id, "due_date": due})
+                for student_id, book_id in pairs
+            ])
+        return [response.status_code for response in responses]
+
+    return asyncio.run(run())
+
+def add_books(db, count, quantity):
+    books = [
+        models.Book(
+            title=f"Contested book {number}", author="Test", isbn=f"contested-{datetime.utcnow().timestamp()}-{number}",
+            category=BookCategory.FICTION, quantity=quantity, available_quantity=quantity
+        )
+        for number in range(count)
+    ]
+    db.add_all(books)
+    db.commit()
+    return books
+
+def add_students(db, count):
+    stamp = datetime.utcnow().timestamp()
+    students = [
+        models.Student(
+            fullname=f"Racing student {number}", student_id=f"race-{stamp}-{number}",
+            email=f"race-{stamp}-{number}@example.com", department=Department.COMPUTER_SCIENCE,
+            year_level=YearLevel.FIRST_YEAR, is_active=True
+        )
+        for number in range(count)
+    ]
+    db.add_all(students)
+    db.commit()
+    return students
+
+def open_loans(db, **filters) -> int:
+    return db.query(func.count(models.BorrowRecord.id)).filter_by(return_date=None, **filters).scalar()
+
+def test_concurrent_checkouts_cannot_oversell_a_book(app_module, token, db):
+    book = add_books(db, 1, quantity=2)[0]
+    students = add_students(db, CONCURRENT_CHECKOUTS)
+
+    statuses = checkout_all(app_module.app, token, [(student.id, book.id) for student in students])
+
+    assert statuses.count(200) == 2
+    assert statuses.count(400) == CONCURRENT_CHECKOUTS - 2
+    db.expire_all()
+    assert book.available_quantity == 0
+    assert book.quantity - book.available_quantity == open_loans(db, book_id=book.id)
+
+def test_concurrent_checkouts_cannot_exceed_a_student_limit(app_module, token, db):
+    books = add_books(db, CONCURRENT_CHECKOUTS, quantity=1)
+    student = add_students(db, 1)[0]
+
+    statuses = checkout_all(app_module.app, token, [(student.id, book.id) for book in books])
+
+    assert statuses.count(200) == 3
+    db.expire_all()
+    assert student.active_borrow_count == open_loans(db, student_id=student.id) == 3
+    assert sum(book.available_quantity for book in books) == CONCURRENT_CHECKOUTS - 3
+
+# Batch checkouts and returns
+
+def due_in(days) -> str:
+    return (datetime.utcnow() + timedelta(days=days)).isoformat()
+
+def checkout_batch(client, pairs, days=14) -> list:
+    response = client.post("/api/borrows/batch", json={"items": [
+        {"student_id": student_id, "book_id": book_id, "due_date": due_in(days)} for student_id, book_id in pairs
+    ]})
+    assert response.status_code == 200, response.text
+    results = response.json()["results"]
+    assert [result["index"] for result in results] == list(range(len(pairs)))
+    return results
+
+def errors(results) -> list:
+    return [result["error"] for result in results]
+
+def test_batch_applies_limits_across_its_items(client, db):
+    shared = add_books(db, 1, quantity=2)[0]
+    books = add_books(db, 4, quantity=1)
+    students = add_students(db, 3)
+    last_id = db.query(func.max(models.BorrowRecord.id)).scalar()
+
+    results = checkout_batch(client, [
+        (students[0].id, shared.id),
+        (students[0].id, shared.id),    # the same loan twice
+        (students[1].id, books[0].id),
+        (students[2].id, books[0].id),  # the only copy went to the item before
+        (students[0].id, books[1].id),
+        (students[0].id, books[2].id),
+        (students[0].id, books[3].id),  # a fourth book for a student limited to three
+    ])
+
+    assert errors(results) == [
+        None,
+        "Student already has this book",
+        None,
+        "No copies available for borrowing",
+        None,
+        None,
+        "Student has reached maximum borrow limit (3 books)",
+    ]
+    # The inserted rows are found again by id and matched to their items
+    created = [(result["borrow"]["id"], result["borrow"]["student_id"], result["borrow"]["book_id"])
+               for result in results if result["success"]]
+    assert all(borrow_id > last_id for borrow_id, _, _ in created)
+    assert [(student_id, book_id) for _, student_id, book_id in created] == [
+        (students[0].id, shared.id), (students[1].id, books[0].id),
+        (students[0].id, books[1].id), (students[0].id, books[2].id),
+    ]
+    for borrow_id, student_id, book_id in created:
+        record = db.get(models.BorrowRecord, borrow_id)
+        assert (record.student_id, record.book_id, record.return_date) == (student_id, book_id, None)
+    db.expire_all()
+    assert [student.active_borrow_count for student in students] == [3, 1, 0]
+    assert [book.available_quantity for book in [shared, *books]] == [1, 0, 0, 0, 1]
+
+def test_batch_return_reports_each_item(client, db):
+    books = add_books(db, 2, quantity=1)
+    student = add_students(db, 1)[0]
+    borrow_ids = [result["borrow"]["id"] for result in checkout_batch(client, [(student.id, book.id) for book in books])]
+
+    response = client.post("/api/borrows/batch-return", json={"borrow_ids": [borrow_ids[0], borrow_ids[0], 10**9, borrow_ids[1]]})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert errors(body["results"]) == [None, "Book already returned", "Borrow record not found", None]
+    assert (body["succeeded"], body["failed"]) == (2, 2)
+    db.expire_all()
+    assert student.active_borrow_count == open_loans(db, student_id=student.id) == 0
+    assert [book.available_quantity for book in books] == [1, 1]
+
+def test_batch_is_one_transaction(app_module, client, db, monkeypatch):
+    books = add_books(db, 2, quantity=1)
+    student = add_students(db, 1)[0]
+
+    def fail(*args):
+        raise RuntimeError("failed after the copies were taken")
+    monkeypatch.setattr(app_module.circulation, "record_borrows", fail)
+    with pytest.raises(RuntimeError):
+        checkout_batch(client, [(student.id, book.id) for book in books])
+
+    db.expire_all()
+    assert open_loans(db, student_id=student.id) == 0
+    assert student.active_borrow_count == 0
+    assert [book.available_quantity for book in books] == [1, 1]
+
+def test_single_and_batch_checkouts_share_their_rules(client, db):
+    books = add_books(db, 3, quantity=2)
+    students = add_students(db, 2)
+    # An overdue loan blocks further checkouts, one at a time or in a batch
+    response = client.post("/api/borrows/", json={"student_id": students[0].id, "book_id": books[0].id, "due_date": due_in(-1)})
+    assert response.status_code == 200, response.text
+    response = client.post("/api/borrows/", json={"student_id": students[0].id, "book_id": books[1].id, "due_date": due_in(14)})
+    assert (response.status_code, response.json()["detail"]) == (400, "Student has overdue books and cannot borrow more books")
+    assert errors(checkout_batch(client, [(students[0].id, books[1].id)])) == [response.json()["detail"]]
+
+    # So does a second copy of a book the student already has
+    assert errors(checkout_batch(client, [(students[1].id, books[2].id)])) == [None]
+    response = client.post("/api/borrows/", json={"student_id": students[1].id, "book_id": books[2].id, "due_date": due_in(14)})
+    assert (response.status_code, response.json()["detail"]) == (400, "Student already has this book")
+    assert errors(checkout_batch(client, [(students[1].id, books[2].id)])) == [response.json()["detail"]]
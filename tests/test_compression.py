@@ -0,0 +1,94 @@
+import re
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+import assets
+import compression
+
+def compressed_app() -> TestClient:
+    """A bare app behind the middleware: /text?size=N, /stream?chunk=N&count=M"""
+
+    async def text(request):
+        size = int(request.query_params["size"])
+        etag = request.query_params.get("etag")
+        return PlainTextResponse("x" * size, headers={"ETag": etag} if etag else None)
+
+    async def stream(request):
+        chunk, count = int(request.query_params["chunk"]), int(request.query_params["count"])
+        return StreamingResponse((b"y" * chunk for _ in range(count)), media_type="text/csv")
+
+    app = Starlette(routes=[Route("/text", text), Route("/stream", stream)])
+    app.add_middleware(compression.CompressionMiddleware)
+    return TestClient(app)
+
+@pytest.mark.parametrize("size, encoded", [(compression.MINIMUM_SIZE - 1, False), (compression.MINIMUM_SIZE, True)])
+def test_bodies_below_the_threshold_pass_through(size, encoded):
+    response = compressed_app().get("/text", params={"size": size}, headers={"Accept-Encoding": "gzip"})
+    assert response.text == "x" * size
+    assert (response.headers.get("content-encoding") == "gzip") is encoded
+    if encoded:
+        assert "Accept-Encoding" in response.headers["vary"]
+
+@pytest.mark.parametrize("chunk, count, encoded", [(300, 3, False), (300, 4, True), (5000, 3, True)])
+def test_streams_are_compressed_once_they_reach_the_threshold(chunk, count, encoded):
+    response = compressed_app().get("/stream", params={"chunk": chunk, "count": count}, headers={"Accept-Encoding": "br"})
+    assert response.content == b"y" * (chunk * count)
+    assert (response.headers.get("content-encoding") == "br") is encoded
+
+@pytest.mark.parametrize("accept_encoding, chosen", [
+    ("gzip, deflate, br", "br"),
+    ("gzip", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0.5, br;q=0.1", "br"),  # any weight above zero; brotli first
+    ("*", "br"),
+    ("gzip;q=0, *", "br"),
+    ("br;q=0, gzip;q=0", None),
+    ("identity", None),
+    ("", None),
+])
+def test_encoding_negotiation(accept_encoding, chosen):
+    assert compression.choose_encoding(accept_encoding) == chosen
+    response = compressed_app().get("/text", params={"size": 4096}, headers={"Accept-Encoding": accept_encoding})
+    assert response.headers.get("content-encoding") == chosen
+    assert response.text == "x" * 4096
+
+@pytest.mark.parametrize("size, etag, encoding, sent", [
+    (4096, '"v1"', "gzip", 'W/"v1"'),
+    (4096, '"v1"', "br", 'W/"v1"'),
+    (4096, '"v1"', "identity", '"v1"'),
+    (4096, 'W/"v1"', "gzip", 'W/"v1"'),
+    (100, '"v1"', "gzip", '"v1"'),   # too small to compress
+])
+def test_compressed_bodies_get_weak_etags(size, etag, encoding, sent):
+    response = compressed_app().get("/text", params={"size": size, "etag": etag}, headers={"Accept-Encoding": encoding})
+    assert response.headers["etag"] == sent
+
+# Static assets
+
+def asset_urls(client) -> list:
+    response = client.get("/login")
+    assert response.status_code == 200
+    return re.findall(r'/static/[\w/.-]+\.[0-9a-f]{12}\.(?:css|js)', response.text)
+
+def test_pages_link_hashed_assets_cached_for_good(client):
+    urls = asset_urls(client)
+    assert any(url.endswith(".css") for url in urls) and any(url.endswith(".js") for url in urls)
+    for url in urls:
+        response = client.get(url, headers={"Accept-Encoding": "br"})
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == assets.IMMUTABLE
+        assert response.headers["content-encoding"] == "br"  # precompressed, not compressed again
+        plain = client.get(re.sub(r"\.[0-9a-f]{12}\.", ".", url), headers={"Accept-Encoding": "identity"})
+        assert plain.headers["cache-control"] == assets.REVALIDATE
+        assert response.content == plain.content
+
+        response = client.get(url, headers={"Accept-Encoding": "br", "If-None-Match": response.headers["etag"]})
+        assert response.status_code == 304
+        assert response.content == b""
+
+def test_hashed_asset_names_follow_content():
+    first, second = assets.Asset("a.css", b"body { color: red }"), assets.Asset("a.css", b"body { color: blue }")
+    assert first.digest != second.digest
+    assert assets.Asset("b.css", b"body { color: red }").digest == first.digest
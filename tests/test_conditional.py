@@ -0,0 +1,88 @@
+from datetime import timedelta
+import pytest
+from sqlalchemy import update
+import models
+
+IDENTITY = {"Accept-Encoding": "identity"}
+
+def etag_of(client, url, **params) -> str:
+    response = client.get(url, params=params, headers=IDENTITY)
+    assert response.status_code == 200, response.text
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert not response.headers["etag"].startswith("W/")
+    return response.headers["etag"]
+
+def revalidate(client, url, etag, encoding="identity", **params):
+    return client.get(url, params=params, headers={"If-None-Match": etag, "Accept-Encoding": encoding})
+
+def assert_not_modified(client, url, etag, **params):
+    response = revalidate(client, url, etag, **params)
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+# A write to each table the responses are read from
+def write_books(db):
+    book = db.query(models.Book).order_by(models.Book.id.desc()).first()
+    db.execute(update(models.Book).where(models.Book.id == book.id).values(description=f"{book.description or ''}."))
+
+def write_students(db):
+    student = db.query(models.Student).order_by(models.Student.id.desc()).first()
+    db.execute(update(models.Student).where(models.Student.id == student.id).values(phone=f"{student.phone or ''}1"))
+
+def write_borrow_records(db):
+    record = db.query(models.BorrowRecord).filter(models.BorrowRecord.return_date != None).first()
+    db.execute(update(models.BorrowRecord).where(models.BorrowRecord.id == record.id).values(
+        due_date=record.due_date + timedelta(seconds=1)
+    ))
+
+WRITES = {"books": write_books, "students": write_students, "borrow_records": write_borrow_records}
+
+@pytest.mark.parametrize("kind, change", [("books", {"description": "Revised"}), ("students", {"phone": "555-0100"})])
+def test_single_resource_revalidates(client, db, kind, change):
+    model = {"books": models.Book, "students": models.Student}[kind]
+    url = f"/api/{kind}/{db.query(model.id).order_by(model.id).first()[0]}"
+    etag = etag_of(client, url)
+    assert_not_modified(client, url, etag)
+    assert revalidate(client, url, f"W/{etag}").status_code == 304
+
+    response = client.put(url, json=change)
+    assert response.status_code == 200, response.text
+    assert etag_of(client, url) != etag
+    assert revalidate(client, url, etag).status_code == 200
+
+# List endpoints and the tables their ETag covers
+LISTS = [
+    ("/api/books/", {"limit": 5}, ("books",)),
+    ("/api/students/", {"limit": 5}, ("students", "borrow_records")),
+    ("/api/students/", {"limit": 5, "has_overdue": "true"}, ("students", "borrow_records")),
+    ("/api/borrows/", {"limit": 5}, ("books", "students", "borrow_records")),
+    ("/api/borrows/", {"limit": 5, "fast": "true"}, ("books", "students", "borrow_records")),
+]
+
+@pytest.mark.parametrize("url, params, tables", LISTS)
+def test_list_etag_follows_the_tables_it_reads(client, db, url, params, tables):
+    for table, write in WRITES.items():
+        etag = etag_of(client, url, **params)
+        assert_not_modified(client, url, etag, **params)
+
+        write(db)
+        db.commit()
+        if table in tables:
+            assert etag_of(client, url, **params) != etag, table
+            assert revalidate(client, url, etag, **params).status_code == 200
+        else:
+            assert_not_modified(client, url, etag, **params)
+
+@pytest.mark.parametrize("url, params", [("/api/books/", {"limit": 50}), ("/api/borrows/", {"limit": 50})])
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_compressed_responses_carry_weak_etags_that_still_match(client, url, params, encoding):
+    strong = etag_of(client, url, **params)
+    response = client.get(url, params=params, headers={"Accept-Encoding": encoding})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == encoding
+    assert response.headers["etag"] == f"W/{strong}"
+
+    response = revalidate(client, url, response.headers["etag"], encoding=encoding, **params)
+    assert response.status_code == 304
+    assert response.content == b""
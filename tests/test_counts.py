@@ -0,0 +1,87 @@
+import time
+from datetime import datetime
+from sqlalchemy import delete, func, insert, text
+import counts
+import models
+from enums import BookCategory
+
+def maintained_counts(db) -> dict:
+    return dict(db.execute(text("SELECT table_name, row_count FROM row_counts")).all())
+
+def actual_counts(db) -> dict:
+    return {
+        table: db.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+        for table in counts.COUNTED_TABLES
+    }
+
+def test_row_counts_follow_inserts_and_deletes(client, db):
+    assert maintained_counts(db) == actual_counts(db)
+    stamp = time.time_ns()
+
+    # Through the ORM
+    books = [
+        models.Book(title=f"Counted {number}", author="Test", isbn=f"count-{stamp}-{number}",
+                    category=BookCategory.OTHER, quantity=1, available_quantity=1)
+        for number in range(3)
+    ]
+    db.add_all(books)
+    db.commit()
+    db.delete(books[0])
+    db.commit()
+    assert maintained_counts(db) == actual_counts(db)
+
+    # Through Core statements, which no session event sees
+    db.execute(insert(models.Book), [
+        {"title": "Counted core", "author": "Test", "isbn": f"count-{stamp}-core-{number}",
+         "category": BookCategory.OTHER, "quantity": 1, "available_quantity": 1}
+        for number in range(4)
+    ])
+    db.execute(delete(models.Book).where(models.Book.isbn.in_([books[1].isbn, f"count-{stamp}-core-0"])))
+    db.commit()
+    assert maintained_counts(db) == actual_counts(db)
+
+    # Through the API, and borrow records dated before any report's range
+    response = client.post("/api/students/", json={
+        "student_id": f"CNT{stamp}", "fullname": "Counted Student",
+        "email": f"count-{stamp}@example.com", "department": "Science"
+    })
+    assert response.status_code == 200, response.text
+    long_ago = datetime(2000, 1, 1)
+    records = [
+        models.BorrowRecord(student_id=response.json()["id"], book_id=books[2].id,
+                            borrow_date=long_ago, due_date=long_ago, return_date=long_ago)
+        for _ in range(2)
+    ]
+    db.add_all(records)
+    db.commit()
+    db.execute(delete(models.BorrowRecord).where(models.BorrowRecord.id == records[0].id))
+    db.commit()
+    assert maintained_counts(db) == actual_counts(db)
+
+def page_total(client, path, **params) -> int:
+    response = client.get(path, params=params)
+    assert response.status_code == 200, response.text
+    return response.context["count"].total
+
+def test_filtered_page_counts_follow_writes(client, db):
+    inactive = db.query(func.count(models.Student.id)).filter(models.Student.is_active == False).scalar()
+    assert page_total(client, "/students", status="inactive") == inactive
+    hits = counts.count_cache.hits
+    assert page_total(client, "/students", status="inactive") == inactive
+    assert counts.count_cache.hits == hits + 1
+    total = page_total(client, "/students")
+
+    stamp = time.time_ns()
+    response = client.post("/api/students/", json={
+        "student_id": f"CNT{stamp}", "fullname": "Countable Inactive",
+        "email": f"count-{stamp}@example.com", "department": "Science", "is_active": False
+    })
+    assert response.status_code == 200, response.text
+    assert page_total(client, "/students", status="inactive") == inactive + 1
+    assert page_total(client, "/students", search="Countable Inactive") == 1
+    assert page_total(client, "/students") == total + 1
+
+    response = client.put(f"/api/students/{response.json()['id']}", json={"is_active": True})
+    assert response.status_code == 200, response.text
+    assert page_total(client, "/students", status="inactive") == inactive
+    assert page_total(client, "/students") == total + 1
@@ -0,0 +1,39 @@
+import time
+from datetime import datetime, timedelta
+import models
+
+def dashboard(client) -> dict:
+    response = client.get("/dashboard")
+    assert response.status_code == 200, response.text
+    return response.context
+
+def test_cached_dashboard_holds_no_orm_objects(app_module, client):
+    app_module.dashboard_cache.clear()
+    dashboard(client)
+    hits = app_module.dashboard_cache.hits
+
+    context = dashboard(client)  # served from the cache, rendered by another request
+    assert app_module.dashboard_cache.hits == hits + 1
+    assert context["recent_borrows"]
+    for borrow in context["recent_borrows"]:
+        assert isinstance(borrow, dict)
+        assert not any(isinstance(value, models.Base) for value in borrow.values())
+
+def test_dashboard_counts_a_loan_that_turns_overdue(client, db):
+    student = db.query(models.Student).filter(
+        models.Student.is_active == True, models.Student.active_borrow_count == 0
+    ).first()
+    book = db.query(models.Book).filter(models.Book.available_quantity > 0).first()
+    due = datetime.utcnow() + timedelta(seconds=2)
+    response = client.post("/api/borrows/", json={"student_id": student.id, "book_id": book.id, "due_date": due.isoformat()})
+    assert response.status_code == 200, response.text
+
+    overdue = dashboard(client)["stats"]["overdue_books"]
+    assert dashboard(client)["stats"]["overdue_books"] == overdue
+
+    # No write happens meanwhile; only the clock moves past the due date
+    time.sleep(max((due - datetime.utcnow()).total_seconds(), 0) + 0.2)
+    assert dashboard(client)["stats"]["overdue_books"] == overdue + 1
+
+    response = client.post(f"/api/borrows/{response.json()['id']}/return")
+    assert response.status_code == 200, response.text
@@ -0,0 +1,101 @@
+import argparse
+import csv
+import io
+from sqlalchemy import event, func
+import importer
+import models
+
+def upload(client, kind, text):
+    response = client.post(f"/api/import/{kind}", files={"file": (f"{kind}.csv", text.encode(), "text/csv")})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def rejects(result) -> list:
+    return [(reject["line"], reject["error"]) for reject in result["rejects"]]
+
+def test_book_import_rejects_duplicate_isbns(client, db):
+    existing = db.query(models.Book).order_by(models.Book.id).first()
+    result = upload(client, "books", "\n".join([
+        "title,author,isbn,category,quantity",
+        "Import One,Ada Author,import-isbn-1,Science,2",
+        "Import Two,Ada Author,import-isbn-1,Science,1",
+        f"Import Three,Ada Author,{existing.isbn},Science,1",
+        "Import Four,Ada Author,import-isbn-4,Not a category,1",
+        "Import Five,Ada Author,import-isbn-5,History,",
+    ]))
+
+    assert (result["processed"], result["inserted"], result["rejected"]) == (5, 2, 3)
+    assert rejects(result)[:3] == [
+        (3, "isbn already registered"),
+        (4, "isbn already registered"),
+        (5, rejects(result)[2][1]),
+    ]
+    assert rejects(result)[2][1].startswith("category:")
+    books = {book.isbn: book for book in db.query(models.Book).filter(models.Book.isbn.like("import-isbn-%"))}
+    assert sorted(books) == ["import-isbn-1", "import-isbn-5"]
+    assert (books["import-isbn-1"].title, books["import-isbn-1"].available_quantity) == ("Import One", 2)
+    assert books["import-isbn-5"].quantity == 1
+
+def test_student_import_rejects_duplicate_ids_and_emails(client, db):
+    existing = db.query(models.Student).order_by(models.Student.id).first()
+    result = upload(client, "students", "\n".join([
+        "student_id,fullname,email,department,year_level",
+        "IMP-1,Import One,import.one@example.com,Science,1",
+        "IMP-1,Import Two,import.two@example.com,Science,1",
+        "IMP-3,Import Three,import.one@example.com,Science,1",
+        f"{existing.student_id},Import Four,import.four@example.com,Science,1",
+        f"IMP-5,Import Five,{existing.email},Science,1",
+        "IMP-6,Import Six,import.six@example.com,Science,9",
+        "IMP-7,Import Seven,import.seven@example.com,Law,4",
+    ]))
+
+    assert (result["processed"], result["inserted"], result["rejected"]) == (7, 2, 5)
+    assert rejects(result)[:4] == [
+        (3, "student_id already registered"),
+        (4, "email already registered"),
+        (5, "student_id already registered"),
+        (6, "email already registered"),
+    ]
+    assert rejects(result)[4][0] == 7 and rejects(result)[4][1].startswith("year_level:")
+    imported = db.query(models.Student).filter(models.Student.student_id.like("IMP-%")).order_by(models.Student.student_id).all()
+    assert [(student.student_id, student.email, student.year_level.value) for student in imported] == [
+        ("IMP-1", "import.one@example.com", 1),
+        ("IMP-7", "import.seven@example.com", 4),
+    ]
+
+def test_manage_import_writes_rejects_file(app_module, db, tmp_path):
+    import manage
+
+    source = tmp_path / "books.csv"
+    source.write_text("\n".join([
+        "title,author,isbn,category",
+        "Cli One,Bo Writer,cli-isbn-1,Fiction",
+        "Cli Two,Bo Writer,cli-isbn-1,Fiction",
+        ",Bo Writer,cli-isbn-3,Fiction",
+    ]) + "\n")
+    manage.import_file(argparse.Namespace(kind="books", file=str(source), rejects=None, admin=None))
+
+    with open(f"{source}.rejects.csv", newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert [(row["line"], row["isbn"], row["title"]) for row in rows] == [("3", "cli-isbn-1", "Cli Two"), ("4", "cli-isbn-3", "")]
+    assert rows[0]["error"] == "isbn already registered"
+    assert rows[1]["error"].startswith("title:")
+    assert db.query(models.Book).filter(models.Book.isbn.like("cli-isbn-%")).count() == 1
+
+def test_import_commits_in_chunks(db):
+    rows = ["title,author,isbn,category"]
+    rows += [f"Chunk {number},Cy Writer,chunk-{number},History" for number in range(4500)]
+    rows.append("Chunk again,Cy Writer,chunk-0,History")  # duplicates a row committed two chunks earlier
+    commits = []
+    event.listen(db, "after_commit", lambda session: commits.append(1))
+    progress = []
+
+    result = importer.import_csv(
+        db, "books", io.StringIO("\n".join(rows)),
+        on_progress=lambda result: progress.append((result.processed, result.inserted))
+    )
+
+    assert (result.processed, result.inserted, result.rejected) == (4501, 4500, 1)
+    assert progress == [(2000, 2000), (4000, 4000), (4501, 4500)]
+    assert len(commits) == 3
+    assert db.query(func.count(models.Book.id)).filter(models.Book.isbn.like("chunk-%")).scalar() == 4500
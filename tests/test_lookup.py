@@ -0,0 +1,52 @@
+import time
+import pytest
+import lookup
+
+def new_student() -> dict:
+    stamp = time.time_ns()
+    return {
+        "student_id": f"LKP{stamp}", "fullname": "Quokkaberg Ulterior",
+        "email": f"lookup-{stamp}@example.com", "department": "Science"
+    }
+
+def new_book() -> dict:
+    return {"title": "Quokkaberg Ulterior", "author": "Lookup Test", "isbn": f"lookup-{time.time_ns()}", "category": "Science"}
+
+# Each lookup, the body that creates a row of it, the rename, and the
+# parameter that stops the endpoint from filtering rows out
+LOOKUPS = {
+    "students": (lookup.students, new_student, {"fullname": "Wombatique Ulterior"}, {"active_only": "false"}),
+    "books": (lookup.books, new_book, {"title": "Wombatique Ulterior"}, {"available_only": "false"}),
+}
+
+def found(client, kind, q) -> list:
+    response = client.get(f"/api/lookup/{kind}", params={"q": q, **LOOKUPS[kind][3]})
+    assert response.status_code == 200, response.text
+    return [row["id"] for row in response.json()]
+
+def indexed(kind, q) -> list:
+    """Ids the prefix index itself holds for q, without a catch-up refresh"""
+    return LOOKUPS[kind][0].index.search(lookup.words(q), lookup.LOOKUP_LIMIT)
+
+@pytest.mark.parametrize("kind", LOOKUPS)
+def test_lookup_index_follows_session_writes(client, kind):
+    _, make_row, rename, _ = LOOKUPS[kind]
+    found(client, kind, "a")  # loads the index
+
+    response = client.post(f"/api/{kind}/", json=make_row())
+    assert response.status_code == 200, response.text
+    row_id = response.json()["id"]
+    assert indexed(kind, "quokkaberg") == [row_id]
+    assert found(client, kind, "quokka ulter") == [row_id]
+
+    response = client.put(f"/api/{kind}/{row_id}", json=rename)
+    assert response.status_code == 200, response.text
+    assert indexed(kind, "quokkaberg") == []
+    assert indexed(kind, "wombatique") == [row_id]
+    assert found(client, kind, "quokka") == []
+    assert found(client, kind, "wombat ulter") == [row_id]
+
+    response = client.delete(f"/api/{kind}/{row_id}")
+    assert response.status_code == 200, response.text
+    assert indexed(kind, "wombatique") == []
+    assert found(client, kind, "wombat") == []
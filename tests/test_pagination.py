@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import select
+import models
+import pagination
+import search as search_module
+
+PAGE = 37
+SEARCH_PAGE = 5  # "history" matches about twenty books of the test library
+
+def walk(client, url, params=None, json=None, page_size=PAGE) -> list:
+    """Ids of every row of a listing, following X-Next-Cursor page by page"""
+    params = {**(params or {}), "limit": page_size}
+    ids = []
+    while True:
+        response = client.request("GET", url, params=params, json=json)
+        assert response.status_code == 200, response.text
+        page = [row["id"] for row in response.json()]
+        ids += page
+        cursor = response.headers.get(pagination.NEXT_CURSOR_HEADER)
+        if cursor is None:
+            assert len(page) < page_size
+            return ids
+        assert len(page) == page_size
+        params["cursor"] = cursor
+
+def ordered_ids(db, id_column, *order_by) -> list:
+    return [row_id for row_id, in db.query(id_column).order_by(*order_by, id_column)]
+
+def test_cursor_walks_books(client, db):
+    assert walk(client, "/api/books/") == ordered_ids(db, models.Book.id)
+
+def test_cursor_walks_students(client, db):
+    assert walk(client, "/api/students/") == ordered_ids(db, models.Student.id)
+
+@pytest.mark.parametrize("params", [{}, {"fast": "true"}, {"status": "returned"}])
+def test_cursor_walks_borrows(client, db, params):
+    query = db.query(models.BorrowRecord.id).order_by(models.BorrowRecord.id)
+    if params.get("status") == "returned":
+        query = query.filter(models.BorrowRecord.return_date != None)
+    assert walk(client, "/api/borrows/", params) == [row_id for row_id, in query]
+
+def test_cursor_walks_book_search_by_rank(client, db):
+    hits = search_module.book_search_hits("history")
+    expected = db.execute(select(hits.c.book_id, hits.c.rank).order_by(hits.c.rank, hits.c.book_id)).all()
+    assert len(expected) > 2 * SEARCH_PAGE
+    assert len({rank for _, rank in expected}) < len(expected)  # ties fall back to the id
+
+    response = client.get("/api/books/", params={"search": "history", "limit": SEARCH_PAGE})
+    rank, book_id = pagination.decode_cursor(response.headers[pagination.NEXT_CURSOR_HEADER], 2)
+    assert isinstance(rank, float) and (book_id, rank) == tuple(expected[SEARCH_PAGE - 1])
+
+    walked = walk(client, "/api/books/", {"search": "history"}, page_size=SEARCH_PAGE)
+    assert walked == [book_id for book_id, _ in expected]
+
+def test_cursor_walks_borrow_history_both_ways(client, db):
+    record = models.BorrowRecord
+    expected = [row_id for row_id, in db.query(record.id).order_by(record.borrow_date.desc(), record.id.desc())]
+    walked = walk(client, "/books/search/", {"sort_by": "borrow_date", "sort_desc": "true"}, json={})
+    assert walked == expected
+
+    expected = ordered_ids(db, record.id, record.due_date)
+    walked = walk(client, "/books/search/", {"sort_by": "due_date", "sort_desc": "false"}, json={})
+    assert walked == expected
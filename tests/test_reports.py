@@ -0,0 +1,115 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func
+import models
+
+def report(client, start=None, end=None):
+    params = {}
+    if start:
+        params["start_date"] = start.isoformat()
+    if end:
+        params["end_date"] = end.isoformat()
+    response = client.get("/reports/data", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def report_trend(data) -> dict:
+    trend = data["borrow_trends"]
+    return {label: count for label, count in zip(trend["labels"], trend["data"]) if count}
+
+def direct_trend(db, start) -> dict:
+    """Borrows per day counted straight from borrow_records"""
+    day = func.date(models.BorrowRecord.borrow_date)
+    rows = db.query(day, func.count(models.BorrowRecord.id)).filter(
+        day >= start.isoformat()
+    ).group_by(day)
+    return dict(rows)
+
+def test_report_statements_do_not_grow_with_date_range(app_module, client, statements):
+    today = datetime.utcnow().date()
+    report(client, today - timedelta(days=7))  # warm up
+
+    counts = []
+    for start in (today - timedelta(days=7), today - timedelta(days=365), None):
+        with statements:
+            report(client, start, today)
+        counts.append(statements.count)
+
+    assert len(set(counts)) == 1
+    assert counts[0] <= app_module.get_report_data.query_budget
+
+def test_report_rollup_matches_borrow_records(client, db):
+    start = datetime.utcnow().date() - timedelta(days=60)
+    data = report(client, start)
+    assert report_trend(data)
+    assert report_trend(data) == direct_trend(db, start)
+    assert data["stats"]["total_borrows"] == db.query(models.BorrowRecord).filter(
+        models.BorrowRecord.borrow_date >= datetime.combine(start, datetime.min.time())
+    ).count()
+
+    # Checkouts and returns made through the API keep the rollup in step
+    student = db.query(models.Student).filter(
+        models.Student.is_active == True, models.Student.active_borrow_count == 0
+    ).first()
+    book = db.query(models.Book).filter(models.Book.available_quantity > 0).first()
+    due = (datetime.utcnow() + timedelta(days=14)).isoformat()
+    response = client.post("/api/borrows/", json={"student_id": student.id, "book_id": book.id, "due_date": due})
+    assert response.status_code == 200, response.text
+    response = client.post(f"/api/borrows/{response.json()['id']}/return")
+    assert response.status_code == 200, response.text
+
+    db.expire_all()
+    assert report_trend(report(client, start)) == direct_trend(db, start)
+
+# Report exports
+
+def export(client, export_format, **params) -> list:
+    """The rows of an export as dicts of strings, whichever the format"""
+    response = client.get("/reports/export", params={"format": export_format, **params})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith({"csv": "text/csv", "ndjson": "application/x-ndjson"}[export_format])
+    assert response.headers["content-disposition"].endswith(f'.{export_format}"')
+    if export_format == "csv":
+        return list(csv.DictReader(io.StringIO(response.text)))
+    return [
+        {name: "" if value is None else str(value) for name, value in json.loads(line).items()}
+        for line in response.text.splitlines()
+    ]
+
+def borrow_ids(rows) -> list:
+    return [int(row["borrow_id"]) for row in rows]
+
+@pytest.mark.parametrize("export_format", ["csv", "ndjson"])
+def test_export_honours_report_type_and_dates(client, db, export_format):
+    today = datetime.utcnow().date()
+    start, end = today - timedelta(days=30), today - timedelta(days=10)
+    record = models.BorrowRecord
+
+    rows = export(client, export_format, report_type="borrows", start_date=start.isoformat(), end_date=end.isoformat())
+    expected = db.query(record.id).filter(
+        record.borrow_date >= datetime.combine(start, datetime.min.time()),
+        record.borrow_date < datetime.combine(end + timedelta(days=1), datetime.min.time())
+    ).order_by(record.id)
+    assert rows and borrow_ids(rows) == [borrow_id for borrow_id, in expected]
+    assert all(start.isoformat() <= row["borrow_date"][:10] <= end.isoformat() for row in rows)
+
+    rows = export(client, export_format, report_type="overdue")
+    expected = db.query(record.id).filter(
+        record.return_date == None, record.due_date < datetime.utcnow()
+    ).order_by(record.id)
+    assert rows and borrow_ids(rows) == [borrow_id for borrow_id, in expected]
+
+    rows = export(client, export_format, report_type="books")
+    assert len(rows) == db.query(models.Book).count()
+    assert {"isbn", "available_quantity", "borrow_count"} <= set(rows[0])
+
+def test_export_formats_hold_the_same_rows(client):
+    params = {"report_type": "students", "start_date": (datetime.utcnow().date() - timedelta(days=90)).isoformat()}
+    assert export(client, "csv", **params) == export(client, "ndjson", **params)
+
+@pytest.mark.parametrize("params", [{"format": "xml"}, {"report_type": "fines"}, {"start_date": "yesterday"}])
+def test_export_rejects_unknown_parameters(client, params):
+    assert client.get("/reports/export", params=params).status_code == 400
@@ -0,0 +1,33 @@
+import pytest
+
+def search_ids(client, term) -> list:
+    response = client.get("/api/books/", params={"search": term, "limit": 1000})
+    assert response.status_code == 200, response.text
+    return [book["id"] for book in response.json()]
+
+@pytest.mark.parametrize("term", ["!!!", "-"])
+def test_search_without_words_matches_nothing(client, term):
+    assert search_ids(client, term) == []
+    response = client.get("/borrows", params={"search": term})
+    assert response.status_code == 200
+
+def test_search_index_follows_book_writes(client):
+    response = client.post("/api/books/", json={
+        "title": "Zyzzogeton Field Guide", "author": "Quillon Marsh",
+        "isbn": "search-sync-1", "category": "Science"
+    })
+    assert response.status_code == 200, response.text
+    book_id = response.json()["id"]
+    assert search_ids(client, "zyzzog") == [book_id]
+    assert search_ids(client, "quillon marsh") == [book_id]
+
+    response = client.put(f"/api/books/{book_id}", json={"title": "Xerophyte Field Guide"})
+    assert response.status_code == 200, response.text
+    assert search_ids(client, "zyzzogeton") == []
+    assert search_ids(client, "xerophyte") == [book_id]
+    assert search_ids(client, "quillon") == [book_id]
+
+    response = client.delete(f"/api/books/{book_id}")
+    assert response.status_code == 200, response.text
+    assert search_ids(client, "xerophyte") == []
+    assert search_ids(client, "quillon") == []
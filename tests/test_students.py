@@ -0,0 +1,29 @@
+from datetime import datetime
+import models
+
+def overdue_student_ids(db) -> list:
+    """Students with an open loan past its due date, counted from borrow_records"""
+    record = models.BorrowRecord
+    rows = db.query(record.student_id).filter(
+        record.return_date == None, record.due_date < datetime.utcnow()
+    ).distinct().order_by(record.student_id)
+    return [student_id for student_id, in rows]
+
+def test_overdue_filter_statements_do_not_grow_with_limit(app_module, client, db, statements):
+    expected = overdue_student_ids(db)
+    assert len(expected) > 10
+
+    client.get("/api/students/", params={"limit": 1})  # warm up the admin cache
+    counts = []
+    pages = []
+    for limit in (10, 1000):
+        with statements:
+            response = client.get("/api/students/", params={"has_overdue": "true", "limit": limit})
+        assert response.status_code == 200, response.text
+        counts.append(statements.count)
+        pages.append([student["id"] for student in response.json()])
+
+    assert counts[0] == counts[1] <= app_module.list_students.query_budget
+    # The filter runs in SQL, so the first page is full and both pages agree
+    assert pages[0] == expected[:10]
+    assert pages[1] == expected